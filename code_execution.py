@@ -0,0 +1,152 @@
+"""
+Execution-based scoring of generated code.
+
+Lexical overlap with `expected_response` says little about whether a fix
+works, so instructions can carry a `tests` snippet: Python source that
+exercises the code the agent is asked to write and fails with an
+exception (usually an `assert`) if it is wrong. The Python code blocks of
+a response are extracted, the tests are appended, and the script runs in
+a fresh interpreter:
+
+- in isolated mode (`python -I`), with an empty environment, in its own
+  temporary working directory that is deleted afterwards;
+- with CPU time, address space and file size limits (POSIX only) and a
+  wall-clock timeout that kills the whole process group.
+
+This contains runaway loops, memory blow-ups and stray files. It is not a
+security boundary: the code can still reach the network and read files,
+so only score responses from agents you would run code from anyway.
+
+Each run is a separate process that a thread only waits on, so the
+evaluator schedules runs on a thread pool sized to the number of cores.
+"""
+
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_TIMEOUT = 10.0  # seconds of wall-clock time per run
+MEMORY_LIMIT_MB = 512  # address space per run
+FILE_SIZE_LIMIT = 16 * 1024 * 1024  # bytes any single written file may reach
+OUTPUT_TAIL = 2000  # characters of output kept for failed runs
+
+_FENCE = re.compile(r"```[ \t]*([\w+#.-]*)[^\n]*\n(.*?)```", re.DOTALL)
+_PYTHON_TAGS = frozenset({"python", "python3", "py"})
+
+# Applies the limits inside the child before the script starts; setting
+# them here rather than in a preexec_fn keeps Popen safe to call from
+# several threads.
+_BOOTSTRAP = """\
+import runpy, sys
+cpu_seconds, memory, file_size = map(int, sys.argv[1:4])
+try:
+    import resource
+except ImportError:
+    pass
+else:
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (file_size, file_size))
+    if memory:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+sys.argv = sys.argv[4:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+@dataclass
+class ExecutionResult:
+    """Outcome of running a response's code against its tests."""
+
+    # passed, failed, timeout or no_code
+    status: str
+    duration: float = 0.0
+    output: str = ""
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "execution_passed": 1.0 if self.status == "passed" else 0.0,
+            "execution_time": self.duration,
+            "execution_status": self.status,
+        }
+
+
+def extract_code(text: str) -> Optional[str]:
+    """
+    Return the Python code of a response, or None if it has none.
+
+    Fenced blocks tagged as Python are joined in order; if no block is
+    tagged, untagged blocks are used instead.
+    """
+    blocks = [(tag.lower(), body) for tag, body in _FENCE.findall(text)]
+    code = [body for tag, body in blocks if tag in _PYTHON_TAGS]
+    if not code:
+        code = [body for tag, body in blocks if not tag]
+    return "\n\n".join(code) if code else None
+
+
+def run_tests(code: str, tests: str, timeout: float = EXECUTION_TIMEOUT,
+              memory_mb: int = MEMORY_LIMIT_MB) -> ExecutionResult:
+    """Run `code` followed by `tests` in a sandboxed interpreter."""
+    with tempfile.TemporaryDirectory(prefix="eval-exec-") as workdir:
+        script = os.path.join(workdir, "solution.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write(f"{code}\n\n# --- tests ---\n{tests}\n")
+        command = [
+            sys.executable, "-I", "-c", _BOOTSTRAP,
+            str(int(timeout) + 1), str(memory_mb * 1024 * 1024),
+            str(FILE_SIZE_LIMIT), script,
+        ]
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command, cwd=workdir, env={}, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill(process)
+            output, _ = process.communicate()
+            status = "timeout"
+        else:
+            if process.returncode == 0:
+                status = "passed"
+            elif process.returncode == -getattr(signal, "SIGXCPU", 0):
+                status = "timeout"
+            else:
+                status = "failed"
+        duration = time.perf_counter() - start
+
+    text = output.decode("utf-8", errors="replace")
+    return ExecutionResult(status, duration,
+                           "" if status == "passed" else text[-OUTPUT_TAIL:])
+
+
+def _kill(process: subprocess.Popen) -> None:
+    """Kill a timed-out run together with anything it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def score_execution(response: str, tests: str,
+                    timeout: float = EXECUTION_TIMEOUT,
+                    memory_mb: int = MEMORY_LIMIT_MB) -> Dict[str, Any]:
+    """Execution metrics of one response."""
+    code = extract_code(response)
+    if code is None:
+        return ExecutionResult("no_code").metrics()
+    result = run_tests(code, tests, timeout, memory_mb)
+    if result.status != "passed":
+        logger.debug(f"Execution {result.status}:\n{result.output}")
+    return result.metrics()
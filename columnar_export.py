@@ -0,0 +1,270 @@
+"""
+Columnar export of evaluation results for analysis.
+
+Each run is written as one file per agent under a Hive-style layout,
+
+    <root>/run=<run id>/agent=<agent>/part-0.parquet   (or part-0.npz)
+
+with one typed column per field: numeric metrics and timings as float64
+(NaN where a result has no value), flags as bool and text as strings.
+Parquet is written when pyarrow is installed, otherwise an uncompressed
+NumPy `.npz` archive with fixed-width string columns.
+
+Both formats are read memory-mapped: Parquet through pyarrow's memory
+map, and `.npz` members by mapping the arrays stored inside the archive
+directly. `scan` yields the mapped columns partition by partition, so
+reading many runs costs little more than the columns used; `load`
+concatenates them into in-memory arrays. Run ids start with their start
+time, so `since` and `until` select runs by date, e.g.
+`load(root, since="20240401", until="20240701")`.
+"""
+
+import glob
+import importlib.util
+import os
+import struct
+import zipfile
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple)
+
+import numpy as np
+
+# Text columns with few distinct values, dictionary-encoded in Parquet.
+CATEGORICAL = ("instruction_type", "difficulty", "model")
+
+_EXTENSIONS = {"parquet": ".parquet", "npz": ".npz"}
+_LOCAL_HEADER = struct.Struct("<4s22xHH")
+
+
+def default_format() -> str:
+    """"parquet" if pyarrow is installed, "npz" otherwise."""
+    return ("parquet" if importlib.util.find_spec("pyarrow") is not None
+            else "npz")
+
+
+def to_columns(records: Sequence[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Turn flat records into typed columns, in order of first appearance.
+
+    A field is bool if every value is, float64 if every value is a number
+    (missing values become NaN) and a string otherwise (missing values
+    become "").
+    """
+    names = list(dict.fromkeys(name for record in records
+                               for name in record))
+    columns = {}
+    for name in names:
+        values = [record.get(name) for record in records]
+        present = [value for value in values if value is not None]
+        if present and all(isinstance(value, (bool, np.bool_))
+                           for value in present):
+            columns[name] = np.array([bool(value) for value in values])
+        elif all(isinstance(value, (int, float, np.number))
+                 and not isinstance(value, bool) for value in present):
+            columns[name] = np.array(
+                [np.nan if value is None else value for value in values],
+                dtype=np.float64
+            )
+        else:
+            columns[name] = np.array(
+                ["" if value is None else str(value) for value in values],
+                dtype=str
+            )
+    return columns
+
+
+def partition_path(root: str, run_id: str, agent: str, fmt: str) -> str:
+    return os.path.join(root, f"run={run_id}", f"agent={agent}",
+                        f"part-0{_EXTENSIONS[fmt]}")
+
+
+def export_partition(root: str, run_id: str, agent: str,
+                     columns: Dict[str, np.ndarray],
+                     fmt: Optional[str] = None) -> str:
+    """
+    Write the columns of one run and agent, replacing an earlier export,
+    and return the path written.
+
+    Raises:
+        ValueError: If `fmt` is not "parquet", "npz" or None (default).
+    """
+    fmt = fmt or default_format()
+    if fmt not in _EXTENSIONS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    path = partition_path(root, run_id, agent, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if fmt == "parquet":
+        _write_parquet(tmp_path, columns)
+    else:
+        with open(tmp_path, "wb") as f:
+            # Uncompressed, so every member can be memory-mapped.
+            np.savez(f, **columns)
+    os.replace(tmp_path, path)
+    for other in _EXTENSIONS:
+        stale = partition_path(root, run_id, agent, other)
+        if other != fmt and os.path.exists(stale):
+            os.remove(stale)
+    return path
+
+
+def _write_parquet(path: str, columns: Dict[str, np.ndarray]) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrays = {}
+    for name, values in columns.items():
+        array = pa.array(values)
+        if name in CATEGORICAL and values.dtype.kind == "U":
+            array = array.dictionary_encode()
+        arrays[name] = array
+    pq.write_table(pa.table(arrays), path)
+
+
+def partitions(root: str, runs: Optional[Iterable[str]] = None,
+               agents: Optional[Iterable[str]] = None,
+               since: Optional[str] = None, until: Optional[str] = None
+               ) -> List[Tuple[str, str, str]]:
+    """
+    (run id, agent, path) of the exported partitions, oldest run first,
+    optionally restricted to `runs`, `agents` and run ids in
+    [`since`, `until`).
+    """
+    runs = set(runs) if runs is not None else None
+    agents = set(agents) if agents is not None else None
+    found = {}
+    for path in glob.glob(os.path.join(root, "run=*", "agent=*", "part-0.*")):
+        run_dir, agent_dir = path.split(os.sep)[-3:-1]
+        run_id, agent = run_dir[len("run="):], agent_dir[len("agent="):]
+        if ((runs is not None and run_id not in runs)
+                or (agents is not None and agent not in agents)
+                or (since is not None and run_id < since)
+                or (until is not None and run_id >= until)
+                or os.path.splitext(path)[1] not in _EXTENSIONS.values()):
+            continue
+        found[(run_id, agent)] = path
+    return [(run_id, agent, path)
+            for (run_id, agent), path in sorted(found.items())]
+
+
+def read_partition(path: str, columns: Optional[Sequence[str]] = None
+                   ) -> Dict[str, np.ndarray]:
+    """Memory-map the columns of one exported partition."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns, memory_map=True)
+        return {name: table.column(name).to_numpy()
+                for name in table.column_names}
+    return _map_npz(path, columns)
+
+
+def _map_npz(path: str, columns: Optional[Sequence[str]] = None
+             ) -> Dict[str, np.ndarray]:
+    """
+    Memory-map the arrays of an uncompressed `.npz` archive.
+
+    `np.load` ignores `mmap_mode` for archives, so each member's offset is
+    found from its zip header and its `.npy` header instead.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if columns is not None and name not in columns:
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            f.seek(info.header_offset)
+            _, name_length, extra_length = _LOCAL_HEADER.unpack(
+                f.read(_LOCAL_HEADER.size)
+            )
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if not np.prod(shape, dtype=np.int64):
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r",
+                                     offset=f.tell(), shape=shape,
+                                     order="F" if fortran else "C")
+    return arrays
+
+
+def _missing(values: np.ndarray, size: int) -> np.ndarray:
+    """
+    A column of `size` missing values of the same kind as `values`: NaN,
+    "" or, for bool columns, which have no missing value, False.
+    """
+    if values.dtype.kind == "f":
+        return np.full(size, np.nan)
+    if values.dtype.kind == "b":
+        return np.zeros(size, dtype=bool)
+    return np.full(size, "", dtype=values.dtype if values.dtype.kind == "U"
+                   else object)
+
+
+def num_rows(path: str) -> int:
+    """The number of rows of an exported partition, from its metadata."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        return pq.read_metadata(path).num_rows
+    # Mapping the members only reads their headers.
+    arrays = _map_npz(path)
+    return len(next(iter(arrays.values()))) if arrays else 0
+
+
+def scan(root: str, columns: Optional[Sequence[str]] = None,
+         runs: Optional[Iterable[str]] = None,
+         agents: Optional[Iterable[str]] = None,
+         since: Optional[str] = None, until: Optional[str] = None
+         ) -> Iterator[Tuple[str, str, Dict[str, np.ndarray]]]:
+    """
+    Yield (run id, agent, columns) for the selected partitions (see
+    `partitions`), with the requested `columns` (default: all) of each
+    memory-mapped. Columns a partition lacks are left out.
+    """
+    for run_id, agent, path in partitions(root, runs, agents, since, until):
+        yield run_id, agent, read_partition(path, columns)
+
+
+def load(root: str, columns: Optional[Sequence[str]] = None,
+         runs: Optional[Iterable[str]] = None,
+         agents: Optional[Iterable[str]] = None,
+         since: Optional[str] = None, until: Optional[str] = None
+         ) -> Dict[str, np.ndarray]:
+    """
+    Concatenate the selected partitions (see `partitions`) into one set of
+    columns with added "run_id" and "agent" columns. Only the requested
+    `columns` (default: all) are read; a column missing from a partition
+    is filled with missing values: NaN for numbers and "" for text. Flags
+    have no missing value, so a flag missing from a partition reads as
+    False; check its presence per partition with `scan` if that matters.
+
+    The result is copied into memory; use `scan` to work on the
+    memory-mapped columns of each partition instead.
+    """
+    parts = []
+    for run_id, agent, path in partitions(root, runs, agents, since, until):
+        part = read_partition(path, columns)
+        size = num_rows(path)
+        part["run_id"] = np.full(size, run_id)
+        part["agent"] = np.full(size, agent)
+        parts.append(part)
+
+    names = list(dict.fromkeys(name for part in parts for name in part))
+    loaded = {}
+    for name in names:
+        sample = next(part[name] for part in parts if name in part)
+        loaded[name] = np.concatenate([
+            part[name] if name in part
+            else _missing(sample, len(part["run_id"]))
+            for part in parts
+        ])
+    return loaded
@@ -6,23 +6,39 @@ using a set of predefined instructions. It collects responses, calculates
 metrics, and generates a comparison report with visualizations.
 """
 
+import argparse
+import asyncio
+import hashlib
+import importlib.util
 import json
 import os
+import re
+import sqlite3
 import sys
 import time
 import logging
-from typing import Dict, List, Any, Optional, Tuple
-
-import requests
-import pandas as pd
-import numpy as np
+from concurrent.futures import (Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import httpx
 from datetime import datetime
 from dotenv import load_dotenv
 from tqdm import tqdm
-import matplotlib.pyplot as plt
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from rouge import Rouge
-import seaborn as sns
+
+# pandas, matplotlib, seaborn and the scoring modules are imported where
+# they are used, so runs that skip them do not pay for loading them.
+from http_cassette import Cassette, RecordingTransport, ReplayTransport
+from latency_histogram import LatencyHistogram
+import metric_registry
+from response_cache import CACHE_MODES, ResponseCache
+from result_store import ResultStore
+from result_table import ResultTable
+from result_log import (ResultLog, fold_results, new_run_id, read_records,
+                        run_log_path)
 
 # Load environment variables from .env before anything else
 load_dotenv()
@@ -45,6 +61,9 @@ CONFIG = {
     "agent_v1_endpoint": os.getenv("AGENT_V1_ENDPOINT"),
     "agent_v2_endpoint": os.getenv("AGENT_V2_ENDPOINT"),
     "agent_v2_model": os.getenv("AGENT_V2_MODEL"),
+    "agent_v2_chat_url": os.getenv(
+        "AGENT_V2_CHAT_URL", "https://api.groq.com/openai/v1/chat/completions"
+    ),
     "api_key_v1": os.getenv("AGENT_V1_API_KEY"),
     "api_key_v2": os.getenv("AGENT_V2_API_KEY"),
     "instructions_file": "instructions.json",
@@ -52,8 +71,380 @@ CONFIG = {
     "timeout": 60,  # 秒
     "max_retries": 3,  # リトライ回数
     "retry_delay": 5,  # リトライ間隔（秒）
+    # 同時実行数（1 の場合は従来どおり逐次実行）
+    "concurrency": int(os.getenv("EVAL_CONCURRENCY", "1")),
+    # エージェントごとのHTTPコネクションプール設定
+    "pool_max_connections": int(os.getenv("EVAL_POOL_MAX_CONNECTIONS", "10")),
+    "pool_max_keepalive": int(os.getenv("EVAL_POOL_MAX_KEEPALIVE", "10")),
+    "keepalive_expiry": 30.0,  # 秒
+    # プロバイダーごとの初期レート上限（1分あたりのリクエスト数、未設定なら無制限）
+    # 実際の許容量はレスポンスのレート制限ヘッダーから随時更新される
+    "agent_v1_rpm": float(os.getenv("AGENT_V1_RPM", "0")) or None,
+    "agent_v2_rpm": float(os.getenv("AGENT_V2_RPM", "0")) or None,
+    "rate_limit_burst": 1,  # 連続送信を許可するリクエスト数
+    # 致命的エラー（認証失敗など）が出たエージェントを以降スキップするか
+    "abort_on_fatal": (
+        os.getenv("EVAL_ABORT_ON_FATAL", "false").lower() == "true"
+    ),
+    # レスポンスキャッシュ（read / write / off）
+    "cache_mode": os.getenv("EVAL_CACHE", "off"),
+    "cache_dir": os.path.join("results", "cache"),
+    "cache_max_bytes": 256 * 1024 * 1024,  # バイト
+    "cache_ttl": 7 * 24 * 3600,  # 秒
+    # HTTP通信の記録・再生（record / replay / off）
+    "cassette_mode": "off",
+    "cassette_file": os.path.join("results", "cassette.jsonl"),
+    "replay_latency_scale": 1.0,  # 再生時の遅延倍率（0 = 待ちなし）
+    # ストリーミング（SSE）でレスポンスを受信し、初回トークンまでの時間などを計測
+    "stream": os.getenv("EVAL_STREAM", "false").lower() == "true",
+    # 指標の計算に使うプロセス数（1 = プロセスプールを使わずインラインで計算）
+    "scoring_workers": int(os.getenv("EVAL_SCORING_WORKERS", "1")),
+    "rescore_file": None,  # 保存済みの応答から指標を再計算する結果ファイル
+    # 期待される応答の解析結果（未設定なら instructions.json の隣）
+    "expected_index_file": None,
+    # 計算する品質指標（カンマ区切り、"none" なら応答時間と成功率のみ）
+    "metrics": os.getenv("EVAL_METRICS", "default"),
+    # "execution" 指標: テストを実行するサンドボックスの同時実行数と制限
+    "execution_workers": int(
+        os.getenv("EVAL_EXECUTION_WORKERS", str(os.cpu_count() or 1))
+    ),
+    "execution_timeout": 10.0,  # 秒
+    "execution_memory_mb": 512,
+    # この推定Jaccard類似度以上の応答をほぼ重複とみなす（MinHash/LSH）
+    "duplicate_threshold": 0.8,
+    # 結果ログ（1ペアごとに1行追記、fsyncはまとめて実行）
+    "log_sync_every": 64,  # 件
+    "log_sync_interval": 1.0,  # 秒
+    "snapshot_log": None,  # 結果ログからJSON/CSV/レポートだけを再生成する
+    # 中断したランのID（"latest" で直近）。成功済みのペアは再実行しない
+    "resume_run": None,
+    # 全ランの結果を蓄積するSQLiteデータベース（未設定なら results_dir 内）と、
+    # レポートで比較する直近のラン数
+    "results_db": None,
+    "history_runs": 20,
+    # 列指向エクスポート（auto: pyarrowがあればParquet、なければ.npz / off）
+    "export_format": os.getenv("EVAL_EXPORT_FORMAT", "auto"),
+    "export_dir": None,  # 未設定なら results_dir/columnar
 }
 
+AGENT_VERSIONS = ("v1", "v2")
+# Formats of the columnar export; "auto" picks Parquet if pyarrow is installed.
+EXPORT_FORMATS = ("auto", "parquet", "npz", "off")
+# Percentiles reported for response_time (SLOs are written on p95).
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+# Status codes worth retrying; every other 4xx is a fatal request error.
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429})
+
+
+class ResponseSchemaError(ValueError):
+    """Raised when a provider response does not have the expected shape."""
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Classify an agent call failure.
+
+    Timeouts, dropped connections, 408/425/429 and 5xx responses are
+    transient and worth retrying. Other 4xx responses (bad key, bad model,
+    invalid payload) and response schema mismatches will fail the same way
+    on every attempt.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    return isinstance(error, (
+        httpx.TimeoutException, httpx.NetworkError,
+        httpx.RemoteProtocolError,
+    ))
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate-limit duration into seconds.
+
+    Accepts plain seconds ("7", "0.5") and the Go-style durations Groq and
+    Gemini use ("2m59.56s", "37s", "120ms").
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a `Retry-After` header (seconds or HTTP date) into seconds."""
+    seconds = _parse_duration(value)
+    if seconds is not None or value is None:
+        return seconds
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """
+    Token bucket pacing the calls made to one provider.
+
+    The bucket starts from an optional configured rate and is re-tuned from
+    the `Retry-After` and `x-ratelimit-*` headers of every response, so the
+    harness sends at the provider's actual allowance instead of hitting 429
+    and sleeping. A rate of None means unlimited until the provider says
+    otherwise.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 burst: int = 1):
+        self.rate = requests_per_minute / 60 if requests_per_minute else None
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self._last_refill = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            elapsed = now - self._last_refill
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def reserve(self) -> float:
+        """Take one token and return the seconds to wait before sending."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate is not None:
+            # Tokens may go negative: each waiter queues behind the others.
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def delay(self) -> float:
+        """Return the seconds until the provider allows calls again."""
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def block_for(self, seconds: float) -> None:
+        """Hold back every call for at least `seconds`."""
+        self.blocked_until = max(
+            self.blocked_until, time.monotonic() + seconds
+        )
+
+    def update_from_response(self, response: httpx.Response) -> None:
+        """Re-tune the bucket from the rate-limit headers of a response."""
+        headers = response.headers
+        retry_after = _parse_retry_after(headers.get("retry-after"))
+        if retry_after is None and response.status_code == 429:
+            retry_after = self._gemini_retry_delay(response)
+        if retry_after is not None:
+            self.block_for(retry_after)
+
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is None or reset is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if remaining <= 0:
+                self.block_for(reset)
+            elif kind == "requests":
+                # Spread the remaining allowance evenly until the reset.
+                self._refill(time.monotonic())
+                self.rate = remaining / max(reset, 1e-3)
+
+    @staticmethod
+    def _gemini_retry_delay(response: httpx.Response) -> Optional[float]:
+        """Read the `RetryInfo.retryDelay` Gemini puts in a 429 body."""
+        try:
+            details = response.json()["error"].get("details", [])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        for detail in details:
+            if isinstance(detail, dict) and "retryDelay" in detail:
+                return _parse_duration(detail["retryDelay"])
+        return None
+
+
+def _read_usage(agent_version: str, data: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Return the prompt/completion token counts reported by a provider.
+
+    Groq reports `usage` (inside `x_groq` on streamed chunks) and Gemini
+    `usageMetadata`; counts the provider did not report are left out.
+    """
+    if agent_version == "v2":
+        usage = data.get("usage") or (data.get("x_groq") or {}).get("usage")
+        names = (("prompt_tokens", "prompt_tokens"),
+                 ("completion_tokens", "completion_tokens"))
+    else:
+        usage = data.get("usageMetadata")
+        names = (("prompt_tokens", "promptTokenCount"),
+                 ("completion_tokens", "candidatesTokenCount"))
+    if not isinstance(usage, dict):
+        return {}
+    return {
+        name: usage[field_name] for name, field_name in names
+        if isinstance(usage.get(field_name), int)
+    }
+
+
+@dataclass
+class AgentResponse:
+    """Outcome of one agent call."""
+
+    text: Optional[str] = None
+    error: Optional[str] = None
+    # Extra per-call metrics, e.g. streaming latencies.
+    metrics: Dict[str, float] = field(default_factory=dict)
+    # Attempt count, per-attempt phase timings and time spent waiting.
+    timings: Dict[str, Any] = field(default_factory=dict)
+
+
+class RequestTrace:
+    """
+    Time the phases of one HTTP attempt from httpcore trace events.
+
+    Pass `record` (sync clients) or `arecord` (async clients) as the
+    `trace` request extension. DNS resolution happens inside the TCP
+    connect and is reported as part of `connect`; `connect` and `tls` are
+    absent when a pooled connection is reused, and all network phases are
+    absent for transports that do not emit trace events.
+    """
+
+    # phase -> (event it starts at, event it ends at)
+    PHASES = {
+        "connect": ("connect_tcp.started", "connect_tcp.complete"),
+        "tls": ("start_tls.started", "start_tls.complete"),
+        "send": ("send_request_headers.started",
+                 "send_request_body.complete"),
+        "ttfb": ("send_request_body.complete",
+                 "receive_response_headers.complete"),
+        "download": ("receive_response_headers.complete",
+                     "receive_response_body.complete"),
+    }
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.marks: Dict[str, float] = {}
+
+    def record(self, event_name: str, info: Dict[str, Any]) -> None:
+        # Drop the "connection."/"http11."/"http2." prefix.
+        event = event_name.split(".", 1)[-1]
+        now = time.perf_counter()
+        if event.endswith(".started"):
+            self.marks.setdefault(event, now)
+        else:
+            self.marks[event] = now
+
+    async def arecord(self, event_name: str, info: Dict[str, Any]) -> None:
+        self.record(event_name, info)
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def phases(self) -> Dict[str, float]:
+        """Return the duration in seconds of each observed phase."""
+        self.finish()
+        phases = {"total": self.end - self.start}
+        if self.marks:
+            # Time before the first network event: pool wait and overhead.
+            phases["pool"] = min(self.marks.values()) - self.start
+        for phase, (begin, end) in self.PHASES.items():
+            if begin in self.marks and end in self.marks:
+                phases[phase] = self.marks[end] - self.marks[begin]
+        return phases
+
+
+class StreamAccumulator:
+    """
+    Collect the SSE events of a streamed response and time its tokens.
+
+    Lines are fed as they arrive, so the recorded timestamps reflect when
+    each chunk reached the client.
+    """
+
+    def __init__(self, agent_version: str, start: float):
+        self.agent_version = agent_version
+        self.start = start
+        self.parts: List[str] = []
+        self.chunk_times: List[float] = []
+        self.usage: Dict[str, int] = {}
+
+    def feed(self, line: str) -> None:
+        """Consume one line of the event stream."""
+        if not line.startswith("data:"):
+            return
+        data = line[len("data:"):].strip()
+        if not data or data == "[DONE]":
+            return
+        try:
+            chunk = json.loads(data)
+            text = self._chunk_text(chunk)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise ResponseSchemaError(
+                f"Unexpected {self.agent_version} stream chunk: {e!r}"
+            ) from e
+        self.usage.update(_read_usage(self.agent_version, chunk))
+        if text:
+            self.parts.append(text)
+            self.chunk_times.append(time.perf_counter())
+
+    def _chunk_text(self, chunk: Dict[str, Any]) -> Optional[str]:
+        if self.agent_version == "v2":
+            choices = chunk["choices"]
+            return choices[0].get("delta", {}).get("content") if choices else None
+        candidate = chunk["candidates"][0]
+        parts = candidate.get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    def _inter_token_latency(self, output_tokens: int) -> float:
+        """
+        Return the mean time per token after the first chunk.
+
+        A chunk can carry many tokens (Gemini sends whole sentences), so
+        the time from the first to the last chunk is spread over the
+        tokens that followed the first chunk rather than over the chunk
+        gaps. Those tokens are estimated from the first chunk's share of
+        the text.
+        """
+        chars = sum(len(part) for part in self.parts)
+        later_tokens = output_tokens * (1 - len(self.parts[0]) / chars)
+        if len(self.chunk_times) < 2 or later_tokens <= 0:
+            return 0.0
+        return (self.chunk_times[-1] - self.chunk_times[0]) / later_tokens
+
+    def finish(self) -> AgentResponse:
+        """Return the assembled text with its streaming latency metrics."""
+        if not self.parts:
+            raise ResponseSchemaError(
+                f"{self.agent_version} stream ended without any content"
+            )
+        end = time.perf_counter()
+        # Without a usage block, count one token per streamed chunk.
+        output_tokens = self.usage.get("completion_tokens", len(self.parts))
+        total = end - self.start
+        return AgentResponse(text="".join(self.parts), metrics=dict(
+            self.usage,
+            time_to_first_token=self.chunk_times[0] - self.start,
+            inter_token_latency=self._inter_token_latency(output_tokens),
+            output_tokens_per_second=output_tokens / total if total > 0
+            else 0.0,
+        ))
+
 
 class AgentEvaluator:
     def __init__(self, config: Dict[str, Any]):
@@ -61,23 +452,89 @@ class AgentEvaluator:
         self.config = config
         self._validate_config()
         self.instructions = self._load_instructions()
-        self.results = []
+        self.metrics = metric_registry.parse_metrics(
+            self.config.get("metrics", "default")
+        )
+        # Metrics scored against expected_response, and the test runner of
+        # the "execution" metric; both fail here, before any API call, if
+        # they cannot be loaded.
+        self.text_metrics = metric_registry.with_reference(self.metrics)
+        metric_registry.load_scorers(self.text_metrics)
+        self._run_tests = (
+            metric_registry.METRICS["execution"].load()
+            if "execution" in self.metrics else None
+        )
+        self.expected_index = None
+        if self.text_metrics:
+            from expected_index import ExpectedResponseIndex
+
+            # 期待される応答の解析結果（instructions.jsonの隣に保存）
+            self.expected_index = ExpectedResponseIndex.for_instructions(
+                self.config["instructions_file"], self.instructions,
+                self.config.get("expected_index_file")
+            )
+        # One row per evaluated instruction, held column by column; the
+        # result dicts are rebuilt from it only to be written out.
+        self.table = ResultTable(self._summarize_timings)
+        # Identifies the run in its log, saved results and across-run
+        # comparisons; a resumed run takes both from its log.
+        self.run_id = new_run_id()
+        self.run_timestamp = datetime.now().isoformat()
+        # (instruction id, agent) -> successful result of a resumed run
+        self._checkpoint: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        if self.config.get("resume_run"):
+            self._load_checkpoint(self.config["resume_run"])
         self._setup_directories()
-        self.rouge = Rouge()  # ROUGEスコア計算用
+        self.cassette = Cassette(
+            self.config["cassette_file"], self.config["cassette_mode"]
+        )
+        self.clients = {
+            version: self._create_client() for version in AGENT_VERSIONS
+        }
+        self.aborted_agents: Dict[str, str] = {}
+        self._scoring_pool: Optional[ProcessPoolExecutor] = None
+        self._execution_pool: Optional[ThreadPoolExecutor] = None
+        # (future, metrics dict to update, (instruction id, agent))
+        self._pending_scores: List[
+            Tuple[Future, Dict[str, Any], Tuple[str, str]]
+        ] = []
+        self.result_log: Optional[ResultLog] = None
+        self.cache = ResponseCache(
+            self.config["cache_dir"],
+            mode=self.config["cache_mode"],
+            max_bytes=self.config["cache_max_bytes"],
+            ttl=self.config["cache_ttl"],
+        )
+        self._v2_model: Optional[str] = None
+        self.rate_limiters = {
+            version: RateLimiter(
+                self.config.get(f"agent_{version}_rpm"),
+                self.config.get("rate_limit_burst", 1),
+            )
+            for version in AGENT_VERSIONS
+        }
 
-        # Download required NLTK data
-        try:
-            import nltk
-            nltk.download('punkt', quiet=True)
-        except Exception as e:
-            logger.warning(f"Failed to download NLTK data: {e}")
+    def __enter__(self) -> "AgentEvaluator":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the pooled HTTP clients of every agent."""
+        for client in self.clients.values():
+            client.close()
+        self.cassette.close()
 
     def _validate_config(self) -> None:
         """Validate the configuration."""
-        required_vars = [
-            "agent_v1_endpoint", "agent_v2_endpoint",
-            "api_key_v1", "api_key_v2"
-        ]
+        required_vars = ["agent_v1_endpoint", "agent_v2_endpoint"]
+        # Replayed cassettes are redacted, and rescoring and snapshots make
+        # no calls, so no credentials are needed for any of them.
+        if (self.config.get("cassette_mode") != "replay"
+                and not self.config.get("rescore_file")
+                and not self.config.get("snapshot_log")):
+            required_vars += ["api_key_v1", "api_key_v2"]
 
         missing_vars = [
             var for var in required_vars if not self.config.get(var)
@@ -89,6 +546,7 @@ class AgentEvaluator:
                 "Please set these in your .env file or environment variables."
             )
             raise ValueError(msg)
+        _check_export_format(self.config.get("export_format", "auto"))
 
     def _load_instructions(self) -> List[Dict[str, Any]]:
         """Load instructions from the JSON file."""
@@ -124,39 +582,101 @@ class AgentEvaluator:
             sanitized_config["api_key_v2"] = "***REDACTED***"
         return sanitized_config
 
-    def _call_agent_with_retry(
+    def _client_limits(self, min_connections: int = 1) -> httpx.Limits:
+        """Connection pool limits shared by the sync and async clients."""
+        return httpx.Limits(
+            max_connections=max(
+                self.config["pool_max_connections"], min_connections
+            ),
+            max_keepalive_connections=self.config["pool_max_keepalive"],
+            keepalive_expiry=self.config["keepalive_expiry"],
+        )
+
+    def _create_transport(self, limits: httpx.Limits, use_async: bool):
+        """Create the transport for a client, honouring the cassette mode."""
+        if self.cassette.mode == "replay":
+            return ReplayTransport(
+                self.cassette, self.config["replay_latency_scale"]
+            )
+        transport_class = (
+            httpx.AsyncHTTPTransport if use_async else httpx.HTTPTransport
+        )
+        transport = transport_class(limits=limits)
+        if self.cassette.mode == "record":
+            return RecordingTransport(transport, self.cassette)
+        return transport
+
+    def _create_client(self) -> httpx.Client:
+        """Create a pooled, keep-alive HTTP client for one agent."""
+        transport = self._create_transport(
+            self._client_limits(), use_async=False
+        )
+        return httpx.Client(
+            transport=transport, timeout=self.config["timeout"]
+        )
+
+    def _create_async_client(self) -> httpx.AsyncClient:
+        """
+        Create a pooled, keep-alive async HTTP client for one agent.
+
+        Async clients are bound to the running event loop, so they are
+        created per concurrent run rather than in `__init__`.
+        """
+        # A concurrent run needs at least one connection per in-flight call.
+        limits = self._client_limits(self.config["concurrency"])
+        transport = self._create_transport(limits, use_async=True)
+        return httpx.AsyncClient(
+            transport=transport, timeout=self.config["timeout"]
+        )
+
+    def _resolve_v2_model(self) -> str:
+        """Return the v2 model name, resolving it once per evaluator."""
+        if self._v2_model:
+            return self._v2_model
+
+        model_name = self.config.get("agent_v2_model")
+        if not model_name:
+            endpoint = self.config["agent_v2_endpoint"]
+            url_parts = endpoint.split('/')
+            if len(url_parts) > 7 and url_parts[6] == 'completions':
+                model_name = '/'.join(url_parts[7:])
+                logger.info(
+                    "AGENT_V2_MODEL not set, parsed model "
+                    f"'{model_name}' from endpoint URL."
+                )
+            else:
+                model_name = 'llama3-8b-8192'  # Fallback
+                logger.warning(
+                    "AGENT_V2_MODEL not set and couldn't parse from URL. "
+                    f"Using default model: {model_name}"
+                )
+        self._v2_model = model_name
+        return model_name
+
+    def _model_name(self, agent_version: str) -> str:
+        """Return the model an agent runs, for bookkeeping purposes."""
+        if agent_version == "v2":
+            return self._resolve_v2_model()
+        # Gemini endpoints look like .../models/<model>:generateContent
+        endpoint = self.config["agent_v1_endpoint"]
+        match = re.search(r"models/([^:/?]+)", endpoint)
+        return match.group(1) if match else endpoint.split("?")[0]
+
+    def _build_request(
             self, agent_version: str, instruction_text: str
-    ) -> Tuple[Optional[str], Optional[str]]:
+    ) -> Tuple[str, Dict[str, str], Optional[Dict[str, str]], Dict[str, Any]]:
         """
-        Make API call with retry mechanism.
+        Build the provider-specific request for an agent.
 
         Returns:
-            A tuple of (response_text, error_message).
+            A tuple of (endpoint, headers, params, payload).
         """
         api_key = self.config[f"api_key_{agent_version}"]
-        headers = {}
-        params = {}
-        payload = {}
         endpoint = self.config[f"agent_{agent_version}_endpoint"]
 
         if agent_version == 'v2':
-            model_name = self.config.get("agent_v2_model")
-            if not model_name:
-                url_parts = endpoint.split('/')
-                if len(url_parts) > 7 and url_parts[6] == 'completions':
-                    model_name = '/'.join(url_parts[7:])
-                    logger.info(
-                        "AGENT_V2_MODEL not set, parsed model "
-                        f"'{model_name}' from endpoint URL."
-                    )
-                else:
-                    model_name = 'llama3-8b-8192'  # Fallback
-                    logger.warning(
-                        "AGENT_V2_MODEL not set and couldn't parse from URL. "
-                        f"Using default model: {model_name}"
-                    )
-
-            endpoint = "https://api.groq.com/openai/v1/chat/completions"
+            model_name = self._resolve_v2_model()
+            endpoint = self.config["agent_v2_chat_url"]
             headers = {
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
@@ -165,50 +685,202 @@ class AgentEvaluator:
                 "messages": [{"role": "user", "content": instruction_text}],
                 "model": model_name
             }
+            if self.config.get("stream"):
+                payload["stream"] = True
             params = None
         else:  # agent_version == 'v1'
             headers = {"Content-Type": "application/json"}
             params = {'key': api_key}
             payload = {"contents": [{"parts": [{"text": instruction_text}]}]}
+            if self.config.get("stream"):
+                endpoint = endpoint.replace(
+                    ":generateContent", ":streamGenerateContent"
+                )
+                params["alt"] = "sse"
+
+        return endpoint, headers, params, payload
+
+    @staticmethod
+    def _parse_response(agent_version: str,
+                        response: httpx.Response) -> AgentResponse:
+        """Extract the generated text and token usage from a response."""
+        try:
+            data = response.json()
+            if agent_version == 'v2':
+                text = data['choices'][0]['message']['content']
+            else:  # agent_version == 'v1'
+                text = data["candidates"][0]["content"]["parts"][0]["text"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise ResponseSchemaError(
+                f"Unexpected {agent_version} response schema: {e!r}"
+            ) from e
+        return AgentResponse(text=text,
+                             metrics=_read_usage(agent_version, data))
+
+    def _log_request(self, agent_version: str, attempt: int, endpoint: str,
+                     headers: Dict[str, str], params: Optional[Dict[str, str]],
+                     payload: Dict[str, Any]) -> None:
+        """Log the details of an outgoing API request at debug level."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug(f"--- API Request Details (Attempt {attempt + 1}) ---")
+        logger.debug(f"Agent: {agent_version}, URL: {endpoint}")
+        logger.debug(f"Headers: {headers}")
+        logger.debug(f"Params: {params}")
+        payload_str = json.dumps(payload, indent=2, ensure_ascii=False)
+        logger.debug(f"Payload: {payload_str}")
+
+    def _retry_wait(self, agent_version: str, attempt: int,
+                    error: httpx.HTTPError) -> float:
+        """
+        Return how long to wait before retrying a failed attempt.
+
+        A 429 waits exactly as long as the provider asked for; everything
+        else falls back to exponential backoff.
+        """
+        backoff = self.config["retry_delay"] * (2 ** attempt)
+        if (isinstance(error, httpx.HTTPStatusError)
+                and error.response.status_code == 429):
+            limiter = self.rate_limiters[agent_version]
+            if limiter.delay() > 0:
+                return limiter.delay()
+            # No allowance information: pause every call to this agent.
+            limiter.block_for(backoff)
+        return backoff
+
+    def _fail_fast(self, agent_version: str, attempt: int,
+                   error: Exception) -> str:
+        """Record a non-retryable failure and return its error message."""
+        error_message = (
+            f"Fatal error on attempt {attempt + 1}, not retried: {error}"
+        )
+        logger.error(f"Error with {agent_version}: {error_message}")
+        if self.config.get("abort_on_fatal"):
+            self.aborted_agents.setdefault(agent_version, str(error))
+            logger.error(
+                f"Aborting {agent_version} for the rest of the run."
+            )
+        return error_message
+
+    def _aborted_error(self, agent_version: str) -> Optional[str]:
+        """Return an error message if the agent was aborted earlier."""
+        reason = self.aborted_agents.get(agent_version)
+        if reason is None:
+            return None
+        return f"Agent {agent_version} aborted after fatal error: {reason}"
+
+    def _check_response(self, agent_version: str,
+                        response: httpx.Response) -> None:
+        """Feed the rate limiter and raise for HTTP error statuses."""
+        self.rate_limiters[agent_version].update_from_response(response)
+        response.raise_for_status()
+
+    def _send(self, agent_version: str,
+              request: Tuple[str, Dict[str, str], Optional[Dict[str, str]],
+                             Dict[str, Any]],
+              trace: RequestTrace) -> AgentResponse:
+        """Send one attempt of a request and parse the response."""
+        endpoint, headers, params, payload = request
+        client = self.clients[agent_version]
+        if not self.config.get("stream"):
+            response = client.post(
+                endpoint,
+                headers=headers,
+                json=payload,
+                timeout=self.config["timeout"],
+                params=params,
+                extensions={"trace": trace.record}
+            )
+            self._check_response(agent_version, response)
+            return self._parse_response(agent_version, response)
+
+        accumulator = StreamAccumulator(agent_version, time.perf_counter())
+        with client.stream(
+                "POST", endpoint, headers=headers, json=payload,
+                timeout=self.config["timeout"], params=params,
+                extensions={"trace": trace.record}) as response:
+            if response.is_error:
+                response.read()
+            self._check_response(agent_version, response)
+            for line in response.iter_lines():
+                accumulator.feed(line)
+        return accumulator.finish()
+
+    async def _asend(
+            self, client: httpx.AsyncClient, agent_version: str,
+            request: Tuple[str, Dict[str, str], Optional[Dict[str, str]],
+                           Dict[str, Any]],
+            trace: RequestTrace
+    ) -> AgentResponse:
+        """Async counterpart of `_send`."""
+        endpoint, headers, params, payload = request
+        if not self.config.get("stream"):
+            response = await client.post(
+                endpoint,
+                headers=headers,
+                json=payload,
+                timeout=self.config["timeout"],
+                params=params,
+                extensions={"trace": trace.arecord}
+            )
+            self._check_response(agent_version, response)
+            return self._parse_response(agent_version, response)
+
+        accumulator = StreamAccumulator(agent_version, time.perf_counter())
+        async with client.stream(
+                "POST", endpoint, headers=headers, json=payload,
+                timeout=self.config["timeout"], params=params,
+                extensions={"trace": trace.arecord}) as response:
+            if response.is_error:
+                await response.aread()
+            self._check_response(agent_version, response)
+            async for line in response.aiter_lines():
+                accumulator.feed(line)
+        return accumulator.finish()
 
+    def _call_agent_with_retry(
+            self, agent_version: str, instruction_text: str
+    ) -> AgentResponse:
+        """Make API call with retry mechanism."""
+        aborted = self._aborted_error(agent_version)
+        if aborted:
+            return AgentResponse(error=aborted)
+
+        request = self._build_request(agent_version, instruction_text)
+
+        limiter = self.rate_limiters[agent_version]
         last_error = None
+        # Rate limiter and backoff sleeps are kept apart from the attempts.
+        timings = {"attempts": 0, "wait": 0.0, "phases": []}
         for attempt in range(self.config["max_retries"]):
+            delay = limiter.reserve()
+            timings["wait"] += delay
+            time.sleep(delay)
+            timings["attempts"] += 1
+            self._log_request(agent_version, attempt, *request)
+            trace = RequestTrace()
             try:
-                logger.debug(
-                    f"--- API Request Details (Attempt {attempt + 1}) ---"
-                )
-                logger.debug(f"Agent: {agent_version}, URL: {endpoint}")
-                logger.debug(f"Headers: {headers}")
-                logger.debug(f"Params: {params}")
-                payload_str = json.dumps(payload, indent=2, ensure_ascii=False)
-                logger.debug(f"Payload: {payload_str}")
-
-                response = requests.post(
-                    endpoint,
-                    headers=headers,
-                    json=payload,
-                    timeout=self.config["timeout"],
-                    params=params
-                )
-                response.raise_for_status()
-
-                if agent_version == 'v2':
-                    content = response.json()['choices'][0]['message']['content']
-                    return content, None
-                else:  # agent_version == 'v1'
-                    content = (
-                        response.json()["candidates"][0]["content"]
-                        ["parts"][0]["text"]
-                    )
-                    return content, None
+                response = self._send(agent_version, request, trace)
+                timings["phases"].append(trace.phases())
+                response.timings = timings
+                return response
 
-            except requests.exceptions.RequestException as e:
+            except (httpx.HTTPError, ResponseSchemaError) as e:
+                timings["phases"].append(trace.phases())
                 last_error = e
-                wait_time = self.config["retry_delay"] * (2 ** attempt)
+                if not _is_retryable(e):
+                    return AgentResponse(
+                        error=self._fail_fast(agent_version, attempt, e),
+                        timings=timings
+                    )
+                if attempt + 1 == self.config["max_retries"]:
+                    break
+                wait_time = self._retry_wait(agent_version, attempt, e)
                 logger.warning(
                     f"Attempt {attempt + 1} failed for {agent_version}. "
-                    f"Retrying in {wait_time} seconds... Error: {e}"
+                    f"Retrying in {wait_time:.1f} seconds... Error: {e}"
                 )
+                timings["wait"] += wait_time
                 time.sleep(wait_time)
 
         error_message = (
@@ -216,68 +888,303 @@ class AgentEvaluator:
             f"{str(last_error)}"
         )
         logger.error(f"Error with {agent_version}: {error_message}")
-        return None, error_message
-
-    def _calculate_metrics(
-            self, response: str, expected: str,
-            response_tokens: list, expected_tokens: list,
-            response_lower_words: set, expected_lower_words: set
-    ) -> Dict[str, float]:
-        """
-        Calculate evaluation metrics for the response.
-        This method is optimized to accept pre-tokenized inputs
-        to avoid redundant text processing in a loop.
-        """
-        metrics = {
-            "response_length": len(response),
-            "expected_length": len(expected),
-            "length_ratio": len(response) / max(len(expected), 1),
-        }
+        return AgentResponse(error=error_message, timings=timings)
 
-        intersection = len(response_lower_words.intersection(expected_lower_words))
-        union = len(response_lower_words.union(expected_lower_words))
-        metrics["jaccard_similarity"] = intersection / union if union > 0 else 0
+    async def _acall_agent_with_retry(
+            self, client: httpx.AsyncClient, agent_version: str,
+            instruction_text: str
+    ) -> AgentResponse:
+        """Async counterpart of `_call_agent_with_retry` built on httpx."""
+        aborted = self._aborted_error(agent_version)
+        if aborted:
+            return AgentResponse(error=aborted)
 
-        try:
-            smoothie = SmoothingFunction().method4
-            metrics["bleu_score"] = sentence_bleu(
-                [expected_tokens],
-                response_tokens,
-                smoothing_function=smoothie
-            )
-        except Exception as e:
-            logger.warning(f"Error calculating BLEU score: {e}")
-            metrics["bleu_score"] = 0.0
+        request = self._build_request(agent_version, instruction_text)
 
+        limiter = self.rate_limiters[agent_version]
+        last_error = None
+        # Rate limiter and backoff sleeps are kept apart from the attempts.
+        timings = {"attempts": 0, "wait": 0.0, "phases": []}
+        for attempt in range(self.config["max_retries"]):
+            delay = limiter.reserve()
+            timings["wait"] += delay
+            await asyncio.sleep(delay)
+            timings["attempts"] += 1
+            self._log_request(agent_version, attempt, *request)
+            trace = RequestTrace()
+            try:
+                response = await self._asend(
+                    client, agent_version, request, trace
+                )
+                timings["phases"].append(trace.phases())
+                response.timings = timings
+                return response
+
+            except (httpx.HTTPError, ResponseSchemaError) as e:
+                timings["phases"].append(trace.phases())
+                last_error = e
+                if not _is_retryable(e):
+                    return AgentResponse(
+                        error=self._fail_fast(agent_version, attempt, e),
+                        timings=timings
+                    )
+                if attempt + 1 == self.config["max_retries"]:
+                    break
+                wait_time = self._retry_wait(agent_version, attempt, e)
+                logger.warning(
+                    f"Attempt {attempt + 1} failed for {agent_version}. "
+                    f"Retrying in {wait_time:.1f} seconds... Error: {e}"
+                )
+                timings["wait"] += wait_time
+                await asyncio.sleep(wait_time)
+
+        error_message = (
+            f"Failed after {self.config['max_retries']} attempts: "
+            f"{str(last_error)}"
+        )
+        logger.error(f"Error with {agent_version}: {error_message}")
+        return AgentResponse(error=error_message, timings=timings)
+
+    def _calculate_metrics(self, response: str, expected: str,
+                           names: Optional[Sequence[str]] = None
+                           ) -> Dict[str, float]:
+        """Calculate the quality metrics `names` (default: all selected)."""
+        return metric_registry.score_response(
+            self.text_metrics if names is None else names, response,
+            self.expected_index.features(expected)
+        )
+
+    @contextmanager
+    def _scoring_stage(self):
+        """
+        Score responses in worker processes while a run is in progress.
+
+        With more than one `scoring_workers`, `_submit_scoring` hands
+        responses to a process pool instead of scoring them inline, so the
+        next API call does not wait for BLEU/ROUGE. Test runs of the
+        "execution" metric are likewise spread over `execution_workers`
+        threads, each waiting on its own sandboxed process. Finished scores
+        are merged before results are saved, and all of them on exit.
+
+        Concurrent runs never score on the event loop, where a long
+        ROUGE-L or test run would stall every request in flight: without a
+        process pool, scores are computed in one background thread.
+        """
+        concurrent = self.config.get("concurrency", 1) > 1
+        workers = self.config.get("scoring_workers", 1)
+        if workers > 1 and self.text_metrics:
+            self._scoring_pool = ProcessPoolExecutor(max_workers=workers)
+        elif concurrent and self.text_metrics:
+            self._scoring_pool = ThreadPoolExecutor(max_workers=1)
+        runners = self.config.get("execution_workers", 1)
+        if (runners > 1 or concurrent) and self._run_tests is not None:
+            self._execution_pool = ThreadPoolExecutor(
+                max_workers=max(1, runners)
+            )
         try:
-            if response.strip() and expected.strip():
-                rouge_scores = self.rouge.get_scores(response, expected)[0]
-                metrics.update({
-                    "rouge_1": rouge_scores["rouge-1"]["f"],
-                    "rouge_2": rouge_scores["rouge-2"]["f"],
-                    "rouge_l": rouge_scores["rouge-l"]["f"],
-                })
+            yield
+            self._merge_scores(wait=True)
+        finally:
+            for pool in (self._scoring_pool, self._execution_pool):
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+            self._scoring_pool = self._execution_pool = None
+
+    def _submit_scoring(self, metrics: Dict[str, Any], response: str,
+                        instruction: Dict[str, Any], agent_version: str,
+                        names: Optional[Sequence[str]] = None
+                        ) -> Dict[str, Any]:
+        """
+        Add the quality metrics of a response to `metrics`.
+
+        Only the metrics in `names` are computed (default: all selected).
+        Returns the scores computed inline; pooled ones are merged, and
+        logged, later by `_merge_scores`.
+        """
+        names = self.metrics if names is None else names
+        key = (instruction["id"], agent_version)
+        scores: Dict[str, Any] = {}
+        text_metrics = metric_registry.with_reference(names)
+        if text_metrics and "expected_response" in instruction:
+            expected = instruction["expected_response"]
+            if self._scoring_pool is None:
+                scores.update(self._calculate_metrics(response, expected,
+                                                      text_metrics))
             else:
-                metrics.update({
-                    "rouge_1": 0.0, "rouge_2": 0.0, "rouge_l": 0.0,
-                })
-        except Exception as e:
-            logger.warning(f"Error calculating ROUGE scores: {e}")
-            metrics.update({
-                "rouge_1": 0.0, "rouge_2": 0.0, "rouge_l": 0.0,
-            })
+                future = self._scoring_pool.submit(
+                    metric_registry.score_response, text_metrics,
+                    response, self.expected_index.features(expected)
+                )
+                self._pending_scores.append((future, metrics, key))
+
+        if (self._run_tests is not None and "execution" in names
+                and "tests" in instruction):
+            args = (response, instruction["tests"],
+                    self.config.get("execution_timeout", 10.0),
+                    self.config.get("execution_memory_mb", 512))
+            if self._execution_pool is None:
+                scores.update(self._run_tests(*args))
+            else:
+                future = self._execution_pool.submit(self._run_tests, *args)
+                self._pending_scores.append((future, metrics, key))
+        if scores:
+            metrics.update(scores)
+            self._update_table(key, scores)
+        return scores
+
+    def _merge_scores(self, wait: bool = False) -> None:
+        """Merge finished scores into their metrics (all of them if `wait`)."""
+        pending = []
+        for future, metrics, key in self._pending_scores:
+            if not (wait or future.done()):
+                pending.append((future, metrics, key))
+                continue
+            try:
+                scores = future.result()
+            except Exception as e:
+                logger.warning(f"Error calculating metrics: {e}")
+                continue
+            metrics.update(scores)
+            self._update_table(key, scores)
+            self._log({"type": "metrics", "instruction_id": key[0],
+                       "agent": key[1], "metrics": scores})
+        self._pending_scores = pending
+
+    def _update_table(self, key: Tuple[str, str],
+                      scores: Dict[str, Any]) -> None:
+        """Add scores to the (instruction id, agent) row of the table."""
+        row = self.table.row_of(key[0])
+        if row is not None:
+            self.table.update_metrics(row, key[1], scores)
+
+    @property
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        The result rows as dicts, rebuilt from `table` on every access;
+        changing them does not change the table.
+        """
+        return list(self.table.iter_dicts())
+
+    def _log(self, record: Dict[str, Any]) -> None:
+        """Append a record to the result log of the current run."""
+        if self.result_log is not None:
+            self.result_log.append(record)
+
+    def _runs_dir(self) -> str:
+        return os.path.join(self.config["results_dir"], "runs")
+
+    def _read_run_log(self, run: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Adopt the id and start time of `run` and return its results."""
+        path = run_log_path(self._runs_dir(), run)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No log for run '{run}': {path}")
+        records = read_records(path)
+        self.run_id = os.path.splitext(os.path.basename(path))[0]
+        for record in records:
+            if record.get("type") == "run":
+                self.run_timestamp = record.get("timestamp",
+                                                self.run_timestamp)
+        return fold_results(records)
+
+    def _load_checkpoint(self, run: str) -> None:
+        """Keep the successful results of `run` so they are not redone."""
+        self._checkpoint = {
+            key: result for key, result in self._read_run_log(run).items()
+            if result.get("success")
+        }
+        logger.info(f"Resuming run {self.run_id}: reusing "
+                    f"{len(self._checkpoint)} completed results")
 
-        return metrics
+    def _reuse_result(self, instruction: Dict[str, Any], agent_version: str,
+                      stored: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return a checkpointed result, scoring the selected metrics it is
+        missing (e.g. its pooled score had not been logged yet). New scores
+        are logged so later resumes and snapshots do not redo them.
+        """
+        result = dict(stored, metrics=dict(stored.get("metrics", {})))
+        missing = [
+            name for name in self.metrics
+            if metric_registry.METRICS[name].reference in instruction
+            and not all(column in result["metrics"] for column
+                        in metric_registry.METRICS[name].columns)
+        ]
+        if missing and result.get("response") is not None:
+            scores = self._submit_scoring(result["metrics"],
+                                          result["response"], instruction,
+                                          agent_version, missing)
+            if scores:
+                self._log({"type": "metrics",
+                           "instruction_id": instruction["id"],
+                           "agent": agent_version, "metrics": scores})
+        return result
 
     def run_evaluation(self) -> None:
-        """Run evaluation on all instructions for both agents."""
+        """
+        Run evaluation on all instructions for both agents.
+
+        Progress goes to the run's append-only log as each (instruction,
+        agent) pair completes; the JSON and CSV snapshots are written once,
+        at the end. A resumed run appends to the log it resumes.
+        """
+        path = run_log_path(self._runs_dir(), self.run_id)
+        os.makedirs(self._runs_dir(), exist_ok=True)
+        new_run = not os.path.exists(path)
+        self.result_log = ResultLog(
+            path, mode="a",
+            sync_every=self.config.get("log_sync_every", 64),
+            sync_interval=self.config.get("log_sync_interval", 1.0),
+        )
+        if new_run:
+            self._log({"type": "run", "run_id": self.run_id,
+                       "timestamp": self.run_timestamp,
+                       "config": self._get_sanitized_config()})
+        logger.info(f"Run {self.run_id} logging to {path}")
+        try:
+            with self._scoring_stage():
+                if self.config.get("concurrency", 1) > 1:
+                    asyncio.run(self._run_evaluation_async())
+                else:
+                    self._run_evaluation_sequential()
+        finally:
+            self.result_log.close()
+            self.result_log = None
+        if len(self.table):
+            self._save_results()
+
+    def load_result_log(self, run: str) -> None:
+        """
+        Rebuild `self.table` from the log of `run` (an id, "latest" or a
+        log file), e.g. one left behind by an interrupted run. Instructions
+        missing an agent are skipped.
+        """
+        results = self._read_run_log(run)
+        self.table = ResultTable.from_results(
+            (self._build_result_row(instruction,
+                                    results[(instruction["id"], "v1")],
+                                    results[(instruction["id"], "v2")])
+             for instruction in self.instructions
+             if all((instruction["id"], version) in results
+                    for version in AGENT_VERSIONS)),
+            self._summarize_timings
+        )
+        logger.info(f"Loaded {len(self.table)} results of run "
+                    f"{self.run_id}")
+
+    def snapshot(self, run: str) -> None:
+        """Write the JSON and CSV results of a run from its log."""
+        self.load_result_log(run)
+        if len(self.table):
+            self._save_results()
+
+    def _run_evaluation_sequential(self) -> None:
+        """Evaluate the instructions one after another."""
         logger.info(
             f"Starting evaluation of {len(self.instructions)} instructions..."
         )
 
         for instruction in tqdm(self.instructions,
                                 desc="Evaluating instructions"):
-            instruction_id = instruction["id"]
             logger.info(
                 f"\nEvaluating instruction: {instruction['title']} "
                 f"({instruction['type']})"
@@ -289,24 +1196,98 @@ class AgentEvaluator:
             logger.info("  Testing agent_v2...")
             result_v2 = self._evaluate_instruction(instruction, "v2")
 
-            self.results.append({
-                "instruction_id": instruction_id,
-                "instruction_type": instruction["type"],
-                "difficulty": instruction["difficulty"],
-                "v1_success": result_v1["success"],
-                "v2_success": result_v2["success"],
-                "v1_metrics": result_v1.get("metrics", {}),
-                "v2_metrics": result_v2.get("metrics", {})
-            })
+            self.table.append(
+                self._build_result_row(instruction, result_v1, result_v2)
+            )
+            self._merge_scores()
 
-            self._save_results()
+    async def _run_evaluation_async(self) -> None:
+        """
+        Run evaluation with (instruction, agent) pairs fanned out concurrently.
 
-    def _evaluate_instruction(
-            self, instruction: Dict[str, Any], agent_version: str
+        At most `concurrency` API calls are in flight at any time. Rows
+        join the table in instruction order, as soon as every earlier row
+        has, so the table and the saved files look exactly like a
+        sequential run.
+        """
+        concurrency = self.config["concurrency"]
+        logger.info(
+            f"Starting evaluation of {len(self.instructions)} instructions "
+            f"with concurrency {concurrency}..."
+        )
+
+        semaphore = asyncio.Semaphore(concurrency)
+        rows: List[Optional[Dict[str, Any]]] = [None] * len(self.instructions)
+        added = 0  # rows[:added] are in the table
+        clients = {
+            version: self._create_async_client() for version in AGENT_VERSIONS
+        }
+
+        async def evaluate_agent(instruction, agent_version):
+            async with semaphore:
+                return await self._aevaluate_instruction(
+                    clients[agent_version], instruction, agent_version
+                )
+
+        async def evaluate(index, instruction):
+            result_v1, result_v2 = await asyncio.gather(
+                evaluate_agent(instruction, "v1"),
+                evaluate_agent(instruction, "v2"),
+            )
+            return index, self._build_result_row(
+                instruction, result_v1, result_v2
+            )
+
+        try:
+            tasks = [
+                asyncio.create_task(evaluate(index, instruction))
+                for index, instruction in enumerate(self.instructions)
+            ]
+            for next_done in tqdm(asyncio.as_completed(tasks),
+                                  total=len(tasks),
+                                  desc="Evaluating instructions"):
+                index, row = await next_done
+                rows[index] = row
+                while added < len(rows) and rows[added] is not None:
+                    self.table.append(rows[added])
+                    rows[added] = None
+                    added += 1
+                self._merge_scores()
+        finally:
+            for row in rows[added:]:
+                if row is not None:
+                    self.table.append(row)
+            await asyncio.gather(
+                *(client.aclose() for client in clients.values())
+            )
+
+    @staticmethod
+    def _build_result_row(
+            instruction: Dict[str, Any], result_v1: Dict[str, Any],
+            result_v2: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Evaluate a single instruction with the specified agent version."""
-        result = {"success": False}
+        """Combine the per-agent results of one instruction into a row."""
+        prompt = AgentEvaluator._build_prompt(instruction)
+        return {
+            "instruction_id": instruction["id"],
+            "instruction_type": instruction["type"],
+            "difficulty": instruction["difficulty"],
+            "prompt_hash": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            "v1_model": result_v1.get("model"),
+            "v2_model": result_v2.get("model"),
+            "v1_response": result_v1.get("response"),
+            "v2_response": result_v2.get("response"),
+            "v1_success": result_v1["success"],
+            "v2_success": result_v2["success"],
+            "v1_metrics": result_v1.get("metrics", {}),
+            "v2_metrics": result_v2.get("metrics", {}),
+            "v1_timings": result_v1.get("timings", {}),
+            "v2_timings": result_v2.get("timings", {})
+        }
 
+    @staticmethod
+    def _build_prompt(instruction: Dict[str, Any]) -> str:
+        """Render the prompt text sent to the agents for an instruction."""
         prompt_parts = []
         if instruction.get("description"):
             prompt_parts.append(instruction["description"])
@@ -315,34 +1296,124 @@ class AgentEvaluator:
         if instruction.get("requirements"):
             req_text = "\n".join(f'- {r}' for r in instruction["requirements"])
             prompt_parts.append(f'\n\nRequirements:\n{req_text}')
-        instruction_text = "\n".join(prompt_parts)
+        return "\n".join(prompt_parts)
+
+    def _evaluate_instruction(
+            self, instruction: Dict[str, Any], agent_version: str
+    ) -> Dict[str, Any]:
+        """Evaluate a single instruction with the specified agent version."""
+        stored = self._checkpoint.get((instruction["id"], agent_version))
+        if stored is not None:
+            return self._reuse_result(instruction, agent_version, stored)
+
+        instruction_text = self._build_prompt(instruction)
+        cache_key, cached = self._cache_lookup(agent_version, instruction_text)
+        if cached is not None:
+            return self._score_response(
+                instruction, agent_version, cached["response_text"], None,
+                cached["response_time"], cached.get("metrics")
+            )
 
         start_time = time.time()
-        response_text, error = self._call_agent_with_retry(
+        response = self._call_agent_with_retry(
             agent_version, instruction_text
         )
         duration = time.time() - start_time
+        self._cache_store(cache_key, agent_version, response, duration)
+
+        return self._score_response(
+            instruction, agent_version, response.text, response.error,
+            duration, response.metrics, response.timings
+        )
+
+    async def _aevaluate_instruction(
+            self, client: httpx.AsyncClient, instruction: Dict[str, Any],
+            agent_version: str
+    ) -> Dict[str, Any]:
+        """Async counterpart of `_evaluate_instruction`."""
+        stored = self._checkpoint.get((instruction["id"], agent_version))
+        if stored is not None:
+            return self._reuse_result(instruction, agent_version, stored)
+
+        instruction_text = self._build_prompt(instruction)
+        cache_key, cached = self._cache_lookup(agent_version, instruction_text)
+        if cached is not None:
+            return self._score_response(
+                instruction, agent_version, cached["response_text"], None,
+                cached["response_time"], cached.get("metrics")
+            )
+
+        start_time = time.time()
+        response = await self._acall_agent_with_retry(
+            client, agent_version, instruction_text
+        )
+        duration = time.time() - start_time
+        self._cache_store(cache_key, agent_version, response, duration)
+
+        return self._score_response(
+            instruction, agent_version, response.text, response.error,
+            duration, response.metrics, response.timings
+        )
+
+    def _cache_lookup(
+            self, agent_version: str, instruction_text: str
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Look up a cached response for the request an instruction renders to.
+
+        Returns:
+            A tuple of (cache_key, cached_entry); both are None when the
+            cache is off, and the entry is None on a miss.
+        """
+        if self.cache.mode == "off":
+            return None, None
+        endpoint, _, _, payload = self._build_request(
+            agent_version, instruction_text
+        )
+        cache_key = ResponseCache.make_key(agent_version, endpoint, payload)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"  {agent_version} served from response cache")
+        return cache_key, cached
+
+    def _cache_store(self, cache_key: Optional[str], agent_version: str,
+                     response: AgentResponse, duration: float) -> None:
+        """Store a successful response under its cache key."""
+        if cache_key is None or response.text is None:
+            return
+        self.cache.put(cache_key, {
+            "agent": agent_version,
+            "model": self._model_name(agent_version),
+            "response_text": response.text,
+            # The original latency is kept so cached runs report real timings.
+            "response_time": duration,
+            "metrics": response.metrics,
+        })
+
+    def _score_response(
+            self, instruction: Dict[str, Any], agent_version: str,
+            response_text: Optional[str], error: Optional[str],
+            duration: float, call_metrics: Optional[Dict[str, float]] = None,
+            timings: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Turn an agent response into a result dict with metrics."""
+        result = {
+            "success": False,
+            "timings": timings or {},
+            # Raw output, kept so metrics can be recomputed offline.
+            "response": response_text,
+            "model": self._model_name(agent_version),
+        }
 
         if error is None and response_text is not None:
             result["success"] = True
-            if "expected_response" in instruction:
-                # Pre-computation for optimization
-                expected_response = instruction["expected_response"]
-                response_tokens = response_text.split()
-                expected_tokens = expected_response.split()
-                response_lower_words = set(response_text.lower().split())
-                expected_lower_words = set(expected_response.lower().split())
-
-                metrics = self._calculate_metrics(
-                    response_text,
-                    expected_response,
-                    response_tokens,
-                    expected_tokens,
-                    response_lower_words,
-                    expected_lower_words
-                )
-                metrics["response_time"] = duration
-                result["metrics"] = metrics
+            # Latency metrics do not depend on a reference answer.
+            result["metrics"] = dict(call_metrics or {},
+                                     response_time=duration)
+            self._add_token_throughput(result["metrics"], timings)
+            if self.metrics:
+                self._submit_scoring(result["metrics"], response_text,
+                                     instruction, agent_version)
             logger.info(f"  {agent_version} completed in {duration:.2f}s")
         else:
             error_msg = (
@@ -351,30 +1422,196 @@ class AgentEvaluator:
             logger.error(f"  {error_msg}")
             result["error"] = error_msg
 
+        self._log({"type": "result", "instruction_id": instruction["id"],
+                   "agent": agent_version, **result})
         return result
 
+    @staticmethod
+    def _add_token_throughput(metrics: Dict[str, float],
+                              timings: Optional[Dict[str, Any]]) -> None:
+        """
+        Add tokens per second and latency per output token to `metrics`.
+
+        Throughput is measured over the successful attempt when its timing
+        is known, so retry backoff does not count against the provider.
+        """
+        completion_tokens = metrics.get("completion_tokens")
+        if not completion_tokens:
+            return
+        phases = (timings or {}).get("phases")
+        seconds = phases[-1]["total"] if phases else metrics["response_time"]
+        if seconds <= 0:
+            return
+        metrics["tokens_per_second"] = completion_tokens / seconds
+        metrics["latency_per_output_token"] = seconds / completion_tokens
+
+    def rescore(self) -> None:
+        """
+        Recompute the metrics of stored responses without calling agents.
+
+        Loads the results file named by `rescore_file`, scores every stored
+        response against the current expected responses and tests, keeps
+        latency and usage metrics as they were, and saves the updated
+        results.
+        """
+        with open(self.config["rescore_file"], "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        self.table = ResultTable.from_results(saved.pop("results"),
+                                              self._summarize_timings)
+        self.run_timestamp = saved.get("timestamp", self.run_timestamp)
+        self.run_id = saved.get("run_id", self.run_id)
+
+        instructions = {
+            instruction["id"]: instruction for instruction in self.instructions
+        }
+
+        def stored_pairs(name: str) -> List[Tuple[int, str, str]]:
+            """(row, version, instruction field) of stored responses."""
+            return [
+                (row, version, instructions[instruction_id][name])
+                for row, instruction_id
+                in enumerate(self.table.instruction_ids)
+                for version in AGENT_VERSIONS
+                if self.table.responses(version)[row] is not None
+                and name in instructions.get(instruction_id, {})
+            ]
+
+        targets = (stored_pairs("expected_response") if self.text_metrics
+                   else [])
+        tested = stored_pairs("tests") if self._run_tests is not None else []
+        logger.info(f"Rescoring {len(targets)} stored responses, "
+                    f"running tests of {len(tested)}...")
+        scores = self._score_batch(
+            [self.table.responses(version)[row]
+             for row, version, _ in targets],
+            [expected for _, _, expected in targets]
+        ) + self._run_test_batch(
+            [self.table.responses(version)[row]
+             for row, version, _ in tested],
+            [tests for _, _, tests in tested]
+        )
+        for (row, version, _), metrics in zip(targets + tested, scores):
+            self.table.update_metrics(row, version, metrics)
+        self._save_results()
+
+    def _score_batch(self, responses: List[str],
+                     expected: List[str]) -> List[Dict[str, float]]:
+        """Score many responses, in parallel processes when it pays off."""
+        if not self.text_metrics:
+            return [{} for _ in responses]
+        workers = max(1, self.config.get("scoring_workers", 1))
+        # Below this many pairs, starting processes costs more than it saves.
+        if workers == 1 or len(responses) < 200:
+            return metric_registry.score_pairs(self.text_metrics, responses,
+                                               expected)
+
+        size = -(-len(responses) // (workers * 4))
+        chunks = [(responses[i:i + size], expected[i:i + size])
+                  for i in range(0, len(responses), size)]
+        scores: List[Dict[str, float]] = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk_scores in pool.map(
+                    metric_registry.score_pairs,
+                    [self.text_metrics] * len(chunks), *zip(*chunks)):
+                scores.extend(chunk_scores)
+        return scores
+
+    def _run_test_batch(self, responses: List[str],
+                        tests: List[str]) -> List[Dict[str, Any]]:
+        """Run the tests of many responses, `execution_workers` at a time."""
+        if not responses:
+            return []
+        limits = (self.config.get("execution_timeout", 10.0),
+                  self.config.get("execution_memory_mb", 512))
+        workers = max(1, self.config.get("execution_workers", 1))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(
+                lambda pair: self._run_tests(*pair, *limits),
+                zip(responses, tests)
+            ))
+
     def _save_results(self) -> None:
         """Save current results to JSON and CSV files."""
+        self._merge_scores()
         results_file = os.path.join(
             self.config["results_dir"], "evaluation_results.json"
         )
         with open(results_file, "w", encoding="utf-8") as f:
             json.dump({
-                "timestamp": datetime.now().isoformat(),
+                "run_id": self.run_id,
+                "timestamp": self.run_timestamp,
                 "config": self._get_sanitized_config(),
                 "results": self.results
             }, f, indent=2, ensure_ascii=False)
 
         self._save_results_csv()
         logger.info(f"Results saved to {results_file}")
+        self._export_columnar()
+        self._store_results()
+
+    def _export_columnar(self) -> None:
+        """
+        Export this run's results as one typed table per agent. A failed
+        export is logged and does not stop the database write or report.
+        """
+        fmt = self.config.get("export_format", "auto")
+        if fmt == "off" or not len(self.table):
+            return
+        root = self.config.get("export_dir") or os.path.join(
+            self.config["results_dir"], "columnar"
+        )
+        try:
+            import columnar_export
+
+            for version in AGENT_VERSIONS:
+                records = []
+                for result in self.table.iter_dicts():
+                    record = {
+                        "instruction_id": result["instruction_id"],
+                        "instruction_type": result["instruction_type"],
+                        "difficulty": result["difficulty"],
+                        "prompt_hash": result.get("prompt_hash"),
+                        "model": result.get(f"{version}_model"),
+                        "success": bool(result[f"{version}_success"]),
+                    }
+                    record.update(result.get(f"{version}_metrics", {}))
+                    record.update(self._summarize_timings(
+                        result.get(f"{version}_timings", {})
+                    ))
+                    records.append(record)
+                path = columnar_export.export_partition(
+                    root, self.run_id, version,
+                    columnar_export.to_columns(records),
+                    None if fmt == "auto" else fmt
+                )
+                logger.info(f"Columnar results saved to {path}")
+        except (ImportError, OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not export results to {root}: {e}")
+
+    def _results_db(self) -> str:
+        return self.config.get("results_db") or os.path.join(
+            self.config["results_dir"], "evaluation.db"
+        )
+
+    def _store_results(self) -> None:
+        """Add this run's results to the database of all runs."""
+        try:
+            with ResultStore(self._results_db()) as store:
+                store.save_run(self.run_id, self.run_timestamp,
+                               self._get_sanitized_config(),
+                               self.table.iter_dicts())
+        except sqlite3.Error as e:
+            logger.warning(
+                f"Could not store results in {self._results_db()}: {e}"
+            )
 
     def _save_results_csv(self) -> None:
         """Save flattened results to CSV for easier analysis."""
-        if not self.results:
+        if not len(self.table):
             return
 
         flattened = []
-        for result in self.results:
+        for result in self.table.iter_dicts():
             row = {
                 "instruction_id": result["instruction_id"],
                 "instruction_type": result["instruction_type"],
@@ -389,9 +1626,16 @@ class AgentEvaluator:
                 for key, value in metrics.items():
                     if isinstance(value, (int, float)):
                         row[f"{prefix}{key}"] = value
+                timings = self._summarize_timings(
+                    result.get(f"{prefix}timings", {})
+                )
+                for key, value in timings.items():
+                    row[f"{prefix}{key}"] = value
 
             flattened.append(row)
 
+        import pandas as pd
+
         csv_file = os.path.join(
             self.config["results_dir"], "evaluation_results.csv"
         )
@@ -401,22 +1645,23 @@ class AgentEvaluator:
 
     def generate_report(self) -> None:
         """Generate a comprehensive markdown report with visualizations."""
-        if not self.results:
+        if not len(self.table):
             logger.warning("No results to generate report.")
             return
 
         report_file = os.path.join(
             self.config["results_dir"], "evaluation_report.md"
         )
+        table = self.table
         self._generate_visualizations()
 
         with open(report_file, "w", encoding="utf-8") as f:
             f.write("# GitHub Copilot Agent Evaluation Report\n\n")
             f.write(f"Generated at: {datetime.now().isoformat()}\n\n")
 
-            total = len(self.results)
-            v1_success = sum(1 for r in self.results if r["v1_success"])
-            v2_success = sum(1 for r in self.results if r["v2_success"])
+            total = table.size
+            v1_success = table.success_count("v1")
+            v2_success = table.success_count("v2")
             improvement = (v2_success - v1_success) / total if total > 0 else 0
 
             f.write("## 📊 Summary\n\n")
@@ -445,13 +1690,10 @@ class AgentEvaluator:
             f.write("| Metric | Agent v1 | Agent v2 | Difference |\n")
             f.write("|--------|----------|----------|------------|\n")
 
-            metrics_to_avg = [
-                "jaccard_similarity", "bleu_score", "rouge_1", "rouge_2",
-                "rouge_l", "response_time"
-            ]
-            for metric in metrics_to_avg:
-                v1_avg = self._calculate_average_metric(metric, "v1")
-                v2_avg = self._calculate_average_metric(metric, "v2")
+            metrics_to_avg = self._quality_metrics() + ["response_time"]
+            for metric, v1_avg, v2_avg in zip(
+                    metrics_to_avg, table.means(metrics_to_avg, "v1"),
+                    table.means(metrics_to_avg, "v2")):
                 diff = v2_avg - v1_avg
                 diff_str = f"{diff:+.3f}"
                 if metric == "response_time":
@@ -465,7 +1707,26 @@ class AgentEvaluator:
                         f"{diff_str} |\n"
                     )
 
-            f.write("\n![Metrics Comparison](metrics_comparison.png)\n\n")
+            if self._quality_metrics():
+                f.write(
+                    "\n![Metrics Comparison](metrics_comparison.png)\n\n"
+                )
+            else:
+                f.write("\n")
+
+            if self._has_metric("time_to_first_token"):
+                self._write_streaming_table(f)
+
+            if self._has_metric("completion_tokens"):
+                self._write_token_usage(f)
+
+            if self._has_metric("execution_status"):
+                self._write_execution_table(f)
+
+            self._write_latency_percentiles(f)
+            self._write_phase_breakdown(f)
+            self._write_near_duplicates(f)
+            self._write_run_history(f)
 
             f.write("## 📋 Detailed Results\n\n")
             f.write("<details>")
@@ -496,46 +1757,384 @@ class AgentEvaluator:
             "----------|-------------|-------------|\n"
         )
 
-        for result in sorted(self.results, key=lambda x: x["instruction_id"]):
-            v1_m = result.get("v1_metrics", {})
-            v2_m = result.get("v2_metrics", {})
+        table = self.table
+        columns = {
+            (version, metric): table.rows(metric, version)
+            for version in AGENT_VERSIONS
+            for metric in ("jaccard_similarity", "bleu_score", "rouge_l",
+                           "response_time")
+        }
+        types = table.fields["instruction_type"].decode()
+        difficulties = table.fields["difficulty"].decode()
+        for i in table.sort_order().tolist():
+            file_handle.write(
+                f"| {table.instruction_ids[i]} | "
+                f"{types[i]} | {difficulties[i]} | "
+                f"{'✅' if table.success['v1'][i] else '❌'} | "
+                f"{'✅' if table.success['v2'][i] else '❌'} | "
+                f"{columns['v1', 'jaccard_similarity'][i]:.3f} | "
+                f"{columns['v2', 'jaccard_similarity'][i]:.3f} | "
+                f"{columns['v1', 'bleu_score'][i]:.3f} | "
+                f"{columns['v2', 'bleu_score'][i]:.3f} | "
+                f"{columns['v1', 'rouge_l'][i]:.3f} | "
+                f"{columns['v2', 'rouge_l'][i]:.3f} | "
+                f"{columns['v1', 'response_time'][i]:.2f} | "
+                f"{columns['v2', 'response_time'][i]:.2f} |\n"
+            )
+
+    @staticmethod
+    def _summarize_timings(timings: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Flatten the timings of one call into scalar columns.
+
+        Phase durations are summed over all attempts and prefixed with
+        "phase_"; "attempts" and "retry_wait" are taken as they are.
+        """
+        if not timings:
+            return {}
+        summary = {
+            "attempts": timings.get("attempts", 0),
+            "retry_wait": timings.get("wait", 0.0),
+        }
+        for phases in timings.get("phases", []):
+            for phase, seconds in phases.items():
+                key = f"phase_{phase}"
+                summary[key] = summary.get(key, 0.0) + seconds
+        return summary
+
+    def _write_phase_breakdown(self, file_handle) -> None:
+        """Write the average request phase timings of both agents."""
+        table = self.table
+        if not table.timings:
+            return
+
+        file_handle.write("### Request Phase Breakdown\n")
+        file_handle.write(
+            "Average per call, summed over attempts. `ttfb` is the time "
+            "between sending the request and receiving the response "
+            "headers; `connect` includes DNS resolution; `retry_wait` is "
+            "time spent in rate limiting and retry backoff.\n\n"
+        )
+        file_handle.write("| Phase | Agent v1 | Agent v2 | Difference |\n")
+        file_handle.write("|-------|----------|----------|------------|\n")
+        columns = ["attempts", "retry_wait"] + [
+            f"phase_{phase}" for phase in
+            ("pool", *RequestTrace.PHASES, "total")
+        ]
+        # Phases a call did not go through (e.g. connect on a reused
+        # connection) count as zero.
+        means = [table.timing_means(columns, version)
+                 for version in AGENT_VERSIONS]
+        for column, averages in zip(columns, zip(*means)):
+            unit = "" if column == "attempts" else " (s)"
             file_handle.write(
-                f"| {result['instruction_id']} | "
-                f"{result['instruction_type']} | {result['difficulty']} | "
-                f"{'✅' if result['v1_success'] else '❌'} | "
-                f"{'✅' if result['v2_success'] else '❌'} | "
-                f"{v1_m.get('jaccard_similarity', 0):.3f} | "
-                f"{v2_m.get('jaccard_similarity', 0):.3f} | "
-                f"{v1_m.get('bleu_score', 0):.3f} | "
-                f"{v2_m.get('bleu_score', 0):.3f} | "
-                f"{v1_m.get('rouge_l', 0):.3f} | "
-                f"{v2_m.get('rouge_l', 0):.3f} | "
-                f"{v1_m.get('response_time', 0):.2f} | "
-                f"{v2_m.get('response_time', 0):.2f} |\n"
+                f"| {column.replace('phase_', '')}{unit} | "
+                f"{averages[0]:.3f} | {averages[1]:.3f} | "
+                f"{averages[1] - averages[0]:+.3f} |\n"
             )
+        file_handle.write("\n")
+
+    def _write_near_duplicates(self, file_handle) -> None:
+        """
+        Write clusters of near-identical responses within this run and the
+        responses that repeat answers of earlier runs.
+        """
+        from near_duplicates import (LSHIndex, MinHasher, SignatureStore,
+                                     similarity)
+
+        threshold = self.config.get("duplicate_threshold", 0.8)
+        hasher = MinHasher()
+        ids = self.table.instruction_ids
+        signatures = {
+            f"{instruction_id}/{version}": hasher.signature(response)
+            for version in AGENT_VERSIONS
+            for instruction_id, response
+            in zip(ids, self.table.responses(version))
+            if response
+        }
+        index = LSHIndex(threshold, hasher.num_perm)
+        for key, signature in signatures.items():
+            index.add(key, signature)
+        pairs = [
+            (signatures.get(f"{instruction_id}/v1"),
+             signatures.get(f"{instruction_id}/v2"))
+            for instruction_id in ids
+        ]
+        same_answer = sum(
+            1 for v1, v2 in pairs
+            if v1 is not None and v2 is not None
+            and similarity(v1, v2) >= threshold
+        )
+
+        store = SignatureStore(
+            os.path.join(self.config["results_dir"],
+                         "response_signatures.json"), hasher
+        )
+        earlier = store.index(threshold, exclude=self.run_id)
+        repeats = []
+        for key, signature in signatures.items():
+            matches = earlier.query(signature)
+            if matches:
+                repeats.append((key, *matches[0]))
+        store.put(self.run_id, signatures, self.run_timestamp)
+        store.save()
+
+        file_handle.write("## 🔁 Near-Duplicate Responses\n\n")
+        file_handle.write(
+            f"Responses with an estimated Jaccard similarity of at least "
+            f"{threshold:.2f} over word {hasher.shingle_size}-shingles "
+            f"(MinHash, {hasher.num_perm} permutations, LSH with "
+            f"{index.bands} bands of {index.rows} rows).\n\n"
+        )
+        file_handle.write(
+            f"Agents v1 and v2 answered {same_answer} of "
+            f"{len(self.table)} instructions near-identically.\n\n"
+        )
+        clusters = index.clusters()
+        if clusters:
+            file_handle.write("| Cluster | Size | Responses |\n")
+            file_handle.write("|---------|------|-----------|\n")
+            for number, cluster in enumerate(clusters, 1):
+                members = ", ".join(cluster[:10])
+                if len(cluster) > 10:
+                    members += ", …"
+                file_handle.write(
+                    f"| {number} | {len(cluster)} | {members} |\n"
+                )
+            file_handle.write("\n")
+
+        if repeats:
+            file_handle.write("### Repeated From Earlier Runs\n")
+            file_handle.write(
+                "| Response | Earlier Run | Earlier Response | "
+                "Similarity |\n"
+            )
+            file_handle.write(
+                "|----------|-------------|------------------|"
+                "------------|\n"
+            )
+            for key, (run, earlier_key), score in repeats[:20]:
+                file_handle.write(
+                    f"| {key} | {run} | {earlier_key} | {score:.2f} |\n"
+                )
+            if len(repeats) > 20:
+                file_handle.write(
+                    f"\n{len(repeats) - 20} more responses repeat earlier "
+                    f"answers.\n"
+                )
+            file_handle.write("\n")
+
+    def _write_run_history(self, file_handle) -> None:
+        """
+        Write success rate and mean response time per run, and mean
+        response time per instruction type, over the latest runs.
+        """
+        limit = self.config.get("history_runs", 20)
+        try:
+            with ResultStore(self._results_db()) as store:
+                summary = store.run_summary(limit)
+                by_type = store.metric_by_group("response_time", limit=limit)
+        except sqlite3.Error as e:
+            logger.warning(
+                f"Could not read run history from "
+                f"{self._results_db()}: {e}"
+            )
+            return
+
+        runs: Dict[str, Dict[str, Any]] = {}
+        for run_id, started, agent, count, successes, mean in summary:
+            run = runs.setdefault(run_id, {"started": started})
+            run[agent] = (successes / count if count else 0.0, mean)
+        if len(runs) < 2:
+            return
+
+        def time_str(mean: Optional[float]) -> str:
+            return "-" if mean is None else f"{mean:.3f}"
+
+        file_handle.write("## 📉 Run History\n\n")
+        file_handle.write(
+            f"The latest {len(runs)} runs in `{self._results_db()}`, "
+            f"oldest first.\n\n"
+        )
+        file_handle.write(
+            "| Run | Started | v1 Success | v2 Success | v1 Time (s) | "
+            "v2 Time (s) |\n"
+        )
+        file_handle.write(
+            "|-----|---------|------------|------------|-------------|"
+            "-------------|\n"
+        )
+        for run_id, run in runs.items():
+            v1_rate, v1_time = run.get("v1", (0.0, None))
+            v2_rate, v2_time = run.get("v2", (0.0, None))
+            marker = " (this run)" if run_id == self.run_id else ""
+            file_handle.write(
+                f"| {run_id}{marker} | {run['started'][:19]} | "
+                f"{v1_rate:.1%} | {v2_rate:.1%} | {time_str(v1_time)} | "
+                f"{time_str(v2_time)} |\n"
+            )
+        file_handle.write("\n")
+
+        if by_type:
+            file_handle.write("<details>")
+            file_handle.write(
+                "<summary>Mean response time (s) by instruction "
+                "type</summary>\n\n"
+            )
+            file_handle.write("| Run | Type | Agent | Mean | Results |\n")
+            file_handle.write("|-----|------|-------|------|---------|\n")
+            for run_id, _, group, agent, mean, count in by_type:
+                file_handle.write(
+                    f"| {run_id} | {group} | {agent} | {mean:.3f} | "
+                    f"{count} |\n"
+                )
+            file_handle.write("\n</details>\n\n")
+
+    def _quality_metrics(self) -> List[str]:
+        """Averaged quality metrics that any result recorded."""
+        return [
+            column
+            for column in metric_registry.averaged_columns(
+                list(metric_registry.METRICS)
+            )
+            if self._has_metric(column)
+        ]
+
+    def _has_metric(self, metric_name: str) -> bool:
+        """Return True if any result recorded `metric_name`."""
+        return self.table.has(metric_name)
+
+    def _write_token_usage(self, file_handle) -> None:
+        """Write token counts and throughput per agent."""
+        file_handle.write("### Token Usage\n")
+        file_handle.write("| Metric | Agent v1 | Agent v2 | Difference |\n")
+        file_handle.write("|--------|----------|----------|------------|\n")
+        table = self.table
+        totals = [int(table.values("completion_tokens", version).sum())
+                  for version in AGENT_VERSIONS]
+        file_handle.write(
+            f"| total completion_tokens | {totals[0]} | {totals[1]} | "
+            f"{totals[1] - totals[0]:+d} |\n"
+        )
+        for metric, unit in (("prompt_tokens", ""),
+                             ("completion_tokens", ""),
+                             ("tokens_per_second", ""),
+                             ("latency_per_output_token", " (s)")):
+            v1_avg = self._calculate_average_metric(metric, "v1")
+            v2_avg = self._calculate_average_metric(metric, "v2")
+            file_handle.write(
+                f"| {metric}{unit} | {v1_avg:.3f} | {v2_avg:.3f} | "
+                f"{v2_avg - v1_avg:+.3f} |\n"
+            )
+        file_handle.write("\n")
+
+    def _write_execution_table(self, file_handle) -> None:
+        """Write how the agents' code fared against the instruction tests."""
+        statuses = ("passed", "failed", "timeout", "no_code")
+        file_handle.write("### Code Execution\n")
+        file_handle.write(
+            "| Agent | Runs | Pass Rate | "
+            + " | ".join(status.replace("_", " ").title()
+                         for status in statuses)
+            + " | Mean Time (s) |\n"
+        )
+        file_handle.write("|-------|------|-----------|"
+                          + "------|" * len(statuses) + "---------------|\n")
+        table = self.table
+        for version in AGENT_VERSIONS:
+            labels = table.label_counts("execution_status", version)
+            runs = sum(labels.values())
+            counts = {status: labels.get(status, 0) for status in statuses}
+            rate = counts["passed"] / runs if runs else 0.0
+            mean_time = table.mean("execution_time", version)
+            file_handle.write(
+                f"| {version} | {runs} | {rate:.1%} | "
+                + " | ".join(str(counts[status]) for status in statuses)
+                + f" | {mean_time:.3f} |\n"
+            )
+        file_handle.write("\n")
+
+    def _write_streaming_table(self, file_handle) -> None:
+        """Write the average streaming latencies of both agents."""
+        file_handle.write("### Streaming Latency\n")
+        file_handle.write("| Metric | Agent v1 | Agent v2 | Difference |\n")
+        file_handle.write("|--------|----------|----------|------------|\n")
+        for metric, unit in (("time_to_first_token", " (s)"),
+                             ("inter_token_latency", " (s)"),
+                             ("output_tokens_per_second", "")):
+            v1_avg = self._calculate_average_metric(metric, "v1")
+            v2_avg = self._calculate_average_metric(metric, "v2")
+            file_handle.write(
+                f"| {metric}{unit} | {v1_avg:.3f} | {v2_avg:.3f} | "
+                f"{v2_avg - v1_avg:+.3f} |\n"
+            )
+        file_handle.write("\n")
+
+    def _latency_histograms(
+            self, group_by: Optional[str] = None
+    ) -> Dict[Tuple[str, str], LatencyHistogram]:
+        """
+        Build response_time histograms per agent and result column.
+
+        Returns:
+            A dict keyed by (agent_version, group value); the group value
+            is "all" when `group_by` is None.
+        """
+        table = self.table
+        return {
+            (version, group): LatencyHistogram.from_values(values.tolist())
+            for version in AGENT_VERSIONS
+            for group, values in table.grouped_values(
+                "response_time", version, group_by
+            ).items()
+        }
+
+    def _write_latency_percentiles(self, file_handle) -> None:
+        """Write response_time percentile tables overall and per slice."""
+        file_handle.write("## ⏱️ Latency Percentiles\n\n")
+        header = " | ".join(f"p{p} (s)" for p in LATENCY_PERCENTILES)
+        for title, group_by in (("Overall", None),
+                                ("By Instruction Type", "instruction_type"),
+                                ("By Difficulty", "difficulty")):
+            histograms = self._latency_histograms(group_by)
+            if not histograms:
+                continue
+            file_handle.write(f"### {title}\n")
+            file_handle.write(f"| Agent | Group | n | {header} | max (s) |\n")
+            file_handle.write(
+                "|-------|-------|---|"
+                + "|".join("-" * 9 for _ in LATENCY_PERCENTILES)
+                + "|---------|\n"
+            )
+            for (version, group), histogram in sorted(
+                    histograms.items(), key=lambda item: item[0][::-1]):
+                values = " | ".join(
+                    f"{histogram.percentile(p):.3f}"
+                    for p in LATENCY_PERCENTILES
+                )
+                file_handle.write(
+                    f"| {version} | {group} | {histogram.total_count} | "
+                    f"{values} | {histogram.percentile(100):.3f} |\n"
+                )
+            file_handle.write("\n")
+        file_handle.write("![Latency CDF](latency_cdf.png)\n\n")
 
     def _calculate_average_metric(self, metric_name: str,
                                   version: str) -> float:
         """Calculate average of a specific metric for a version."""
-        total = 0
-        count = 0
-
-        for result in self.results:
-            metrics = result.get(f"{version}_metrics", {})
-            if metric_name in metrics and metrics[metric_name] is not None:
-                total += metrics[metric_name]
-                count += 1
-
-        return total / count if count > 0 else 0.0
+        return self.table.mean(metric_name, version)
 
     def _generate_visualizations(self) -> None:
         """Generate visualization charts for the evaluation results."""
         try:
+            import seaborn as sns
+
             sns.set_theme(style="whitegrid")
 
             self._plot_success_rate()
             self._plot_metrics_comparison()
             self._plot_response_time_comparison()
+            self._plot_latency_cdf()
 
             logger.info("Visualizations generated successfully")
 
@@ -545,9 +2144,13 @@ class AgentEvaluator:
 
     def _plot_success_rate(self):
         """Plot and save the success rate comparison chart."""
-        total = len(self.results)
-        v1_success = sum(1 for r in self.results if r["v1_success"])
-        v2_success = sum(1 for r in self.results if r["v2_success"])
+        import matplotlib.pyplot as plt
+        import numpy as np
+
+        table = self.table
+        total = table.size
+        v1_success = table.success_count("v1")
+        v2_success = table.success_count("v2")
         v1_rate = v1_success / total * 100 if total > 0 else 0
         v2_rate = v2_success / total * 100 if total > 0 else 0
 
@@ -586,10 +2189,15 @@ class AgentEvaluator:
 
     def _plot_metrics_comparison(self):
         """Plot and save the metrics comparison chart."""
-        metrics = ["jaccard_similarity", "bleu_score", "rouge_1",
-                   "rouge_2", "rouge_l"]
-        v1_avgs = [self._calculate_average_metric(m, "v1") for m in metrics]
-        v2_avgs = [self._calculate_average_metric(m, "v2") for m in metrics]
+        import matplotlib.pyplot as plt
+        import numpy as np
+
+        metrics = self._quality_metrics()
+        if not metrics:
+            return
+        table = self.table
+        v1_avgs = table.means(metrics, "v1").tolist()
+        v2_avgs = table.means(metrics, "v2").tolist()
 
         x = np.arange(len(metrics))
         width = 0.35
@@ -626,18 +2234,14 @@ class AgentEvaluator:
 
     def _plot_response_time_comparison(self):
         """Plot and save the response time comparison chart."""
-        v1_times = [
-            r.get("v1_metrics", {}).get("response_time")
-            for r in self.results
-            if r.get("v1_metrics", {}).get("response_time") is not None
-        ]
-        v2_times = [
-            r.get("v2_metrics", {}).get("response_time")
-            for r in self.results
-            if r.get("v2_metrics", {}).get("response_time") is not None
-        ]
+        import matplotlib.pyplot as plt
+        import numpy as np
 
-        if v1_times and v2_times:
+        table = self.table
+        v1_times = table.values("response_time", "v1")
+        v2_times = table.values("response_time", "v2")
+
+        if v1_times.size and v2_times.size:
             fig, ax = plt.subplots(figsize=(10, 6))
             x = np.arange(2)
 
@@ -673,37 +2277,204 @@ class AgentEvaluator:
             )
             plt.close()
 
+    def _plot_latency_cdf(self):
+        """Plot and save the response time CDF of both agents."""
+        import matplotlib.pyplot as plt
+
+        histograms = self._latency_histograms()
+        if not histograms:
+            return
+
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for version in AGENT_VERSIONS:
+            histogram = histograms.get((version, "all"))
+            if histogram is None:
+                continue
+            seconds, fractions = zip(*histogram.cdf())
+            ax.step(seconds, fractions, where='post',
+                    label=f'Agent {version}')
+        for p in LATENCY_PERCENTILES:
+            ax.axhline(p / 100, color='grey', linestyle=':', linewidth=0.8)
+        ax.set_xscale('log')
+        ax.set_xlabel('Response Time (s)')
+        ax.set_ylabel('Fraction of Requests')
+        ax.set_title('Response Time CDF')
+        ax.legend()
+        plt.tight_layout()
+        plt.savefig(
+            os.path.join(self.config["results_dir"], "latency_cdf.png")
+        )
+        plt.close()
+
+
+def _check_export_format(fmt: str) -> None:
+    """
+    Raises:
+        ValueError: If `fmt` is not an export format, or is "parquet"
+            without pyarrow installed.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of "
+                         f"{', '.join(EXPORT_FORMATS)}")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError("The parquet export requires pyarrow; install it "
+                         "or choose the npz export")
+
+
+def _export_arg(value: str) -> str:
+    """Validate an --export format, including one from the environment."""
+    try:
+        _check_export_format(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def _metrics_arg(value: str) -> str:
+    """Validate a --metrics selection, keeping it as given."""
+    try:
+        metric_registry.parse_metrics(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line options that override CONFIG."""
+    parser = argparse.ArgumentParser(
+        description="Evaluate GitHub Copilot agents v1 and v2."
+    )
+    parser.add_argument(
+        "--cache", choices=CACHE_MODES, default=CONFIG["cache_mode"],
+        help="response cache mode: 'read' serves cached responses and "
+             "stores misses, 'write' always calls the agents and refreshes "
+             "the cache, 'off' disables it (default: %(default)s)"
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record", metavar="FILE",
+        help="record every raw HTTP exchange with the agents to FILE"
+    )
+    cassette.add_argument(
+        "--replay", metavar="FILE",
+        help="serve responses recorded in FILE instead of calling the agents"
+    )
+    parser.add_argument(
+        "--latency-scale", type=float, default=CONFIG["replay_latency_scale"],
+        help="multiply recorded latencies when replaying; 0 replays at full "
+             "speed (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--rescore", nargs="?", metavar="RESULTS_FILE",
+        const=os.path.join(CONFIG["results_dir"], "evaluation_results.json"),
+        help="recompute metrics from the responses stored in RESULTS_FILE "
+             "(default: the last run's results) without calling the agents"
+    )
+    run = parser.add_mutually_exclusive_group()
+    run.add_argument(
+        "--resume", metavar="RUN_ID",
+        help="continue run RUN_ID ('latest' for the most recent one), "
+             "calling the agents only for pairs without a successful result"
+    )
+    run.add_argument(
+        "--snapshot", nargs="?", metavar="RUN_ID", const="latest",
+        help="rebuild the JSON/CSV results and the report from the log of "
+             "RUN_ID (default: the most recent run), e.g. after an "
+             "interrupted run, without calling the agents"
+    )
+    parser.add_argument(
+        "--export", type=_export_arg, default=CONFIG["export_format"],
+        metavar="{" + ",".join(EXPORT_FORMATS) + "}",
+        help="columnar export of the results, one file per run and agent: "
+             "'auto' writes Parquet if pyarrow is installed and NumPy .npz "
+             "otherwise (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--stream", action="store_true", default=CONFIG["stream"],
+        help="stream responses over SSE and record time to first token, "
+             "inter-token latency and output tokens per second"
+    )
+    parser.add_argument(
+        "--metrics", type=_metrics_arg, default=CONFIG["metrics"],
+        help="comma-separated quality metrics to compute, from "
+             f"{', '.join(metric_registry.METRICS)}; 'default', 'all' or "
+             "'none' for latency and success rate only "
+             "(default: %(default)s)"
+    )
+    return parser.parse_args(argv)
+
+
+def build_config(args: argparse.Namespace) -> Dict[str, Any]:
+    """Apply command-line options on top of CONFIG."""
+    config = dict(CONFIG, cache_mode=args.cache)
+    config["replay_latency_scale"] = args.latency_scale
+    config["stream"] = args.stream
+    config["rescore_file"] = args.rescore
+    config["snapshot_log"] = args.snapshot
+    config["resume_run"] = args.resume
+    config["metrics"] = args.metrics
+    config["export_format"] = args.export
+    if args.record:
+        config.update(cassette_mode="record", cassette_file=args.record)
+    elif args.replay:
+        config.update(cassette_mode="replay", cassette_file=args.replay)
+    return config
+
 
 def main():
     """Main function to run the evaluation and generate reports."""
+    config = build_config(parse_args())
+
     print("GitHub Copilot Agent Evaluation")
     print("=" * 50)
 
+    run_id = None
     try:
-        evaluator = AgentEvaluator(CONFIG)
-
-        print("\n[START] Starting evaluation...")
-        start_time = time.time()
-        evaluator.run_evaluation()
+        with AgentEvaluator(config) as evaluator:
+            run_id = evaluator.run_id
+            start_time = time.time()
+            if config["rescore_file"]:
+                print("\n[RESCORE] Recomputing metrics from stored "
+                      "responses...")
+                evaluator.rescore()
+            elif config["snapshot_log"]:
+                print("\n[SNAPSHOT] Rebuilding results from the result "
+                      "log...")
+                evaluator.snapshot(config["snapshot_log"])
+            else:
+                if config["resume_run"]:
+                    print(f"\n[RESUME] Resuming run {run_id}...")
+                else:
+                    print(f"\n[START] Starting evaluation run {run_id}...")
+                evaluator.run_evaluation()
 
-        print("\n[REPORT] Generating report...")
-        evaluator.generate_report()
+            print("\n[REPORT] Generating report...")
+            evaluator.generate_report()
 
         duration = time.time() - start_time
         print(f"\n[DONE] Evaluation completed in {duration:.1f} seconds!")
         print(
             "[RESULTS] Report and results saved to: "
-            f"{os.path.abspath(CONFIG['results_dir'])}"
+            f"{os.path.abspath(config['results_dir'])}"
         )
 
     except KeyboardInterrupt:
         print("\n[INTERRUPTED] Evaluation interrupted by user.")
+        _print_resume_hint(config, run_id)
         sys.exit(1)
     except Exception as e:
         print(f"\n[ERROR] An error occurred: {str(e)}")
         logging.exception("Evaluation failed")
+        _print_resume_hint(config, run_id)
         sys.exit(1)
 
 
+def _print_resume_hint(config: Dict[str, Any], run_id: Optional[str]) -> None:
+    """Tell how to continue an evaluation run that did not finish."""
+    if run_id and not (config["rescore_file"] or config["snapshot_log"]):
+        print(f"[RESUME] Continue with: python evaluate_agents.py "
+              f"--resume {run_id}")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,116 @@
+"""
+Precomputed analysis of the expected responses of an instructions file.
+
+Every `expected_response` is tokenized once into `text_metrics`
+features (tokens, lower-cased vocabulary, sentences and the n-gram
+counts of every metric) and the result is stored next to the
+instructions file, e.g. `instructions.index.json` for
+`instructions.json`, unless another path is given. Entries are keyed by the SHA-256 of the expected
+text, so they are shared by both agents and reused across runs; only
+new or changed expected responses are analyzed again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from text_metrics import TextFeatures, analyze
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 2
+
+
+def index_path(instructions_file: str) -> str:
+    """Return the index file that belongs to `instructions_file`."""
+    root, _ = os.path.splitext(instructions_file)
+    return f"{root}.index.json"
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ExpectedResponseIndex:
+    """Features of expected responses, keyed by content hash."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._features: Dict[str, TextFeatures] = {}
+        self._dirty = False
+        self._load()
+
+    @classmethod
+    def for_instructions(cls, instructions_file: str,
+                         instructions: Iterable[Dict[str, Any]],
+                         path: Optional[str] = None
+                         ) -> "ExpectedResponseIndex":
+        """
+        Load the index of an instructions file, stored at `path` (default:
+        next to the file, see `index_path`), and bring it up to date.
+        """
+        index = cls(path or index_path(instructions_file))
+        index.update(
+            instruction["expected_response"] for instruction in instructions
+            if "expected_response" in instruction
+        )
+        return index
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable index {self.path}: {e}")
+            return
+        if data.get("version") != INDEX_VERSION:
+            return
+        self._features = {
+            key: TextFeatures.from_dict(entry)
+            for key, entry in data.get("entries", {}).items()
+        }
+
+    def update(self, texts: Iterable[str]) -> None:
+        """
+        Make sure every text is indexed, dropping entries of texts that are
+        no longer used, and save the index if anything changed.
+        """
+        features = {}
+        for text in texts:
+            key = text_key(text)
+            if key not in features:
+                features[key] = (self._features.get(key)
+                                 or analyze(text).precompute())
+        if features.keys() != self._features.keys():
+            self._dirty = True
+        self._features = features
+        if self._dirty:
+            self.save()
+
+    def save(self) -> None:
+        data = {
+            "version": INDEX_VERSION,
+            "entries": {key: features.to_dict()
+                        for key, features in self._features.items()},
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save index {self.path}: {e}")
+            return
+        self._dirty = False
+        logger.info(f"Expected response index saved to {self.path}")
+
+    def features(self, text: str) -> TextFeatures:
+        """Return the features of `text`, analyzing it if not indexed."""
+        key = text_key(text)
+        if key not in self._features:
+            self._features[key] = analyze(text).precompute()
+        return self._features[key]
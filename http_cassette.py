@@ -0,0 +1,344 @@
+"""
+Record/replay of raw agent HTTP traffic.
+
+A cassette is a JSON Lines file with one request/response exchange per
+line, including status, headers, body and the time the exchange took.
+`RecordingTransport` wraps the real httpx transport and appends every
+exchange to the cassette; `ReplayTransport` serves the recorded responses
+back without touching the network, optionally scaling the recorded
+latencies (0 replays at full speed).
+
+Bodies are passed through to the client as they arrive, and each chunk is
+stored with the time it was received, so streamed (SSE) responses replay
+chunk by chunk at their recorded pace and time-to-first-token survives a
+round trip. Bodies in an encoding other than gzip or deflate are stored
+whole.
+
+Credentials are redacted before anything is written, so the API key in
+the request URL or headers is never stored and does not need to match
+when replaying.
+"""
+
+import asyncio
+import codecs
+import json
+import os
+import time
+import zlib
+from collections import defaultdict, deque
+from typing import (Any, AsyncIterator, Callable, Deque, Dict, Iterator, List,
+                    Optional, Tuple)
+
+import httpx
+
+CASSETTE_MODES = ("record", "replay", "off")
+REDACTED = "***REDACTED***"
+SECRET_PARAMS = frozenset({"key"})
+SECRET_HEADERS = frozenset({"authorization", "x-goog-api-key"})
+# Headers that describe the wire encoding rather than the decoded body.
+_ENCODING_HEADERS = frozenset(
+    {"content-encoding", "content-length", "transfer-encoding"}
+)
+
+
+class CassetteMissError(httpx.TransportError):
+    """Raised when replaying a request that was never recorded."""
+
+
+def _redact_url(url: httpx.URL) -> str:
+    params = [
+        (name, REDACTED if name in SECRET_PARAMS else value)
+        for name, value in url.params.multi_items()
+    ]
+    return str(url.copy_with(params=params))
+
+
+def _request_key(request: httpx.Request) -> str:
+    """Identify a request by method, redacted URL and body."""
+    body = request.content.decode("utf-8", errors="replace")
+    return f"{request.method} {_redact_url(request.url)} {body}"
+
+
+class Cassette:
+    """A file of recorded exchanges, opened for recording or replaying."""
+
+    def __init__(self, path: str, mode: str = "off"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(
+                f"Unknown cassette mode '{mode}', "
+                f"expected one of {CASSETTE_MODES}"
+            )
+        self.path = path
+        self.mode = mode
+        self._file = None
+        self._recorded: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+
+        if mode == "record":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "w", encoding="utf-8")
+        elif mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self._recorded[exchange["key"]].append(exchange)
+
+    def record(self, request: httpx.Request, response: httpx.Response,
+               elapsed: float,
+               chunks: Optional[List[Tuple[float, str]]] = None) -> None:
+        """
+        Append one exchange; `response` must already be read. `chunks`
+        are (seconds since the request, text) of the body as it arrived.
+        """
+        exchange = {
+            "key": _request_key(request),
+            "request": {
+                "method": request.method,
+                "url": _redact_url(request.url),
+                "headers": [
+                    (name, REDACTED if name.lower() in SECRET_HEADERS
+                     else value)
+                    for name, value in request.headers.multi_items()
+                ],
+                "body": request.content.decode("utf-8", errors="replace"),
+            },
+            "response": {
+                "status": response.status_code,
+                "headers": [
+                    (name, value)
+                    for name, value in response.headers.multi_items()
+                    if name.lower() not in _ENCODING_HEADERS
+                ],
+                "body": response.text,
+            },
+            "elapsed": elapsed,
+        }
+        if chunks is not None:
+            exchange["chunks"] = chunks
+        self._file.write(json.dumps(exchange, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def play(self, request: httpx.Request) -> Dict[str, Any]:
+        """
+        Return the next recorded exchange for `request`.
+
+        Identical requests (e.g. retries) are served in recorded order; the
+        last recorded exchange keeps being served once the others are used.
+        """
+        queue = self._recorded.get(_request_key(request))
+        if not queue:
+            raise CassetteMissError(
+                f"No recorded response for {request.method} "
+                f"{_redact_url(request.url)} in {self.path}",
+                request=request,
+            )
+        return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _content_decoder(headers: httpx.Headers
+                     ) -> Optional[Callable[[bytes], bytes]]:
+    """
+    Incremental decoder of the body's content encoding, or None if the
+    encoding is not gzip, deflate or identity.
+    """
+    encoding = headers.get("content-encoding", "identity").lower().strip()
+    if encoding == "identity":
+        return lambda data: data
+    if encoding in ("gzip", "deflate"):
+        wbits = zlib.MAX_WBITS | 16 if encoding == "gzip" else zlib.MAX_WBITS
+        return zlib.decompressobj(wbits).decompress
+    return None
+
+
+class _TeeStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Pass a body through, noting when each chunk arrived."""
+
+    def __init__(self, stream, on_close: Callable[
+            [List[Tuple[float, bytes]]], None]):
+        self.stream = stream
+        self.on_close = on_close
+        self.chunks: List[Tuple[float, bytes]] = []
+        self._closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.stream:
+            self.chunks.append((time.perf_counter(), chunk))
+            yield chunk
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            self.chunks.append((time.perf_counter(), chunk))
+            yield chunk
+
+    def _finish(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.on_close(self.chunks)
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        finally:
+            self._finish()
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self._finish()
+
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Pass requests to a real transport and record every exchange once its
+    body has been read or closed.
+    """
+
+    def __init__(self, transport, cassette: Cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    def _tee(self, request: httpx.Request, response: httpx.Response,
+             start: float) -> httpx.Response:
+        def record(raw_chunks: List[Tuple[float, bytes]]) -> None:
+            self._record(request, response, start, raw_chunks)
+
+        return httpx.Response(
+            response.status_code, headers=response.headers,
+            stream=_TeeStream(response.stream, record),
+            extensions=response.extensions, request=request,
+        )
+
+    def _record(self, request: httpx.Request, response: httpx.Response,
+                start: float, raw_chunks: List[Tuple[float, bytes]]) -> None:
+        elapsed = time.perf_counter() - start
+        raw = b"".join(chunk for _, chunk in raw_chunks)
+        decode = _content_decoder(response.headers)
+        chunks = None
+        if decode is not None:
+            text = codecs.getincrementaldecoder(
+                response.charset_encoding or "utf-8")(errors="replace")
+            chunks = [(arrived - start, text.decode(decode(chunk)))
+                      for arrived, chunk in raw_chunks]
+            chunks.append((elapsed, text.decode(b"", final=True)))
+            chunks = [(offset, part) for offset, part in chunks if part]
+            body = "".join(part for _, part in chunks).encode("utf-8")
+        else:
+            decoded = httpx.Response(response.status_code,
+                                     headers=response.headers, content=raw)
+            body = decoded.read()
+        self.cassette.record(request, httpx.Response(
+            response.status_code,
+            headers=[(name, value)
+                     for name, value in response.headers.multi_items()
+                     if name.lower() not in _ENCODING_HEADERS],
+            content=body,
+        ), elapsed, chunks)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        return self._tee(request, response, start)
+
+    async def handle_async_request(
+            self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        return self._tee(request, response, start)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class _PacedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Yield recorded chunks at their recorded offsets, scaled."""
+
+    def __init__(self, chunks: List[Tuple[float, str]], start: float,
+                 latency_scale: float):
+        self.chunks = chunks
+        self.start = start
+        self.latency_scale = latency_scale
+
+    def _wait(self, offset: float) -> float:
+        return (self.start + offset * self.latency_scale
+                - time.perf_counter())
+
+    def __iter__(self) -> Iterator[bytes]:
+        for offset, text in self.chunks:
+            delay = self._wait(offset)
+            if delay > 0:
+                time.sleep(delay)
+            yield text.encode("utf-8")
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for offset, text in self.chunks:
+            delay = self._wait(offset)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield text.encode("utf-8")
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Serve recorded responses without network access. Bodies recorded in
+    chunks are streamed at their recorded pace: the headers arrive with
+    the first chunk, and the response is not delayed beyond that.
+    """
+
+    def __init__(self, cassette: Cassette, latency_scale: float = 1.0):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+
+    def _build_response(self, request: httpx.Request,
+                        exchange: Dict[str, Any],
+                        start: float) -> httpx.Response:
+        recorded = exchange["response"]
+        if exchange.get("chunks"):
+            return httpx.Response(
+                recorded["status"],
+                headers=recorded["headers"],
+                stream=_PacedStream(exchange["chunks"], start,
+                                    self.latency_scale),
+                request=request,
+            )
+        return httpx.Response(
+            recorded["status"],
+            headers=recorded["headers"],
+            content=recorded["body"].encode("utf-8"),
+            request=request,
+        )
+
+    def _delay(self, exchange: Dict[str, Any]) -> Optional[float]:
+        """Seconds before the response (its first chunk, if chunked)."""
+        chunks = exchange.get("chunks")
+        elapsed = chunks[0][0] if chunks else exchange.get("elapsed", 0.0)
+        delay = elapsed * self.latency_scale
+        return delay if delay > 0 else None
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        exchange = self.cassette.play(request)
+        delay = self._delay(exchange)
+        if delay:
+            time.sleep(delay)
+        return self._build_response(request, exchange, start)
+
+    async def handle_async_request(
+            self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        exchange = self.cassette.play(request)
+        delay = self._delay(exchange)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._build_response(request, exchange, start)
@@ -0,0 +1,90 @@
+"""
+HDR-style latency histograms.
+
+Latencies are recorded as integer microseconds into log-linear buckets, as
+in HdrHistogram: values are grouped by power of two, and each group is
+split into enough linear sub-buckets to keep the given number of
+significant decimal digits. Memory stays small regardless of the range
+of values, and percentiles are accurate to that relative precision, which
+is what long-tailed API latencies need (means and standard deviations
+hide the tail).
+"""
+
+import math
+from typing import Dict, Iterable, List, Tuple
+
+# Values are stored in this unit; 1 µs is far below network jitter.
+UNITS_PER_SECOND = 1_000_000
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in seconds."""
+
+    def __init__(self, significant_figures: int = 2):
+        if not 1 <= significant_figures <= 5:
+            raise ValueError("significant_figures must be between 1 and 5")
+        self.significant_figures = significant_figures
+        largest_single_unit = 2 * 10 ** significant_figures
+        self._sub_bucket_bits = math.ceil(math.log2(largest_single_unit))
+        self._sub_bucket_half = 1 << (self._sub_bucket_bits - 1)
+        self._sub_bucket_mask = (1 << self._sub_bucket_bits) - 1
+        # bucket index -> count; sparse, so there is no upper bound.
+        self._counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.min_value = 0
+        self.max_value = 0
+
+    @classmethod
+    def from_values(cls, values: Iterable[float],
+                    significant_figures: int = 2) -> "LatencyHistogram":
+        """Build a histogram from latencies in seconds."""
+        histogram = cls(significant_figures)
+        for value in values:
+            histogram.record(value)
+        return histogram
+
+    def _index(self, value: int) -> int:
+        bucket = (value | self._sub_bucket_mask).bit_length() \
+            - self._sub_bucket_bits
+        return bucket * self._sub_bucket_half + (value >> bucket)
+
+    def _highest_equivalent(self, index: int) -> int:
+        """Largest value that falls into the bucket at `index`."""
+        bucket = max(0, index // self._sub_bucket_half - 1)
+        sub_bucket = index - bucket * self._sub_bucket_half
+        return ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, seconds: float, count: int = 1) -> None:
+        """Record `count` occurrences of a latency given in seconds."""
+        if seconds < 0:
+            raise ValueError(f"Negative latency: {seconds}")
+        value = int(round(seconds * UNITS_PER_SECOND))
+        index = self._index(value)
+        self._counts[index] = self._counts.get(index, 0) + count
+        if self.total_count == 0 or value < self.min_value:
+            self.min_value = value
+        self.max_value = max(self.max_value, value)
+        self.total_count += count
+
+    def percentile(self, percentile: float) -> float:
+        """Return the latency in seconds at `percentile` (0-100)."""
+        if self.total_count == 0:
+            return 0.0
+        target = max(1, math.ceil(percentile / 100 * self.total_count))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= target:
+                value = min(self._highest_equivalent(index), self.max_value)
+                return max(value, self.min_value) / UNITS_PER_SECOND
+        return self.max_value / UNITS_PER_SECOND
+
+    def cdf(self) -> List[Tuple[float, float]]:
+        """Return (latency in seconds, cumulative fraction) per bucket."""
+        points = []
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            value = min(self._highest_equivalent(index), self.max_value)
+            points.append((value / UNITS_PER_SECOND, seen / self.total_count))
+        return points
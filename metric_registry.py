@@ -0,0 +1,144 @@
+"""
+Registry of the quality metrics the evaluator can compute.
+
+Each metric names the module and function that score it and the packages
+it needs. Nothing is imported until a metric is selected, so a run that
+only measures latency and success rate (`--metrics none`) never loads
+`text_metrics` or NLTK, and a missing optional package only fails the
+runs that ask for its metric.
+
+Selections are comma-separated metric names, e.g. "jaccard,rouge_l";
+"default" stands for `DEFAULT_METRICS`, "all" for every registered
+metric and "none" for no quality metrics at all.
+"""
+
+import functools
+import importlib
+import importlib.util
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class Metric:
+    """A metric and what it takes to compute it."""
+
+    name: str
+    # Keys the metric adds to a result's metrics dict.
+    columns: Tuple[str, ...]
+    # "module:function" of a `text_metrics.Scorer`.
+    scorer: str
+    # Packages that must be importable.
+    requires: Tuple[str, ...] = ()
+    # Whether the report averages the columns per agent.
+    averaged: bool = True
+    # Instruction field the response is scored against. Scorers of
+    # "expected_response" metrics are `text_metrics.Scorer`s; the others
+    # take (response, reference) and return a metrics dict.
+    reference: str = "expected_response"
+
+    def load(self) -> Callable:
+        """Import and return the scorer function."""
+        missing = [package for package in self.requires
+                   if importlib.util.find_spec(package) is None]
+        if missing:
+            raise ImportError(
+                f"Metric '{self.name}' requires {', '.join(missing)}"
+            )
+        module, _, function = self.scorer.partition(":")
+        return getattr(importlib.import_module(module), function)
+
+
+METRICS: Dict[str, Metric] = {}
+
+
+def register(metric: Metric) -> Metric:
+    """Add a metric to the registry, replacing one of the same name."""
+    METRICS[metric.name] = metric
+    return metric
+
+
+for _metric in (
+    Metric("length", ("response_length", "expected_length", "length_ratio"),
+           "text_metrics:length_scores", ("numpy",), averaged=False),
+    Metric("jaccard", ("jaccard_similarity",),
+           "text_metrics:jaccard_scores", ("numpy",)),
+    Metric("bleu", ("bleu_score",), "text_metrics:bleu_scores", ("numpy",)),
+    Metric("rouge_1", ("rouge_1",), "text_metrics:rouge_1_scores",
+           ("numpy",)),
+    Metric("rouge_2", ("rouge_2",), "text_metrics:rouge_2_scores",
+           ("numpy",)),
+    Metric("rouge_l", ("rouge_l",), "text_metrics:rouge_l_scores",
+           ("numpy",)),
+    Metric("gleu", ("gleu_score",), "text_metrics:gleu_scores",
+           ("numpy", "nltk")),
+    Metric("execution",
+           ("execution_passed", "execution_time", "execution_status"),
+           "code_execution:score_execution", averaged=False,
+           reference="tests"),
+):
+    register(_metric)
+
+DEFAULT_METRICS = ("length", "jaccard", "bleu", "rouge_1", "rouge_2",
+                   "rouge_l")
+
+
+def parse_metrics(spec: Optional[str]) -> Tuple[str, ...]:
+    """
+    Turn a comma-separated selection into registered metric names.
+
+    Raises:
+        ValueError: If a name is not registered.
+    """
+    names: List[str] = []
+    for name in (spec or "none").split(","):
+        name = name.strip().lower()
+        if name == "default":
+            names.extend(DEFAULT_METRICS)
+        elif name == "all":
+            names.extend(METRICS)
+        elif name and name != "none":
+            if name not in METRICS:
+                raise ValueError(
+                    f"Unknown metric '{name}', expected one of "
+                    f"{', '.join(METRICS)}"
+                )
+            names.append(name)
+    return tuple(dict.fromkeys(names))
+
+
+def with_reference(names: Sequence[str],
+                   reference: str = "expected_response") -> Tuple[str, ...]:
+    """The selected metrics that are scored against `reference`."""
+    return tuple(name for name in names
+                 if METRICS[name].reference == reference)
+
+
+def averaged_columns(names: Sequence[str]) -> List[str]:
+    """Columns of the selected metrics that the report averages."""
+    return [column for name in names if METRICS[name].averaged
+            for column in METRICS[name].columns]
+
+
+@functools.lru_cache(maxsize=None)
+def load_scorers(names: Tuple[str, ...]) -> Tuple[Callable, ...]:
+    """Import the scorers of the selected metrics."""
+    return tuple(METRICS[name].load() for name in names)
+
+
+def score_response(names: Sequence[str], response: str,
+                   expected) -> Dict[str, float]:
+    """Score one response against `text_metrics.TextFeatures`."""
+    import text_metrics
+
+    return text_metrics.score_response(response, expected,
+                                       load_scorers(tuple(names)))
+
+
+def score_pairs(names: Sequence[str], responses: Sequence[str],
+                expected: Sequence[str]) -> List[Dict[str, float]]:
+    """Score each response against its expected response."""
+    import text_metrics
+
+    return text_metrics.score_pairs(responses, expected,
+                                    load_scorers(tuple(names)))
@@ -0,0 +1,387 @@
+"""
+Local stand-in for the Gemini and Groq APIs used by evaluate_agents.py
+
+This server speaks the two response shapes `AgentEvaluator` parses:
+
+- Gemini: POST .../models/<model>:generateContent and
+  :streamGenerateContent (SSE with ?alt=sse)
+- Groq:   POST .../chat/completions (OpenAI-compatible, "stream": true
+  for SSE)
+
+Latency, token generation speed and 429/5xx fault rates are configurable,
+so the evaluator's throughput ceiling and retry behaviour can be measured
+under realistic failure rates without a live service.
+
+Usage:
+    python mock_agent_server.py --port 8765 \\
+        --latency lognormal:0.4,0.5 --rate-429 0.05 --rate-5xx 0.02
+
+    # .env
+    AGENT_V1_ENDPOINT=http://127.0.0.1:8765/v1beta/models/gemini-pro:generateContent
+    AGENT_V1_API_KEY=dummy
+    AGENT_V2_ENDPOINT=http://127.0.0.1:8765/openai/v1/chat/completions
+    AGENT_V2_CHAT_URL=http://127.0.0.1:8765/openai/v1/chat/completions
+    AGENT_V2_API_KEY=dummy
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GEMINI_PATH = re.compile(
+    r"/models/(?P<model>[^/:]+):(?P<method>generateContent"
+    r"|streamGenerateContent)$"
+)
+GROQ_PATH = re.compile(r"/chat/completions$")
+
+
+@dataclass
+class LatencyModel:
+    """
+    A latency distribution parsed from a spec string.
+
+    Supported specs (all values in seconds):
+        fixed:0.2            always 0.2
+        uniform:0.1,0.5      uniform between 0.1 and 0.5
+        exp:0.3              exponential with mean 0.3
+        lognormal:0.4,0.5    lognormal with median 0.4 and sigma 0.5
+    """
+
+    kind: str = "fixed"
+    params: Tuple[float, ...] = (0.0,)
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        kind, _, raw = spec.partition(":")
+        try:
+            params = tuple(float(p) for p in raw.split(",") if p)
+        except ValueError:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        arity = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        if arity.get(kind) != len(params):
+            raise ValueError(f"Invalid latency spec: {spec}")
+        return cls(kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "exp":
+            return rng.expovariate(1 / self.params[0]) if self.params[0] else 0
+        if self.kind == "lognormal":
+            median, sigma = self.params
+            return rng.lognormvariate(math.log(median), sigma) if median else 0
+        return self.params[0]
+
+
+@dataclass
+class MockSettings:
+    """Behaviour of the mock server."""
+
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    token_delay: float = 0.0  # seconds between generated tokens
+    tokens: int = 40  # tokens per response
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    retry_after: float = 1.0  # seconds advertised on 429 responses
+    seed: Optional[int] = None
+
+
+class MockAgentServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the settings and request statistics."""
+
+    daemon_threads = True
+
+    def __init__(self, address, settings: MockSettings):
+        super().__init__(address, MockAgentHandler)
+        self.settings = settings
+        self.stats: Counter = Counter()
+        self._rng = random.Random(settings.seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> Tuple[float, float]:
+        """Draw a fault roll and a latency sample."""
+        with self._lock:
+            return (self._rng.random(),
+                    self.settings.latency.sample(self._rng))
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+
+class MockAgentHandler(BaseHTTPRequestHandler):
+    """Serve Gemini- and Groq-shaped responses."""
+
+    protocol_version = "HTTP/1.1"
+    server: MockAgentServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        path = self.path.split("?", 1)[0]
+        gemini = GEMINI_PATH.search(path)
+        if gemini:
+            provider = "gemini"
+            prompt = _gemini_prompt(body)
+            stream = gemini.group("method") == "streamGenerateContent"
+        elif GROQ_PATH.search(path):
+            provider = "groq"
+            prompt = _groq_prompt(body)
+            stream = bool(body.get("stream"))
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        self.server.count("requests")
+        settings = self.server.settings
+        roll, latency = self.server.roll()
+        if roll < settings.rate_429:
+            self.server.count("429")
+            self._send_rate_limited(provider)
+            return
+        time.sleep(latency)
+        if roll < settings.rate_429 + settings.rate_5xx:
+            self.server.count("503")
+            self._send_json(503, {"error": {
+                "code": 503, "message": "The model is overloaded."
+            }})
+            return
+
+        tokens = _generate_tokens(prompt, settings.tokens)
+        usage = (len(prompt.split()), len(tokens))
+        if stream:
+            self.server.count("streamed")
+            self._send_stream(provider, body, tokens, usage)
+        else:
+            time.sleep(settings.token_delay * len(tokens))
+            self.server.count("200")
+            self._send_json(200, _full_response(provider, body, tokens, usage))
+
+    def _send_json(self, status: int, data: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_rate_limited(self, provider: str) -> None:
+        retry_after = self.server.settings.retry_after
+        if provider == "groq":
+            self._send_json(429, {"error": {
+                "message": "Rate limit reached", "type": "requests",
+                "code": "rate_limit_exceeded",
+            }}, headers={
+                "Retry-After": f"{retry_after:g}",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": f"{retry_after:g}s",
+            })
+        else:
+            self._send_json(429, {"error": {
+                "code": 429, "status": "RESOURCE_EXHAUSTED",
+                "message": "Resource has been exhausted.",
+                "details": [{
+                    "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                    "retryDelay": f"{retry_after:g}s",
+                }],
+            }})
+
+    def _send_stream(self, provider: str, body: Dict[str, Any],
+                     tokens: List[str], usage: Tuple[int, int]) -> None:
+        """Stream SSE events using chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, event in enumerate(_stream_events(provider, body, tokens,
+                                                     usage)):
+            if index:
+                time.sleep(self.server.settings.token_delay)
+            data = f"data: {event}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii"))
+            self.wfile.write(data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.server.count("200")
+
+
+def _gemini_prompt(body: Dict[str, Any]) -> str:
+    parts = [
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    ]
+    return "\n".join(parts)
+
+
+def _groq_prompt(body: Dict[str, Any]) -> str:
+    return "\n".join(
+        str(message.get("content", "")) for message in body.get("messages", [])
+    )
+
+
+def _generate_tokens(prompt: str, count: int) -> List[str]:
+    """Produce `count` tokens, echoing prompt words so metrics are non-zero."""
+    words = prompt.split() or ["mock"]
+    return [f"{words[i % len(words)]} " for i in range(max(count, 1))]
+
+
+def _full_response(provider: str, body: Dict[str, Any], tokens: List[str],
+                   usage: Tuple[int, int]) -> Dict[str, Any]:
+    prompt_tokens, completion_tokens = usage
+    text = "".join(tokens).rstrip()
+    if provider == "groq":
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+        }],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": completion_tokens,
+            "totalTokenCount": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _stream_events(provider: str, body: Dict[str, Any], tokens: List[str],
+                   usage: Tuple[int, int]) -> Iterator[str]:
+    """Yield the SSE `data:` payloads of a streamed response."""
+    prompt_tokens, completion_tokens = usage
+    usage_metadata = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": completion_tokens,
+        "totalTokenCount": prompt_tokens + completion_tokens,
+    }
+    for index, token in enumerate(tokens):
+        last = index == len(tokens) - 1
+        if provider == "groq":
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": token},
+                    "finish_reason": "stop" if last else None,
+                }],
+            }
+            if last:
+                chunk["x_groq"] = {"usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }}
+        else:
+            chunk = {"candidates": [{
+                "content": {"parts": [{"text": token}], "role": "model"},
+            }]}
+            if last:
+                chunk["candidates"][0]["finishReason"] = "STOP"
+                chunk["usageMetadata"] = usage_metadata
+        yield json.dumps(chunk)
+    if provider == "groq":
+        yield "[DONE]"
+
+
+def start_server(settings: MockSettings, host: str = "127.0.0.1",
+                 port: int = 0) -> MockAgentServer:
+    """Start the server on a background thread and return it."""
+    server = MockAgentServer((host, port), settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    """Run the mock server until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Mock Gemini/Groq server for load-testing the evaluator."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency", type=LatencyModel.parse, default=LatencyModel(),
+        help="time to first token: fixed:S, uniform:LO,HI, exp:MEAN or "
+             "lognormal:MEDIAN,SIGMA (default: fixed:0)"
+    )
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="seconds between generated tokens")
+    parser.add_argument("--tokens", type=int, default=40,
+                        help="tokens per response (default: %(default)s)")
+    parser.add_argument("--rate-429", type=float, default=0.0,
+                        help="fraction of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0,
+                        help="fraction of requests answered with 503")
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                        help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    settings = MockSettings(
+        latency=args.latency, token_delay=args.token_delay,
+        tokens=args.tokens, rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+        retry_after=args.retry_after, seed=args.seed,
+    )
+    server = MockAgentServer((args.host, args.port), settings)
+    host, port = server.server_address[:2]
+    logger.info(f"Mock agent server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Served: {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
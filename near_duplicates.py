@@ -0,0 +1,238 @@
+"""
+Near-duplicate detection across agent responses with MinHash and LSH.
+
+Each response is reduced to a MinHash signature: the minimum, under
+`num_perm` random hash functions, over the hashes of its word shingles
+(runs of `shingle_size` lower-cased words). The fraction of positions
+where two signatures agree estimates the Jaccard similarity of their
+shingle sets, so comparing two responses costs `num_perm` integer
+comparisons regardless of their length.
+
+`LSHIndex` splits signatures into bands and buckets each band, so only
+responses sharing a bucket are compared, instead of every pair. With b
+bands of r rows, pairs of similarity s become candidates with
+probability 1 - (1 - s**r)**b, an S-curve around (1/b)**(1/r); the bands
+are chosen to put that point near the threshold, and candidates are then
+checked against the threshold with their signatures.
+
+`SignatureStore` keeps the signatures of recent runs on disk, so a run
+can also be matched against the answers of earlier ones.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+SHINGLE_SIZE = 3
+# Runs whose signatures `SignatureStore` keeps.
+MAX_STORED_RUNS = 20
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """Word `size`-grams of `text`, lower-cased and without punctuation."""
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size])
+            for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Computes MinHash signatures with a fixed family of hash functions."""
+
+    def __init__(self, num_perm: int = NUM_PERM,
+                 shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a * x + b stays below 2**64 for 32-bit a, b and x.
+        self._a = rng.integers(1, _MAX_HASH, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MAX_HASH, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """Return the signature of `text` as `num_perm` uint32 values."""
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"),
+                                            digest_size=4).digest(), "little")
+             for shingle in shingles(text, self.shingle_size)),
+            dtype=np.uint64,
+        )
+        if not hashes.size:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(first == second))
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve midpoint is closest to `threshold`."""
+    options = [(bands, num_perm // bands)
+               for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs(
+        (1 / option[0]) ** (1 / option[1]) - threshold
+    ))
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = NUM_PERM):
+        self.threshold = threshold
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self._tables: List[Dict[bytes, List[Hashable]]] = [
+            {} for _ in range(self.bands)
+        ]
+        self.signatures: Dict[Hashable, np.ndarray] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[bytes]:
+        for band in range(self.bands):
+            yield signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: Hashable, signature: np.ndarray) -> None:
+        self.signatures[key] = signature
+        for table, band_key in zip(self._tables,
+                                   self._band_keys(signature)):
+            table.setdefault(band_key, []).append(key)
+
+    def query(self, signature: np.ndarray) -> List[Tuple[Hashable, float]]:
+        """Indexed keys at least `threshold` similar, most similar first."""
+        candidates = {
+            key
+            for table, band_key in zip(self._tables,
+                                       self._band_keys(signature))
+            for key in table.get(band_key, ())
+        }
+        matches = [(key, similarity(signature, self.signatures[key]))
+                   for key in candidates]
+        return sorted(
+            (match for match in matches if match[1] >= self.threshold),
+            key=lambda match: -match[1],
+        )
+
+    def clusters(self) -> List[List[Hashable]]:
+        """Groups of indexed keys linked by pairs above the threshold."""
+        parent = {key: key for key in self.signatures}
+
+        def find(key: Hashable) -> Hashable:
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for table in self._tables:
+            for bucket in table.values():
+                # One member per group met in this bucket, so a bucket of
+                # identical answers costs one comparison per member.
+                representatives: List[Hashable] = []
+                for key in bucket:
+                    joined = False
+                    for other in representatives:
+                        if find(key) == find(other) or similarity(
+                                self.signatures[key], self.signatures[other]
+                        ) >= self.threshold:
+                            parent[find(key)] = find(other)
+                            joined = True
+                    if not joined:
+                        representatives.append(key)
+
+        groups: Dict[Hashable, List[Hashable]] = {}
+        for key in self.signatures:
+            groups.setdefault(find(key), []).append(key)
+        return sorted((group for group in groups.values() if len(group) > 1),
+                      key=len, reverse=True)
+
+
+class SignatureStore:
+    """Signatures of the responses of recent runs, kept in a JSON file."""
+
+    def __init__(self, path: str, hasher: MinHasher):
+        self.path = path
+        self.hasher = hasher
+        # run id -> response key -> signature
+        self.runs: Dict[str, Dict[str, np.ndarray]] = {}
+        # run id -> ISO start time of the run
+        self.started: Dict[str, str] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable signatures {self.path}: {e}")
+            return
+        if (data.get("num_perm"), data.get("shingle_size")) != (
+                self.hasher.num_perm, self.hasher.shingle_size):
+            return
+        self.runs = {
+            run: {key: np.frombuffer(bytes.fromhex(value), dtype="<u4")
+                  for key, value in entries.items()}
+            for run, entries in data.get("runs", {}).items()
+        }
+        self.started = {run: started
+                        for run, started in data.get("started", {}).items()
+                        if run in self.runs}
+
+    def put(self, run: str, signatures: Dict[str, np.ndarray],
+            started: str) -> None:
+        """
+        Store the signatures of `run`, which started at `started` (ISO
+        time), keeping the most recently started runs only.
+
+        Runs are ordered by start time rather than by when they were
+        written, so reporting on an old run again does not evict newer ones.
+        Runs stored without a start time count as the oldest.
+        """
+        self.runs[run] = signatures
+        self.started[run] = started
+        order = sorted(self.runs, key=lambda r: (self.started.get(r, ""), r))
+        for old in order[:-MAX_STORED_RUNS]:
+            del self.runs[old]
+            self.started.pop(old, None)
+
+    def save(self) -> None:
+        data = {
+            "num_perm": self.hasher.num_perm,
+            "shingle_size": self.hasher.shingle_size,
+            "runs": {
+                run: {key: signature.astype("<u4").tobytes().hex()
+                      for key, signature in entries.items()}
+                for run, entries in self.runs.items()
+            },
+            "started": self.started,
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save signatures {self.path}: {e}")
+
+    def index(self, threshold: float,
+              exclude: Optional[str] = None) -> LSHIndex:
+        """An index over the stored runs other than `exclude`."""
+        index = LSHIndex(threshold, self.hasher.num_perm)
+        for run, entries in self.runs.items():
+            if run != exclude:
+                for key, signature in entries.items():
+                    index.add((run, key), signature)
+        return index
@@ -0,0 +1,141 @@
+"""
+On-disk cache of agent responses.
+
+Entries are content-addressed: the key is a SHA-256 over the agent, the
+endpoint and the request payload (model, rendered prompt and generation
+parameters), so anything that would change what is sent is a cache miss.
+API keys are never part of the key or the stored entry. Entries expire
+after a TTL, and the least recently used ones are evicted once the cache
+grows past its size limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# read:  serve cached responses and store misses
+# write: always call the agents and refresh the cache
+# off:   neither read nor write
+CACHE_MODES = ("read", "write", "off")
+
+
+class ResponseCache:
+    """Size-bounded, TTL-expiring LRU cache of agent responses on disk."""
+
+    def __init__(self, cache_dir: str, mode: str = "read",
+                 max_bytes: int = 256 * 1024 * 1024,
+                 ttl: float = 7 * 24 * 3600):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode '{mode}', expected one of {CACHE_MODES}"
+            )
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # path -> (last used timestamp, size in bytes)
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._total_bytes = 0
+
+        if mode != "off":
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan()
+
+    @staticmethod
+    def make_key(agent_version: str, endpoint: str,
+                 payload: Dict[str, Any]) -> str:
+        """Return the content address of a request."""
+        blob = json.dumps(
+            {"agent": agent_version, "endpoint": endpoint,
+             "payload": payload},
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _scan(self) -> None:
+        """Index the entries already on disk."""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                self._entries[path] = (stat.st_mtime, stat.st_size)
+                self._total_bytes += stat.st_size
+
+    def _remove(self, path: str) -> None:
+        _, size = self._entries.pop(path, (0.0, 0))
+        self._total_bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for `key`, or None on a miss."""
+        if self.mode != "read":
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        now = time.time()
+        if now - entry.get("created_at", 0) > self.ttl:
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # Touch the file so the LRU order survives restarts.
+        os.utime(path, (now, now))
+        self._entries[path] = (now, self._entries.get(path, (now, 0))[1])
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """Store `entry` under `key`, evicting old entries if needed."""
+        if self.mode == "off":
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = dict(entry, key=key, created_at=time.time())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        _, old_size = self._entries.get(path, (0.0, 0))
+        self._entries[path] = (time.time(), size)
+        self._total_bytes += size - old_size
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until under `max_bytes`."""
+        if self._total_bytes <= self.max_bytes:
+            return
+        by_last_use = sorted(self._entries.items(), key=lambda item: item[1][0])
+        for path, _ in by_last_use:
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
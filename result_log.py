@@ -0,0 +1,119 @@
+"""
+Append-only JSON Lines log of evaluation results.
+
+One "result" record is appended per completed (instruction, agent) pair,
+so saving progress costs one line instead of rewriting every result so
+far. Metrics that are computed after the record was written (pooled
+scoring) follow as "metrics" records for the same pair. Lines are
+flushed and fsynced in batches, every `sync_every` records or
+`sync_interval` seconds, whichever comes first; a crash loses at most
+one batch and leaves at most one torn line, which `read_records` skips.
+
+Every run has an id and its own log, `<runs_dir>/<run id>.jsonl`, which
+starts with a "run" record. The log doubles as the run's checkpoint: a
+resumed run replays it with `fold_results` and appends to it.
+"""
+
+import glob
+import json
+import logging
+import os
+import secrets
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ResultLog:
+    """Writer of a result log with batched fsync."""
+
+    def __init__(self, path: str, mode: str = "a", sync_every: int = 64,
+                 sync_interval: float = 1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._file = open(path, mode, encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def __enter__(self) -> "ResultLog":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append one record, syncing if the batch is full or old enough."""
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._unsynced += 1
+        if (self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        """Flush buffered records and fsync them to disk."""
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+def new_run_id() -> str:
+    """A sortable, unique run id such as 20240501-142233-9f1c."""
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(2)}"
+
+
+def run_log_path(runs_dir: str, run: str) -> str:
+    """
+    The log of `run`: a run id, "latest" for the most recently written
+    log in `runs_dir`, or the path of a log file.
+
+    Raises:
+        FileNotFoundError: If "latest" is asked for and there is no log.
+    """
+    if run == "latest":
+        logs = glob.glob(os.path.join(runs_dir, "*.jsonl"))
+        if not logs:
+            raise FileNotFoundError(f"No run logs in {runs_dir}")
+        return max(logs, key=os.path.getmtime)
+    if run.endswith(".jsonl"):
+        return run
+    return os.path.join(runs_dir, f"{run}.jsonl")
+
+
+def read_records(path: str) -> List[Dict[str, Any]]:
+    """Read the records of a log, skipping a torn or corrupt line."""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping unreadable line {number} of {path}")
+    return records
+
+
+def fold_results(records: List[Dict[str, Any]]
+                 ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Replay records into the latest result per (instruction, agent)."""
+    results: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for record in records:
+        if record.get("type") not in ("result", "metrics"):
+            continue
+        key = (record["instruction_id"], record["agent"])
+        if record["type"] == "result":
+            results[key] = {
+                name: value for name, value in record.items()
+                if name not in ("type", "instruction_id", "agent")
+            }
+        elif key in results:
+            results[key].setdefault("metrics", {}).update(record["metrics"])
+    return results
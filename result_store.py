@@ -0,0 +1,220 @@
+"""
+SQLite store of evaluation results across runs.
+
+The JSON and CSV files under `results/` hold the latest run only; this
+store keeps every run so results can be compared over time. Tables:
+
+- runs:         one row per run (id, start time, sanitized config)
+- instructions: one row per distinct (instruction id, prompt hash), so
+                edits to an instruction do not mix with older versions
+- results:      one row per (run, instruction, agent)
+- metrics:      one row per (result, metric name), numeric values only
+- attempts:     one row per (result, attempt, HTTP phase) duration
+
+The database runs in WAL mode so reports can read while a run writes,
+and metrics and attempts are clustered on their keys (WITHOUT ROWID)
+with indexes on what aggregate queries filter by: metric name, run,
+agent and instruction type.
+"""
+
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started TEXT NOT NULL,
+    config TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+
+CREATE TABLE IF NOT EXISTS instructions (
+    id INTEGER PRIMARY KEY,
+    instruction_id TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    instruction_type TEXT,
+    difficulty TEXT,
+    UNIQUE (instruction_id, prompt_hash)
+);
+CREATE INDEX IF NOT EXISTS instructions_type
+    ON instructions (instruction_type);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    instruction INTEGER NOT NULL REFERENCES instructions (id),
+    agent TEXT NOT NULL,
+    model TEXT,
+    success INTEGER NOT NULL,
+    response TEXT,
+    attempts INTEGER,
+    retry_wait REAL,
+    UNIQUE (run_id, agent, instruction)
+);
+CREATE INDEX IF NOT EXISTS results_instruction
+    ON results (instruction, agent);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (result_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, result_id, value);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    attempt INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (result_id, attempt, phase)
+) WITHOUT ROWID;
+"""
+
+AGENT_VERSIONS = ("v1", "v2")
+
+
+class ResultStore:
+    """Runs, results, metrics and attempt timings in one SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last transactions on power loss.
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def save_run(self, run_id: str, started: str, config: Dict[str, Any],
+                 rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        Store the result rows of a run, replacing what was stored for it
+        before (a resumed, rescored or re-snapshotted run).
+        """
+        with self._db:
+            self._db.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self._db.execute(
+                "INSERT INTO runs (run_id, started, config) VALUES (?, ?, ?)",
+                (run_id, started, json.dumps(config, ensure_ascii=False))
+            )
+            metrics: List[Tuple[int, str, float]] = []
+            attempts: List[Tuple[int, int, str, float]] = []
+            for row in rows:
+                instruction = self._instruction(row)
+                for version in AGENT_VERSIONS:
+                    timings = row.get(f"{version}_timings") or {}
+                    cursor = self._db.execute(
+                        "INSERT INTO results (run_id, instruction, agent, "
+                        "model, success, response, attempts, retry_wait) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, instruction, version,
+                         row.get(f"{version}_model"),
+                         int(bool(row[f"{version}_success"])),
+                         row.get(f"{version}_response"),
+                         timings.get("attempts"), timings.get("wait"))
+                    )
+                    result_id = cursor.lastrowid
+                    metrics.extend(
+                        (result_id, name, value)
+                        for name, value in row.get(f"{version}_metrics",
+                                                   {}).items()
+                        if isinstance(value, (int, float))
+                        and not isinstance(value, bool)
+                    )
+                    attempts.extend(
+                        (result_id, attempt, phase, seconds)
+                        for attempt, phases in enumerate(
+                            timings.get("phases", []), 1)
+                        for phase, seconds in phases.items()
+                    )
+            self._db.executemany(
+                "INSERT INTO metrics (result_id, name, value) "
+                "VALUES (?, ?, ?)", metrics
+            )
+            self._db.executemany(
+                "INSERT INTO attempts (result_id, attempt, phase, seconds) "
+                "VALUES (?, ?, ?, ?)", attempts
+            )
+
+    def _instruction(self, row: Dict[str, Any]) -> int:
+        key = (row["instruction_id"], row.get("prompt_hash", ""))
+        self._db.execute(
+            "INSERT OR IGNORE INTO instructions (instruction_id, prompt_hash, "
+            "instruction_type, difficulty) VALUES (?, ?, ?, ?)",
+            key + (row.get("instruction_type"), row.get("difficulty"))
+        )
+        return self._db.execute(
+            "SELECT id FROM instructions WHERE instruction_id = ? "
+            "AND prompt_hash = ?", key
+        ).fetchone()[0]
+
+    def recent_runs(self, limit: int = 20) -> List[Tuple[str, str]]:
+        """(run id, start time) of the latest runs, oldest first."""
+        rows = self._db.execute(
+            "SELECT run_id, started FROM runs ORDER BY started DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return rows[::-1]
+
+    def run_summary(self, limit: int = 20,
+                    metric: str = "response_time") -> List[Tuple]:
+        """
+        Per run and agent over the latest runs, oldest first: (run id,
+        start time, agent, results, successes, mean of `metric`).
+        """
+        return self._db.execute(
+            """
+            WITH recent AS (
+                SELECT run_id, started FROM runs
+                ORDER BY started DESC LIMIT ?
+            )
+            SELECT recent.run_id, recent.started, r.agent, COUNT(*),
+                   SUM(r.success), AVG(m.value)
+            FROM recent
+            JOIN results r ON r.run_id = recent.run_id
+            LEFT JOIN metrics m ON m.result_id = r.id AND m.name = ?
+            GROUP BY recent.run_id, r.agent
+            ORDER BY recent.started, r.agent
+            """, (limit, metric)
+        ).fetchall()
+
+    def metric_by_group(self, metric: str, group_by: str = "instruction_type",
+                        limit: int = 20,
+                        agents: Optional[Sequence[str]] = None
+                        ) -> List[Tuple]:
+        """
+        Mean of `metric` per run, `group_by` value ("instruction_type" or
+        "difficulty") and agent over the latest runs, oldest first: (run
+        id, start time, group, agent, mean, count).
+        """
+        if group_by not in ("instruction_type", "difficulty"):
+            raise ValueError(f"Cannot group by {group_by}")
+        agents = tuple(agents or AGENT_VERSIONS)
+        return self._db.execute(
+            f"""
+            WITH recent AS (
+                SELECT run_id, started FROM runs
+                ORDER BY started DESC LIMIT ?
+            )
+            SELECT recent.run_id, recent.started, i.{group_by}, r.agent,
+                   AVG(m.value), COUNT(m.value)
+            FROM recent
+            JOIN results r ON r.run_id = recent.run_id
+            JOIN instructions i ON i.id = r.instruction
+            JOIN metrics m ON m.result_id = r.id AND m.name = ?
+            WHERE r.agent IN ({", ".join("?" * len(agents))})
+            GROUP BY recent.run_id, i.{group_by}, r.agent
+            ORDER BY recent.started, i.{group_by}, r.agent
+            """, (limit, metric) + agents
+        ).fetchall()
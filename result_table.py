@@ -0,0 +1,578 @@
+"""
+In-memory store of evaluation results, one array per field.
+
+`AgentEvaluator` appends the result row of each instruction to a
+`ResultTable` as soon as the row is complete, and keeps no other copy of
+it. The table holds the results as a struct of arrays:
+
+- per agent, one float64 array per numeric metric with a bool validity
+  mask, so a mean is `values[valid].mean()` instead of a loop over dicts;
+  integer and bool metrics remember their type, so rows round-trip;
+- text metrics (e.g. `execution_status`), the model and the
+  `instruction_type` and `difficulty` fields as categorical codes into a
+  list of labels;
+- success flags, the raw responses and the SHA-256 prompt hashes (as 32
+  raw bytes);
+- request timings: the attempts and retry wait of each call, the phase
+  durations of every attempt in flat arrays, and per-call summaries for
+  the report.
+
+Arrays grow by doubling, so appending is amortized O(1). Apart from the
+response text, which is kept as is, a row takes a third to a fifth of
+the memory of the nested dicts it replaces. Dicts are rebuilt only
+where they are written out (the JSON results, the CSV, the columnar
+export and the result database) through `iter_dicts`, one row at a
+time.
+"""
+
+from typing import (Any, Callable, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence, Tuple)
+
+import numpy as np
+
+AGENT_VERSIONS = ("v1", "v2")
+# Instruction fields stored as categorical codes.
+CATEGORICAL_FIELDS = ("instruction_type", "difficulty")
+# Keys of a call's timings that get their own arrays.
+TIMING_KEYS = ("attempts", "wait", "phases")
+
+_INITIAL_CAPACITY = 16
+# Marks a value a row does not have, as opposed to a stored None.
+_MISSING = object()
+# Numeric kinds in widening order.
+_KINDS = ("bool", "int", "float")
+
+
+class Column(NamedTuple):
+    """Numeric values of a field; `values` is 0 where `valid` is False."""
+
+    values: np.ndarray
+    valid: np.ndarray
+
+
+class Categorical(NamedTuple):
+    """Labels of a field as indices into `categories`."""
+
+    codes: np.ndarray
+    categories: Tuple[str, ...]
+    valid: np.ndarray
+
+    @classmethod
+    def from_values(cls, values: Sequence[Optional[str]]) -> "Categorical":
+        column = _LabelColumn()
+        for value in values:
+            column.append(_MISSING if value is None else value)
+        return column.view()
+
+    def decode(self) -> List[Optional[str]]:
+        """The label of each row, None where it has none."""
+        categories = np.array(self.categories + ("",), dtype=object)
+        return np.where(self.valid, categories[self.codes], None).tolist()
+
+    def counts(self) -> Dict[str, int]:
+        """Number of valid rows per label, in label order."""
+        counts = np.bincount(self.codes[self.valid],
+                             minlength=len(self.categories))
+        return dict(sorted(zip(self.categories, counts.tolist())))
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, np.number))
+
+
+def _kind(value: Any) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    return "float"
+
+
+class _Array:
+    """A 1-d array that grows by doubling."""
+
+    def __init__(self, dtype: Any, fill: Any = 0, size: int = 0):
+        self.fill = fill
+        self.data = np.full(max(size, _INITIAL_CAPACITY), fill, dtype=dtype)
+        self.size = size
+
+    def append(self, value: Any) -> None:
+        if self.size == len(self.data):
+            grown = np.full(2 * len(self.data), self.fill,
+                            dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self.data[:self.size]
+
+
+class _NumberColumn:
+    """A numeric field that may be missing from some rows."""
+
+    def __init__(self, size: int = 0):
+        self.values = _Array(np.float64, 0.0, size)
+        self.valid = _Array(bool, False, size)
+        self.kind = "bool"
+
+    @staticmethod
+    def accepts(value: Any) -> bool:
+        return _is_number(value)
+
+    def append(self, value: Any = _MISSING) -> None:
+        present = value is not _MISSING
+        self.values.append(float(value) if present else 0.0)
+        self.valid.append(present)
+        if present:
+            self._widen(value)
+
+    def set(self, row: int, value: Any) -> None:
+        self.values.data[row] = float(value)
+        self.valid.data[row] = True
+        self._widen(value)
+
+    def _widen(self, value: Any) -> None:
+        kind = _kind(value)
+        if _KINDS.index(kind) > _KINDS.index(self.kind):
+            self.kind = kind
+
+    def get(self, row: int) -> Any:
+        if not self.valid.data[row]:
+            return _MISSING
+        value = self.values.data[row]
+        if self.kind == "bool":
+            return bool(value)
+        return int(value) if self.kind == "int" else float(value)
+
+    def view(self) -> Column:
+        return Column(self.values.view(), self.valid.view())
+
+
+class _LabelColumn:
+    """A text field stored as codes into its distinct labels."""
+
+    def __init__(self, size: int = 0):
+        self.codes = _Array(np.uint8, 0, size)
+        self.valid = _Array(bool, False, size)
+        self.categories: List[str] = []
+        self._lookup: Dict[str, int] = {}
+
+    @staticmethod
+    def accepts(value: Any) -> bool:
+        return isinstance(value, str)
+
+    def _code(self, label: str) -> int:
+        code = self._lookup.get(label)
+        if code is None:
+            code = self._lookup[label] = len(self.categories)
+            self.categories.append(label)
+            dtype = self.codes.data.dtype
+            if code > np.iinfo(dtype).max:
+                self.codes.data = self.codes.data.astype(
+                    np.min_scalar_type(2 * code)
+                )
+        return code
+
+    def append(self, value: Any = _MISSING) -> None:
+        present = value is not _MISSING
+        self.codes.append(self._code(value) if present else 0)
+        self.valid.append(present)
+
+    def set(self, row: int, value: Any) -> None:
+        self.codes.data[row] = self._code(value)
+        self.valid.data[row] = True
+
+    def get(self, row: int) -> Any:
+        if not self.valid.data[row]:
+            return _MISSING
+        return self.categories[self.codes.data[row]]
+
+    def view(self) -> Categorical:
+        return Categorical(self.codes.view(), tuple(self.categories),
+                           self.valid.view())
+
+
+class _ObjectColumn:
+    """Any other field, or one whose values are of mixed kinds."""
+
+    def __init__(self, size: int = 0):
+        self.values = _Array(object, None, size)
+        self.valid = _Array(bool, False, size)
+
+    @staticmethod
+    def accepts(value: Any) -> bool:
+        return True
+
+    @classmethod
+    def copy_of(cls, column: Any) -> "_ObjectColumn":
+        copy = cls()
+        for row in range(column.valid.size):
+            copy.append(column.get(row))
+        return copy
+
+    def append(self, value: Any = _MISSING) -> None:
+        present = value is not _MISSING
+        self.values.append(value if present else None)
+        self.valid.append(present)
+
+    def set(self, row: int, value: Any) -> None:
+        self.values.data[row] = value
+        self.valid.data[row] = True
+
+    def get(self, row: int) -> Any:
+        return (self.values.data[row] if self.valid.data[row]
+                else _MISSING)
+
+
+def _new_column(value: Any, size: int):
+    """A column of `size` missing rows that can hold `value`."""
+    for column_type in (_NumberColumn, _LabelColumn):
+        if column_type.accepts(value):
+            return column_type(size)
+    return _ObjectColumn(size)
+
+
+class _Columns:
+    """Named fields of a row, added as they first appear."""
+
+    def __init__(self):
+        self.columns: Dict[str, Any] = {}
+        self.size = 0
+
+    def _column(self, name: str, value: Any):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = _new_column(value, self.size)
+        elif not column.accepts(value):
+            column = self.columns[name] = _ObjectColumn.copy_of(column)
+        return column
+
+    def append(self, values: Dict[str, Any]) -> None:
+        for name, column in self.columns.items():
+            if name not in values:
+                column.append()
+        for name, value in values.items():
+            self._column(name, value).append(value)
+        self.size += 1
+
+    def update(self, row: int, values: Dict[str, Any]) -> None:
+        for name, value in values.items():
+            self._column(name, value).set(row, value)
+
+    def get(self, row: int) -> Dict[str, Any]:
+        values = {}
+        for name, column in self.columns.items():
+            value = column.get(row)
+            if value is not _MISSING:
+                values[name] = value
+        return values
+
+
+class _Timings:
+    """The request timings of one agent, per call and per attempt."""
+
+    def __init__(self, summarize: Optional[Callable[
+            [Dict[str, Any]], Dict[str, float]]]):
+        self.summarize = summarize
+        self.timed = _Array(bool, False)
+        self.calls = _Columns()  # attempts and wait
+        self.has_phases = _Array(bool, False)
+        # Attempts of call i are rows offsets[i]:offsets[i + 1] of `phases`.
+        self.offsets = _Array(np.int64, 0)
+        self.offsets.append(0)
+        self.phases = _Columns()
+        self.summaries: Dict[str, _Array] = {}
+        # Keys other than TIMING_KEYS, by row; normally empty.
+        self.other: Dict[int, Dict[str, Any]] = {}
+
+    def append(self, timings: Dict[str, Any]) -> None:
+        row = self.timed.size
+        self.timed.append(bool(timings))
+        self.calls.append({key: timings[key] for key in TIMING_KEYS[:2]
+                           if key in timings})
+        phases = timings.get("phases")
+        self.has_phases.append(phases is not None)
+        for attempt in phases or ():
+            self.phases.append(attempt)
+        self.offsets.append(self.phases.size)
+        other = {key: value for key, value in timings.items()
+                 if key not in TIMING_KEYS}
+        if other:
+            self.other[row] = other
+
+        summary = (self.summarize(timings)
+                   if self.summarize is not None and timings else {})
+        for name, values in self.summaries.items():
+            values.append(summary.get(name, 0.0))
+        for name, value in summary.items():
+            if name not in self.summaries:
+                self.summaries[name] = _Array(np.float64, 0.0, row)
+                self.summaries[name].append(value)
+
+    def get(self, row: int) -> Dict[str, Any]:
+        timings = self.calls.get(row)
+        if self.has_phases.data[row]:
+            start, end = self.offsets.data[row:row + 2]
+            timings["phases"] = [self.phases.get(attempt)
+                                 for attempt in range(start, end)]
+        timings.update(self.other.get(row, {}))
+        return timings
+
+    def columns(self) -> Dict[str, Column]:
+        timed = self.timed.view()
+        return {name: Column(values.view(), timed)
+                for name, values in self.summaries.items()}
+
+
+def _arrays(value: Any) -> Iterator[np.ndarray]:
+    """Every buffer held by a table part."""
+    if isinstance(value, _Array):
+        yield value.data
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _arrays(item)
+    elif isinstance(value, (ResultTable, _Timings, _Columns, _NumberColumn,
+                            _LabelColumn, _ObjectColumn)):
+        for item in vars(value).values():
+            yield from _arrays(item)
+
+
+class ResultTable:
+    """Evaluation results as one array per field."""
+
+    def __init__(self, summarize_timings: Optional[Callable[
+                     [Dict[str, Any]], Dict[str, float]]] = None,
+                 agents: Iterable[str] = AGENT_VERSIONS):
+        """
+        `summarize_timings` flattens a call's timings into the scalar
+        columns of `timings`; calls without timings are invalid in every
+        timing column, and a column a timed call lacks counts as zero.
+        """
+        self.agents = tuple(agents)
+        self.size = 0
+        self._ids = _Array(object, None)
+        self._rows: Dict[str, int] = {}
+        self._fields = {name: _LabelColumn() for name in CATEGORICAL_FIELDS}
+        self._prompt_hashes = _Array("S32", b"")
+        self._success = {version: _Array(bool, False)
+                         for version in self.agents}
+        self._models = {version: _LabelColumn() for version in self.agents}
+        self._responses = {version: _Array(object, None)
+                           for version in self.agents}
+        self._metrics = {version: _Columns() for version in self.agents}
+        self._timings = {version: _Timings(summarize_timings)
+                         for version in self.agents}
+
+    @classmethod
+    def from_results(cls, results: Iterable[Dict[str, Any]],
+                     summarize_timings: Optional[Callable[
+                         [Dict[str, Any]], Dict[str, float]]] = None,
+                     agents: Iterable[str] = AGENT_VERSIONS
+                     ) -> "ResultTable":
+        """Build a table from result rows."""
+        table = cls(summarize_timings, agents)
+        for result in results:
+            table.append(result)
+        return table
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, result: Dict[str, Any]) -> int:
+        """Add a result row (see `AgentEvaluator._build_result_row`)."""
+        row = self.size
+        self._ids.append(result["instruction_id"])
+        self._rows[str(result["instruction_id"])] = row
+        for name, column in self._fields.items():
+            value = result.get(name)
+            column.append(_MISSING if value is None else str(value))
+        prompt_hash = result.get("prompt_hash")
+        self._prompt_hashes.append(bytes.fromhex(prompt_hash)
+                                   if prompt_hash else b"")
+        for version in self.agents:
+            self._success[version].append(
+                bool(result.get(f"{version}_success"))
+            )
+            model = result.get(f"{version}_model")
+            self._models[version].append(_MISSING if model is None
+                                         else model)
+            self._responses[version].append(result.get(f"{version}_response"))
+            self._metrics[version].append(
+                result.get(f"{version}_metrics") or {}
+            )
+            self._timings[version].append(
+                result.get(f"{version}_timings") or {}
+            )
+        self.size += 1
+        return row
+
+    def row_of(self, instruction_id: str) -> Optional[int]:
+        """The row of an instruction, None if it has none yet."""
+        return self._rows.get(str(instruction_id))
+
+    def update_metrics(self, row: int, version: str,
+                       metrics: Dict[str, Any]) -> None:
+        """Add or replace metrics of an agent's result in `row`."""
+        self._metrics[version].update(row, metrics)
+
+    def to_dict(self, row: int) -> Dict[str, Any]:
+        """Rebuild the result dict of `row`."""
+        result = {"instruction_id": self._ids.data[row]}
+        for name, column in self._fields.items():
+            value = column.get(row)
+            result[name] = None if value is _MISSING else value
+        prompt_hash = self._prompt_hashes.data[row]
+        result["prompt_hash"] = prompt_hash.hex() if prompt_hash else None
+        for field, values in (
+                ("model", lambda v: self._models[v].get(row)),
+                ("response", lambda v: self._responses[v].data[row]),
+                ("success", lambda v: bool(self._success[v].data[row])),
+                ("metrics", lambda v: self._metrics[v].get(row)),
+                ("timings", lambda v: self._timings[v].get(row))):
+            for version in self.agents:
+                value = values(version)
+                result[f"{version}_{field}"] = (None if value is _MISSING
+                                                else value)
+        return result
+
+    def iter_dicts(self) -> Iterator[Dict[str, Any]]:
+        """Rebuild the result dicts one row at a time, in order."""
+        for row in range(self.size):
+            yield self.to_dict(row)
+
+    @property
+    def instruction_ids(self) -> np.ndarray:
+        return self._ids.view()
+
+    @property
+    def fields(self) -> Dict[str, Categorical]:
+        return {name: column.view() for name, column in self._fields.items()}
+
+    @property
+    def success(self) -> Dict[str, np.ndarray]:
+        return {version: success.view()
+                for version, success in self._success.items()}
+
+    @property
+    def metrics(self) -> Dict[Tuple[str, str], Column]:
+        return {(version, name): column.view()
+                for version, columns in self._metrics.items()
+                for name, column in columns.columns.items()
+                if isinstance(column, _NumberColumn)}
+
+    @property
+    def labels(self) -> Dict[Tuple[str, str], Categorical]:
+        return {(version, name): column.view()
+                for version, columns in self._metrics.items()
+                for name, column in columns.columns.items()
+                if isinstance(column, _LabelColumn)}
+
+    @property
+    def timings(self) -> Dict[Tuple[str, str], Column]:
+        return {(version, name): column
+                for version, timings in self._timings.items()
+                for name, column in timings.columns().items()}
+
+    def responses(self, version: str) -> np.ndarray:
+        """The raw response of an agent per row (None if it failed)."""
+        return self._responses[version].view()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the table's arrays, not counting response text."""
+        return sum(array.nbytes for array in _arrays(self))
+
+    @property
+    def _empty(self) -> Column:
+        return Column(np.zeros(self.size), np.zeros(self.size, dtype=bool))
+
+    def has(self, name: str) -> bool:
+        """Return True if any result recorded metric `name`."""
+        return any(name in self._metrics[version].columns
+                   for version in self.agents)
+
+    def column(self, name: str, version: str) -> Column:
+        """A numeric metric of an agent; all invalid if never recorded."""
+        column = self._metrics[version].columns.get(name)
+        if isinstance(column, _NumberColumn):
+            return column.view()
+        return self._empty
+
+    def values(self, name: str, version: str) -> np.ndarray:
+        """The recorded values of a numeric metric of an agent."""
+        column = self.column(name, version)
+        return column.values[column.valid]
+
+    def mean(self, name: str, version: str) -> float:
+        """Mean of a numeric metric over the results that recorded it."""
+        values = self.values(name, version)
+        return float(values.mean()) if values.size else 0.0
+
+    def means(self, names: Sequence[str], version: str) -> np.ndarray:
+        """Means of several numeric metrics in one pass (0 if unrecorded)."""
+        if not names:
+            return np.zeros(0)
+        columns = [self.column(name, version) for name in names]
+        values = np.stack([column.values for column in columns])
+        valid = np.stack([column.valid for column in columns])
+        counts = valid.sum(axis=1)
+        totals = np.where(valid, values, 0.0).sum(axis=1)
+        return np.divide(totals, counts, out=np.zeros(len(names)),
+                         where=counts > 0)
+
+    def timing_means(self, names: Sequence[str], version: str) -> np.ndarray:
+        """Means of timing columns over the results that have timings."""
+        timings = self._timings[version]
+        timed = timings.timed.view()
+        count = int(timed.sum())
+        if not count or not names:
+            return np.zeros(len(names))
+        values = np.stack([
+            timings.summaries[name].view() if name in timings.summaries
+            else np.zeros(self.size) for name in names
+        ])
+        return values[:, timed].sum(axis=1) / count
+
+    def success_count(self, version: str) -> int:
+        return int(self._success[version].view().sum())
+
+    def label_counts(self, name: str, version: str) -> Dict[str, int]:
+        """Rows per label of a text metric of an agent."""
+        column = self._metrics[version].columns.get(name)
+        if isinstance(column, _LabelColumn):
+            return column.view().counts()
+        return {}
+
+    def grouped_values(self, name: str, version: str,
+                       by: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Recorded values of a numeric metric per value of the categorical
+        field `by`, in label order, or under "all" if `by` is None.
+        """
+        column = self.column(name, version)
+        if by is None:
+            values = column.values[column.valid]
+            return {"all": values} if values.size else {}
+        field = self.fields[by]
+        groups = {}
+        for code, label in sorted(enumerate(field.categories),
+                                  key=lambda item: item[1]):
+            mask = column.valid & field.valid & (field.codes == code)
+            if mask.any():
+                groups[label] = column.values[mask]
+        missing = column.valid & ~field.valid
+        if missing.any():
+            groups["None"] = column.values[missing]
+        return groups
+
+    def sort_order(self) -> np.ndarray:
+        """Row indices sorted by instruction id."""
+        return np.argsort(self.instruction_ids.astype(str), kind="stable")
+
+    def rows(self, name: str, version: str, default: float = 0.0
+             ) -> List[float]:
+        """A numeric metric per row, `default` where unrecorded."""
+        column = self.column(name, version)
+        return np.where(column.valid, column.values, default).tolist()
@@ -5,6 +5,57 @@ Tests for the GitHub Copilot evaluation setup.
 import unittest
 import json
 import os
+import tempfile
+from unittest import mock
+
+import httpx
+
+import evaluate_agents
+
+
+def make_evaluator(results_dir, **overrides):
+    """Build an AgentEvaluator with dummy credentials for offline tests."""
+    config = dict(evaluate_agents.CONFIG)
+    config.update({
+        "agent_v1_endpoint": "https://gemini.test/v1:generateContent",
+        "agent_v2_endpoint": "https://groq.test/openai/v1/chat/completions",
+        "agent_v2_model": "test-model",
+        "api_key_v1": "test-key-v1",
+        "api_key_v2": "test-key-v2",
+        "instructions_file": os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "instructions.json"
+        ),
+        "results_dir": results_dir,
+        "expected_index_file": os.path.join(results_dir,
+                                            "instructions.index.json"),
+        "retry_delay": 0,
+    })
+    config.update(overrides)
+    return evaluate_agents.AgentEvaluator(config)
+
+
+def fake_agent_response(request):
+    """Answer like Gemini or Groq depending on the requested host."""
+    if request.url.host == "api.groq.com":
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "groq answer"}}]
+        })
+    return httpx.Response(200, json={
+        "candidates": [{"content": {"parts": [{"text": "gemini answer"}]}}]
+    })
+
+
+def use_mock_transport(evaluator, handler=fake_agent_response,
+                       versions=evaluate_agents.AGENT_VERSIONS):
+    """
+    Close the agent clients of `evaluator` and replace them with clients
+    answered by `handler`, a request handler or a transport.
+    """
+    transport = (handler if isinstance(handler, httpx.BaseTransport)
+                 else httpx.MockTransport(handler))
+    for version in versions:
+        evaluator.clients[version].close()
+        evaluator.clients[version] = httpx.Client(transport=transport)
 
 
 class TestEvaluationSetup(unittest.TestCase):
@@ -73,5 +124,1269 @@ class TestAgentEndpoints(unittest.TestCase):
         self.skipTest("Agent endpoint tests require actual API endpoints")
 
 
+class TestConcurrentEvaluation(unittest.TestCase):
+    """Test cases for the asyncio evaluation engine."""
+
+    def test_concurrent_run_keeps_instruction_order(self):
+        """Concurrent runs produce the same rows as a sequential run."""
+        with tempfile.TemporaryDirectory() as tmp:
+            evaluator = make_evaluator(tmp, concurrency=4)
+            with mock.patch.object(
+                    evaluator, "_create_async_client",
+                    side_effect=lambda: httpx.AsyncClient(
+                        transport=httpx.MockTransport(fake_agent_response)
+                    )):
+                evaluator.run_evaluation()
+            evaluator.close()
+
+            self.assertEqual(
+                [r["instruction_id"] for r in evaluator.results],
+                [i["id"] for i in evaluator.instructions]
+            )
+            self.assertTrue(all(r["v1_success"] and r["v2_success"]
+                                for r in evaluator.results))
+            self.assertTrue(os.path.exists(
+                os.path.join(tmp, "evaluation_results.json")
+            ))
+
+
+class TestPooledClients(unittest.TestCase):
+    """Test cases for the per-agent pooled HTTP clients."""
+
+    def test_sequential_run_reuses_agent_clients(self):
+        """Every call of an agent goes through its own persistent client."""
+        calls = {"v1": 0, "v2": 0}
+
+        def handler_for(version):
+            def handler(request):
+                calls[version] += 1
+                return fake_agent_response(request)
+            return handler
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp) as evaluator:
+                for version in evaluate_agents.AGENT_VERSIONS:
+                    use_mock_transport(evaluator, handler_for(version),
+                                       (version,))
+                evaluator.run_evaluation()
+                clients = dict(evaluator.clients)
+
+            n = len(evaluator.instructions)
+            self.assertEqual(calls, {"v1": n, "v2": n})
+            self.assertTrue(all(c.is_closed for c in clients.values()))
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test cases for the header-aware rate limiter."""
+
+    def test_parse_duration(self):
+        """Groq/Gemini duration strings are converted to seconds."""
+        parse = evaluate_agents._parse_duration
+        self.assertAlmostEqual(parse("2m59.56s"), 179.56)
+        self.assertAlmostEqual(parse("37s"), 37.0)
+        self.assertAlmostEqual(parse("120ms"), 0.12)
+        self.assertAlmostEqual(parse("7"), 7.0)
+        self.assertIsNone(parse("soon"))
+
+    def test_rate_from_headers_paces_calls(self):
+        """Remaining requests over the reset window sets the bucket rate."""
+        limiter = evaluate_agents.RateLimiter()
+        self.assertEqual(limiter.reserve(), 0.0)
+        limiter.update_from_response(httpx.Response(200, headers={
+            "x-ratelimit-remaining-requests": "2",
+            "x-ratelimit-reset-requests": "1s",
+        }))
+        self.assertAlmostEqual(limiter.rate, 2.0)
+        limiter.tokens = 0.0
+        self.assertAlmostEqual(limiter.reserve(), 0.5, places=2)
+
+    def test_429_waits_for_retry_after_instead_of_backoff(self):
+        """A 429 retry sleeps for Retry-After, not the exponential delay."""
+        responses = [
+            httpx.Response(429, headers={"retry-after": "2"}),
+            httpx.Response(200, json={
+                "candidates": [{"content": {"parts": [{"text": "ok"}]}}]
+            }),
+        ]
+        sleeps = []
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, retry_delay=30) as evaluator:
+                use_mock_transport(evaluator,
+                                   lambda request: responses.pop(0), ("v1",))
+                with mock.patch("evaluate_agents.time.sleep", sleeps.append):
+                    response = evaluator._call_agent_with_retry("v1", "hi")
+
+        self.assertEqual((response.text, response.error), ("ok", None))
+        self.assertLessEqual(max(sleeps), 2.0)
+        self.assertGreater(max(sleeps), 1.5)
+
+
+class TestFailureClassification(unittest.TestCase):
+    """Test cases for fail-fast handling of non-retryable errors."""
+
+    def _call(self, evaluator, handler):
+        use_mock_transport(evaluator, handler, ("v2",))
+        return evaluator._call_agent_with_retry("v2", "hi")
+
+    def test_auth_error_is_not_retried(self):
+        """A 401 fails on the first attempt without sleeping."""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(401, json={"error": "invalid api key"})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, retry_delay=30) as evaluator:
+                with mock.patch("evaluate_agents.time.sleep") as sleep:
+                    response = self._call(evaluator, handler)
+                    sleep.assert_called_once_with(0.0)
+
+        self.assertIsNone(response.text)
+        self.assertIn("not retried", response.error)
+        self.assertEqual(len(calls), 1)
+
+    def test_schema_mismatch_aborts_agent_when_enabled(self):
+        """With abort_on_fatal, later calls skip the agent entirely."""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"unexpected": []})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, abort_on_fatal=True) as evaluator:
+                first = self._call(evaluator, handler)
+                second = self._call(evaluator, handler)
+
+        self.assertIn("response schema", first.error)
+        self.assertIn("aborted", second.error)
+        self.assertEqual(len(calls), 1)
+
+    def test_server_errors_are_retryable(self):
+        """5xx, 429 and timeouts are classified as retryable."""
+        request = httpx.Request("POST", "https://api.groq.com/")
+        for status, expected in [(500, True), (503, True), (429, True),
+                                 (400, False), (401, False), (404, False)]:
+            error = httpx.HTTPStatusError(
+                "status", request=request,
+                response=httpx.Response(status, request=request)
+            )
+            self.assertEqual(evaluate_agents._is_retryable(error), expected)
+        self.assertTrue(evaluate_agents._is_retryable(
+            httpx.ReadTimeout("timeout", request=request)
+        ))
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases for the on-disk response cache."""
+
+    def test_second_run_is_served_from_cache(self):
+        """A repeated run in read mode makes no API calls."""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return fake_agent_response(request)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = os.path.join(tmp, "cache")
+            for _ in range(2):
+                with make_evaluator(tmp, cache_mode="read",
+                                    cache_dir=cache_dir) as evaluator:
+                    use_mock_transport(evaluator, handler)
+                    evaluator.run_evaluation()
+
+            self.assertEqual(len(calls), 2 * len(evaluator.instructions))
+            self.assertEqual(evaluator.cache.misses, 0)
+
+    def test_lru_eviction_and_ttl(self):
+        """Old entries are evicted past max_bytes and expire after ttl."""
+        from response_cache import ResponseCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(tmp, max_bytes=400, ttl=60)
+            for i in range(10):
+                cache.put(f"{i:064x}", {"response_text": "x" * 50})
+            self.assertLessEqual(cache._total_bytes, 400)
+            self.assertIsNone(cache.get(f"{0:064x}"))
+            self.assertIsNotNone(cache.get(f"{9:064x}"))
+
+            cache.ttl = -1
+            self.assertIsNone(cache.get(f"{9:064x}"))
+
+
+class TestCassettes(unittest.TestCase):
+    """Test cases for HTTP record/replay cassettes."""
+
+    def test_recorded_run_replays_offline(self):
+        """A replayed run reproduces a recorded run without credentials."""
+        from http_cassette import RecordingTransport, REDACTED
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cassette_file = os.path.join(tmp, "run.jsonl")
+            with make_evaluator(tmp, cassette_mode="record",
+                                cassette_file=cassette_file) as recorder:
+                use_mock_transport(recorder, RecordingTransport(
+                    httpx.MockTransport(fake_agent_response), recorder.cassette
+                ))
+                recorder.run_evaluation()
+
+            with open(cassette_file, encoding="utf-8") as f:
+                recorded = f.read()
+            self.assertNotIn("test-key-v1", recorded)
+            self.assertNotIn("test-key-v2", recorded)
+            self.assertIn(REDACTED, recorded)
+
+            with make_evaluator(tmp, cassette_mode="replay",
+                                cassette_file=cassette_file,
+                                replay_latency_scale=0,
+                                api_key_v1=None,
+                                api_key_v2=None) as replayer:
+                replayer.run_evaluation()
+
+            self.assertEqual(
+                [(r["v1_success"], r["v2_success"]) for r in replayer.results],
+                [(r["v1_success"], r["v2_success"]) for r in recorder.results]
+            )
+            self.assertTrue(all(r["v1_success"] for r in replayer.results))
+
+    def test_unrecorded_request_fails_without_retrying(self):
+        """Replaying a request missing from the cassette fails fast."""
+        with tempfile.TemporaryDirectory() as tmp:
+            cassette_file = os.path.join(tmp, "empty.jsonl")
+            open(cassette_file, "w").close()
+            with make_evaluator(tmp, cassette_mode="replay",
+                                cassette_file=cassette_file) as evaluator:
+                response = evaluator._call_agent_with_retry("v1", "hi")
+
+        self.assertIsNone(response.text)
+        self.assertIn("No recorded response", response.error)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """Test cases for latency percentiles in the report."""
+
+    def test_percentiles_within_precision(self):
+        """Percentiles match the exact values to two significant figures."""
+        from latency_histogram import LatencyHistogram
+
+        values = [0.001 * 1.01 ** i for i in range(1000)]
+        histogram = LatencyHistogram.from_values(values)
+        ordered = sorted(values)
+        for p in (50, 90, 99):
+            exact = ordered[int(p / 100 * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(p) / exact, 1,
+                                   delta=0.01)
+        self.assertAlmostEqual(histogram.percentile(100), max(values),
+                               places=6)
+        self.assertEqual(histogram.cdf()[-1][1], 1.0)
+
+    def test_report_has_percentiles_by_slice(self):
+        """The report lists percentiles per agent, type and difficulty."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp) as evaluator:
+                use_mock_transport(evaluator)
+                evaluator.run_evaluation()
+                evaluator.generate_report()
+
+            with open(os.path.join(tmp, "evaluation_report.md"),
+                      encoding="utf-8") as f:
+                report = f.read()
+            self.assertTrue(os.path.exists(
+                os.path.join(tmp, "latency_cdf.png")
+            ))
+
+        self.assertIn("## ⏱️ Latency Percentiles", report)
+        self.assertIn("p95 (s)", report)
+        for instruction in evaluator.instructions:
+            self.assertIn(f"| v1 | {instruction['difficulty']} |", report)
+            self.assertIn(f"| v2 | {instruction['type']} |", report)
+
+
+class TestTextMetrics(unittest.TestCase):
+    """Test cases for the batch metrics engine."""
+
+    PAIRS = [
+        ("The cat sat on the mat. It was happy.",
+         "The cat sat on the mat. It was sad."),
+        ("def add(a, b): return a + b", "def add(x, y):\n    return x + y"),
+        ("the the the the", "the cat"),
+        ("word", "a completely different reference"),
+        ("Same text. Same text.", "Same text. Same text."),
+        ("  .  ", "anything at all"),
+        ("", "empty response"),
+    ]
+
+    def test_scores_match_nltk_and_rouge(self):
+        """Batch scores equal NLTK sentence_bleu and the rouge package."""
+        from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+        from rouge import Rouge
+
+        import text_metrics
+
+        responses, expected = zip(*self.PAIRS)
+        scores = text_metrics.score_pairs(responses, expected)
+        rouge = Rouge()
+        smoothing = SmoothingFunction().method4
+        for (response, reference), score in zip(self.PAIRS, scores):
+            self.assertAlmostEqual(score["bleu_score"], sentence_bleu(
+                [reference.split()], response.split(),
+                smoothing_function=smoothing
+            ), places=12)
+            if response.strip(".").strip():
+                want = rouge.get_scores(response, reference)[0]
+                self.assertAlmostEqual(score["rouge_1"],
+                                       want["rouge-1"]["f"], places=12)
+                self.assertAlmostEqual(score["rouge_2"],
+                                       want["rouge-2"]["f"], places=12)
+                self.assertAlmostEqual(score["rouge_l"],
+                                       want["rouge-l"]["f"], places=12)
+            else:
+                self.assertEqual(score["rouge_1"], 0.0)
+            words = set(response.lower().split())
+            reference_words = set(reference.lower().split())
+            self.assertAlmostEqual(
+                score["jaccard_similarity"],
+                len(words & reference_words)
+                / max(len(words | reference_words), 1)
+            )
+
+    def test_lcs_traceback_matches_rouge(self):
+        """LCS words equal the rouge package's traceback, ties included."""
+        import random
+
+        from rouge import rouge_score
+
+        import text_metrics
+
+        rng = random.Random(0)
+        for _ in range(50):
+            x = [str(rng.randrange(4)) for _ in range(rng.randint(1, 80))]
+            y = [str(rng.randrange(4)) for _ in range(rng.randint(1, 80))]
+            self.assertEqual(text_metrics.lcs_words(x, y),
+                             set(rouge_score._recon_lcs(x, y)._ngrams))
+            self.assertEqual(text_metrics.lcs_length(x, y),
+                             rouge_score._len_lcs(x, y))
+
+    def test_japanese_text_is_tokenized_by_character(self):
+        """CJK text yields character tokens and meaningful scores."""
+        import text_metrics
+
+        features = text_metrics.analyze("Reactで作成。テストを書く！")
+        self.assertEqual(features.tokens[:3], ("React", "で", "作"))
+        self.assertEqual(len(features.sentences), 2)
+
+        score = text_metrics.score_pairs(["AIが人間と共存する未来"],
+                                         ["AIと人間が共存する未来について"])[0]
+        self.assertGreater(score["bleu_score"], 0.1)
+        self.assertGreater(score["rouge_l"], 0.5)
+
+    def test_scanner_matches_whitespace_tokenization(self):
+        """Without CJK characters, the scanner and str.split agree."""
+        import re
+
+        import text_metrics
+
+        texts = ["The cat. The  dog.\n", " . a.b .. c", "x\u00a0y\tz.", ""]
+        expected = [text_metrics.analyze(text) for text in texts]
+        with mock.patch.object(text_metrics, "_CJK", re.compile("")):
+            scanned = [text_metrics.analyze(text) for text in texts]
+        for want, got in zip(expected, scanned):
+            self.assertEqual((got.tokens, got.vocab, got.sentences),
+                             (want.tokens, want.vocab, want.sentences))
+
+    def test_long_responses_score_quickly(self):
+        """ROUGE-L on thousands of tokens does not build a full table."""
+        import time
+
+        import text_metrics
+
+        words = [f"tok{i % 97}" for i in range(5000)]
+        start = time.perf_counter()
+        score = text_metrics.score_pairs([" ".join(words)],
+                                         [" ".join(reversed(words))])[0]
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertGreater(score["rouge_l"], 0)
+
+
+class TestExpectedResponseIndex(unittest.TestCase):
+    """Test cases for the persisted expected-response index."""
+
+    def test_index_is_reused_and_refreshed(self):
+        """Saved features are reused; changed expectations are re-indexed."""
+        import expected_index
+        import text_metrics
+
+        with tempfile.TemporaryDirectory() as tmp:
+            instructions_file = os.path.join(tmp, "instructions.json")
+            instructions = [{"expected_response": "def f(): return 1."},
+                            {"expected_response": "Use a list."}]
+            expected_index.ExpectedResponseIndex.for_instructions(
+                instructions_file, instructions
+            )
+            path = os.path.join(tmp, "instructions.index.json")
+            self.assertTrue(os.path.exists(path))
+
+            instructions[1]["expected_response"] = "Use a tuple."
+            with mock.patch("expected_index.analyze",
+                            wraps=text_metrics.analyze) as analyze:
+                index = expected_index.ExpectedResponseIndex.for_instructions(
+                    instructions_file, instructions
+                )
+            analyze.assert_called_once_with("Use a tuple.")
+
+            features = index.features("def f(): return 1.")
+            self.assertEqual(features.ngrams.keys(),
+                             text_metrics.analyze("x").precompute()
+                             .ngrams.keys())
+            self.assertEqual(
+                text_metrics.score_rows(
+                    [text_metrics.analyze("def f(): return 2.")], [features]
+                ),
+                text_metrics.score_pairs(["def f(): return 2."],
+                                         ["def f(): return 1."])
+            )
+
+
+class TestRescore(unittest.TestCase):
+    """Test cases for recomputing metrics from stored responses."""
+
+    def test_rescore_recomputes_metrics_without_calls(self):
+        """Stored responses are rescored offline, latencies are kept."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp) as evaluator:
+                use_mock_transport(evaluator)
+                evaluator.run_evaluation()
+            original = evaluator.results
+            self.assertEqual(original[0]["v2_response"], "groq answer")
+
+            results_file = os.path.join(tmp, "evaluation_results.json")
+            with open(results_file, encoding="utf-8") as f:
+                stored = json.load(f)
+            for result in stored["results"]:
+                del result["v1_metrics"]["bleu_score"]
+            with open(results_file, "w", encoding="utf-8") as f:
+                json.dump(stored, f)
+
+            def no_calls(request):
+                raise AssertionError("rescoring must not call the agents")
+
+            with make_evaluator(tmp, rescore_file=results_file,
+                                api_key_v1=None,
+                                api_key_v2=None) as rescorer:
+                use_mock_transport(rescorer, no_calls)
+                rescorer.rescore()
+
+        self.assertEqual([r["v1_metrics"] for r in rescorer.results],
+                         [r["v1_metrics"] for r in original])
+
+    def test_scoring_stage_merges_scores_in_order(self):
+        """Pooled scoring during a run gives the same rows as inline."""
+        quality = ("jaccard_similarity", "bleu_score", "rouge_1", "rouge_l")
+        runs = []
+        for workers in (1, 2):
+            with tempfile.TemporaryDirectory() as tmp:
+                with make_evaluator(tmp, scoring_workers=workers) as evaluator:
+                    use_mock_transport(evaluator)
+                    evaluator.run_evaluation()
+                with open(os.path.join(tmp, "evaluation_results.json"),
+                          encoding="utf-8") as f:
+                    saved = json.load(f)["results"]
+            self.assertEqual(saved[-1]["v2_metrics"].keys(),
+                             evaluator.results[-1]["v2_metrics"].keys())
+            runs.append([
+                (r["instruction_id"],
+                 [r[f"{v}_metrics"][m] for v in ("v1", "v2") for m in quality])
+                for r in evaluator.results
+            ])
+        self.assertEqual(runs[0], runs[1])
+
+    def test_parallel_scoring_matches_inline(self):
+        """Process-pool batch scoring returns the inline scores in order."""
+        import text_metrics
+
+        responses = [f"answer {i} uses a loop." for i in range(300)]
+        expected = [f"answer {i % 7} uses a list." for i in range(300)]
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, scoring_workers=2) as evaluator:
+                scores = evaluator._score_batch(responses, expected)
+        self.assertEqual(scores,
+                         text_metrics.score_pairs(responses, expected))
+
+    def test_concurrent_run_scores_off_the_event_loop(self):
+        """Without a process pool, concurrent runs score in a thread."""
+        import threading
+
+        import metric_registry
+
+        threads = []
+        score_response = metric_registry.score_response
+
+        def score(*args):
+            threads.append(threading.current_thread())
+            return score_response(*args)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            evaluator = make_evaluator(tmp, concurrency=2)
+            with mock.patch("metric_registry.score_response",
+                            score), mock.patch.object(
+                    evaluator, "_create_async_client",
+                    side_effect=lambda: httpx.AsyncClient(
+                        transport=httpx.MockTransport(fake_agent_response)
+                    )):
+                evaluator.run_evaluation()
+            evaluator.close()
+
+        self.assertEqual(len(threads), 2 * len(evaluator.instructions))
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertTrue(all("jaccard_similarity" in r["v1_metrics"]
+                            for r in evaluator.results))
+
+
+class TestMetricRegistry(unittest.TestCase):
+    """Test cases for selecting which quality metrics are computed."""
+
+    def test_parse_metrics(self):
+        """Selections expand aliases, drop duplicates and reject typos."""
+        import metric_registry
+
+        self.assertEqual(metric_registry.parse_metrics("jaccard, rouge_l"),
+                         ("jaccard", "rouge_l"))
+        self.assertEqual(metric_registry.parse_metrics("none"), ())
+        self.assertEqual(metric_registry.parse_metrics("default,bleu"),
+                         metric_registry.DEFAULT_METRICS)
+        with self.assertRaises(ValueError):
+            metric_registry.parse_metrics("jacard")
+        with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+            evaluate_agents.parse_args(["--metrics", "jacard"])
+
+    def test_selected_metrics_match_full_scores(self):
+        """Only the selected columns are computed, with the same values."""
+        from nltk.translate.gleu_score import sentence_gleu
+
+        import metric_registry
+        import text_metrics
+
+        responses = ["def add(a, b): return a + b.", "", "print(1)"]
+        expected = ["def add(x, y): return x + y.", "pass", "print(2)"]
+        full = text_metrics.score_pairs(responses, expected)
+        selected = metric_registry.score_pairs(
+            ("jaccard", "rouge_l", "gleu"), responses, expected
+        )
+        for scores, reference, hyp, ref in zip(selected, full, responses,
+                                               expected):
+            self.assertEqual(scores.keys(),
+                             {"jaccard_similarity", "rouge_l", "gleu_score"})
+            self.assertEqual(scores["rouge_l"], reference["rouge_l"])
+            self.assertEqual(scores["jaccard_similarity"],
+                             reference["jaccard_similarity"])
+            gleu = (sentence_gleu([ref.split()], hyp.split())
+                    if hyp and ref else 0.0)
+            self.assertAlmostEqual(scores["gleu_score"], gleu)
+
+    def test_run_without_metrics_skips_scoring(self):
+        """With no metrics selected, only latency and usage are recorded."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, metrics="none",
+                                scoring_workers=2) as evaluator:
+                use_mock_transport(evaluator)
+                with mock.patch("metric_registry.score_response") as score:
+                    evaluator.run_evaluation()
+                evaluator.generate_report()
+            with open(os.path.join(tmp, "evaluation_report.md"),
+                      encoding="utf-8") as f:
+                report = f.read()
+
+        score.assert_not_called()
+        self.assertIsNone(evaluator.expected_index)
+        metrics = evaluator.results[0]["v1_metrics"]
+        self.assertIn("response_time", metrics)
+        self.assertNotIn("jaccard_similarity", metrics)
+        self.assertNotIn("metrics_comparison.png", report)
+        self.assertIn("| response_time (s) |", report)
+
+
+class TestCodeExecution(unittest.TestCase):
+    """Test cases for running generated code against instruction tests."""
+
+    def test_extract_code_prefers_python_blocks(self):
+        """Python-tagged blocks win over untagged ones; prose has no code."""
+        import code_execution
+
+        text = ("Use this:\n```\n$ pip install x\n```\n"
+                "```python\nx = 1\n```\nand\n```py\ny = 2\n```")
+        self.assertEqual(code_execution.extract_code(text),
+                         "x = 1\n\n\ny = 2\n")
+        self.assertEqual(code_execution.extract_code("```\nz = 3\n```"),
+                         "z = 3\n")
+        self.assertIsNone(code_execution.extract_code("No code here."))
+
+    def test_sandboxed_runs(self):
+        """Runs pass, fail, time out or find no code, in a scratch dir."""
+        import code_execution
+
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "instructions.json"), encoding="utf-8") as f:
+            bug_fix = next(i for i in json.load(f)["instructions"]
+                           if i["id"] == "bug_fix_1")
+        fixed = ("```python\ndef process_file(filename):\n"
+                 "    with open(filename) as file:\n"
+                 "        return [process_line(line) for line in file]\n```")
+        original = f"```python\n{bug_fix['code']}\n```"
+
+        def status(response, tests=bug_fix["tests"], **limits):
+            return code_execution.score_execution(
+                response, tests, **limits
+            )["execution_status"]
+
+        self.assertEqual(status(fixed), "passed")
+        self.assertEqual(status(original), "failed")
+        self.assertEqual(status("Close the file."), "no_code")
+        self.assertEqual(status("```python\nwhile True: pass\n```", "",
+                                timeout=1), "timeout")
+        self.assertEqual(status("```python\nimport os\n```",
+                                "assert os.listdir('.') == ['solution.py']"),
+                         "passed")
+
+    def test_run_records_execution_metrics(self):
+        """Instructions with tests get execution metrics in the report."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, metrics="jaccard,execution",
+                                execution_workers=2) as evaluator:
+                use_mock_transport(evaluator)
+                evaluator.run_evaluation()
+                evaluator.generate_report()
+            with open(os.path.join(tmp, "evaluation_report.md"),
+                      encoding="utf-8") as f:
+                report = f.read()
+
+        by_id = {r["instruction_id"]: r for r in evaluator.results}
+        self.assertEqual(by_id["bug_fix_1"]["v2_metrics"]["execution_status"],
+                         "no_code")
+        self.assertNotIn("execution_status", by_id["refactor_1"]["v2_metrics"])
+        self.assertIn("jaccard_similarity", by_id["refactor_1"]["v2_metrics"])
+        self.assertIn("### Code Execution", report)
+
+
+class TestNearDuplicates(unittest.TestCase):
+    """Test cases for MinHash/LSH near-duplicate detection."""
+
+    def test_lsh_clusters_boilerplate(self):
+        """Repeated boilerplate clusters; unrelated answers stay apart."""
+        import random
+
+        import near_duplicates
+
+        rng = random.Random(7)
+        words = [f"word{i}" for i in range(2000)]
+        answers = [" ".join(rng.choices(words, k=80)) for _ in range(200)]
+        boilerplate = ("I am sorry, but I cannot help with reviewing this "
+                       "code because it looks incomplete to me")
+        answers += [boilerplate + suffix for suffix in ("", ".", " today")]
+
+        hasher = near_duplicates.MinHasher()
+        signatures = [hasher.signature(answer) for answer in answers]
+        first, second = (near_duplicates.shingles(answers[-1]),
+                         near_duplicates.shingles(answers[-3]))
+        self.assertAlmostEqual(
+            near_duplicates.similarity(signatures[-1], signatures[-3]),
+            len(first & second) / len(first | second), delta=0.1
+        )
+
+        index = near_duplicates.LSHIndex(threshold=0.8)
+        for key, signature in enumerate(signatures):
+            index.add(key, signature)
+        self.assertEqual([sorted(c) for c in index.clusters()],
+                         [[200, 201, 202]])
+
+    def test_report_lists_clusters_and_repeats(self):
+        """Identical answers cluster, and a second run repeats the first."""
+        reports = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for run in range(2):
+                with make_evaluator(tmp, metrics="none") as evaluator:
+                    evaluator.run_id = f"run-{run}"
+                    use_mock_transport(evaluator)
+                    evaluator.run_evaluation()
+                    evaluator.generate_report()
+                with open(os.path.join(tmp, "evaluation_report.md"),
+                          encoding="utf-8") as f:
+                    reports.append(f.read())
+
+        total = len(evaluator.results)
+        self.assertIn(f"answered 0 of {total} instructions", reports[0])
+        self.assertIn(f"| 1 | {total} | code_review_1/v1", reports[0])
+        self.assertNotIn("Repeated From Earlier Runs", reports[0])
+        self.assertIn("| code_review_1/v1 | run-0 |", reports[1])
+
+    def test_store_keeps_most_recently_started_runs(self):
+        """Rewriting an old run does not evict a newer one."""
+        import near_duplicates
+
+        hasher = near_duplicates.MinHasher()
+        signature = {"a/v1": hasher.signature("some answer text here")}
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+                near_duplicates, "MAX_STORED_RUNS", 2):
+            path = os.path.join(tmp, "signatures.json")
+            store = near_duplicates.SignatureStore(path, hasher)
+            store.put("old", signature, "2024-01-01T00:00:00")
+            store.put("new", signature, "2024-01-03T00:00:00")
+            store.save()
+            store = near_duplicates.SignatureStore(path, hasher)
+            store.put("old", signature, "2024-01-01T00:00:00")
+            store.put("middle", signature, "2024-01-02T00:00:00")
+            self.assertEqual(sorted(store.runs), ["middle", "new"])
+
+
+class TestResultLog(unittest.TestCase):
+    """Test cases for the append-only result log."""
+
+    def test_batched_sync_and_torn_line(self):
+        """Records are fsynced in batches and a torn tail is skipped."""
+        import result_log
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "log.jsonl")
+            with mock.patch("os.fsync") as fsync:
+                with result_log.ResultLog(path, sync_every=3,
+                                          sync_interval=3600) as log:
+                    for agent in ("v1", "v2", "v1"):
+                        log.append({"type": "result", "instruction_id": "a",
+                                    "agent": agent, "metrics": {"x": 1}})
+                    self.assertEqual(fsync.call_count, 1)
+                    log.append({"type": "metrics", "instruction_id": "a",
+                                "agent": "v1", "metrics": {"y": 2}})
+                    self.assertEqual(fsync.call_count, 1)
+            self.assertEqual(fsync.call_count, 2)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write('{"type": "result", "instr')
+
+            with self.assertLogs("result_log", "WARNING"):
+                records = result_log.read_records(path)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(result_log.fold_results(records)[("a", "v1")],
+                         {"metrics": {"x": 1, "y": 2}})
+
+    def test_run_logs_pairs_and_snapshots_at_end(self):
+        """Each pair is logged once; snapshots are written only at the end."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, scoring_workers=2) as evaluator:
+                use_mock_transport(evaluator)
+                with mock.patch.object(evaluator, "_save_results",
+                                       wraps=evaluator._save_results) as save:
+                    evaluator.run_evaluation()
+                self.assertEqual(save.call_count, 1)
+
+            log_file = os.path.join(tmp, "runs", f"{evaluator.run_id}.jsonl")
+            with open(log_file, encoding="utf-8") as f:
+                types = [json.loads(line)["type"] for line in f]
+            with make_evaluator(tmp, snapshot_log="latest", api_key_v1=None,
+                                api_key_v2=None) as restored:
+                restored.snapshot("latest")
+
+        self.assertEqual(types[0], "run")
+        self.assertEqual(types.count("result"), 2 * len(evaluator.results))
+        self.assertEqual(restored.run_id, evaluator.run_id)
+        self.assertEqual(restored.results, evaluator.results)
+
+    def test_resume_only_redoes_unfinished_pairs(self):
+        """A resumed run calls the agents only for failed or missing pairs."""
+        calls = []
+
+        def flaky(request):
+            calls.append(request.url.host)
+            if request.url.host == "api.groq.com":
+                return httpx.Response(401, json={"error": "bad key"})
+            return fake_agent_response(request)
+
+        def record(request):
+            calls.append(request.url.host)
+            return fake_agent_response(request)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp) as first:
+                use_mock_transport(first, flaky)
+                first.run_evaluation()
+            # Drop the last instruction's results, as if the run had been
+            # interrupted before it.
+            log_file = os.path.join(tmp, "runs", f"{first.run_id}.jsonl")
+            with open(log_file, encoding="utf-8") as f:
+                lines = f.readlines()
+            last_id = first.instructions[-1]["id"]
+            with open(log_file, "w", encoding="utf-8") as f:
+                f.writelines(line for line in lines
+                             if last_id not in line)
+            calls.clear()
+
+            with make_evaluator(tmp, resume_run=first.run_id) as resumed:
+                use_mock_transport(resumed, record)
+                resumed.run_evaluation()
+
+        total = len(first.instructions)
+        self.assertEqual(calls.count("api.groq.com"), total)
+        self.assertEqual(len(calls), total + 1)
+        self.assertEqual(resumed.run_id, first.run_id)
+        self.assertTrue(all(r["v1_success"] and r["v2_success"]
+                            for r in resumed.results))
+        self.assertEqual(resumed.results[0]["v1_metrics"],
+                         first.results[0]["v1_metrics"])
+
+    def test_resume_scores_and_logs_only_missing_metrics(self):
+        """Metrics added on resume are scored once and logged."""
+        import metric_registry
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, metrics="jaccard") as first:
+                use_mock_transport(first)
+                first.run_evaluation()
+
+            score = mock.Mock(wraps=metric_registry.score_response)
+            with mock.patch("metric_registry.score_response", score):
+                for _ in range(2):
+                    with make_evaluator(tmp, metrics="jaccard,bleu",
+                                        resume_run=first.run_id) as resumed:
+                        use_mock_transport(resumed)
+                        resumed.run_evaluation()
+
+            with open(os.path.join(tmp, "runs", f"{first.run_id}.jsonl"),
+                      encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+
+        pairs = 2 * len(first.instructions)
+        # Only the first resume scores, and only the new metric.
+        self.assertEqual(score.call_count, pairs)
+        self.assertTrue(all(call.args[0] == ("bleu",)
+                            for call in score.call_args_list))
+        logged = [r for r in records if r["type"] == "metrics"]
+        self.assertEqual(len(logged), pairs)
+        self.assertTrue(all(set(r["metrics"]) == {"bleu_score"}
+                            for r in logged))
+        self.assertIn("bleu_score", resumed.results[0]["v1_metrics"])
+
+
+class TestResultStore(unittest.TestCase):
+    """Test cases for the SQLite store of all runs."""
+
+    def test_runs_accumulate_and_report_history(self):
+        """Every run is kept once, and the report compares them."""
+        import result_store
+
+        def groq_down(request):
+            if request.url.host == "api.groq.com":
+                return httpx.Response(401, json={"error": "bad key"})
+            return fake_agent_response(request)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            run_ids = []
+            for transport in (fake_agent_response, groq_down):
+                with make_evaluator(tmp, metrics="none") as evaluator:
+                    use_mock_transport(evaluator, transport)
+                    evaluator.run_evaluation()
+                    # Saving again replaces the run instead of adding to it.
+                    evaluator._save_results()
+                    evaluator.generate_report()
+                run_ids.append(evaluator.run_id)
+            with open(os.path.join(tmp, "evaluation_report.md"),
+                      encoding="utf-8") as f:
+                report = f.read()
+            with result_store.ResultStore(
+                    os.path.join(tmp, "evaluation.db")) as store:
+                summary = store.run_summary()
+                by_type = store.metric_by_group("response_time", limit=1)
+
+        total = len(evaluator.results)
+        self.assertEqual(
+            [(run, agent, count, successes)
+             for run, _, agent, count, successes, _ in summary],
+            [(run_ids[0], "v1", total, total), (run_ids[0], "v2", total, total),
+             (run_ids[1], "v1", total, total), (run_ids[1], "v2", total, 0)]
+        )
+        types = {instruction["type"] for instruction in evaluator.instructions}
+        self.assertEqual({row[2] for row in by_type}, types)
+        self.assertTrue(all(row[0] == run_ids[1] for row in by_type))
+        self.assertIn("## 📉 Run History", report)
+        self.assertIn(f"| {run_ids[1]} (this run) |", report)
+        self.assertIn("| 100.0% | 0.0% |", report)
+
+
+class TestColumnarExport(unittest.TestCase):
+    """Test cases for the columnar export of results."""
+
+    def test_run_exports_typed_memory_mapped_columns(self):
+        """Each agent's results load back typed and memory-mapped."""
+        import numpy as np
+
+        import columnar_export
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, export_format="npz") as evaluator:
+                use_mock_transport(evaluator)
+                evaluator.run_evaluation()
+            root = os.path.join(tmp, "columnar")
+            parts = columnar_export.partitions(root)
+            mapped = columnar_export.read_partition(parts[0][2])
+            self.assertIsInstance(mapped["response_time"], np.memmap)
+            self.assertEqual(mapped["response_time"].dtype, np.float64)
+            self.assertEqual(mapped["success"].dtype, np.bool_)
+            self.assertEqual(mapped["instruction_type"].dtype.kind, "U")
+            loaded = columnar_export.load(
+                root, columns=["instruction_id", "success", "jaccard_similarity"],
+                since=evaluator.run_id[:8]
+            )
+
+        total = len(evaluator.results)
+        self.assertEqual([part[:2] for part in parts],
+                         [(evaluator.run_id, "v1"), (evaluator.run_id, "v2")])
+        self.assertEqual(list(loaded["agent"]), ["v1"] * total + ["v2"] * total)
+        self.assertTrue(loaded["success"].all())
+        np.testing.assert_allclose(
+            loaded["jaccard_similarity"][:total],
+            [r["v1_metrics"]["jaccard_similarity"] for r in evaluator.results]
+        )
+
+    def test_load_fills_columns_a_partition_lacks(self):
+        """Rows of a partition without a requested column are kept."""
+        import numpy as np
+
+        import columnar_export
+
+        with tempfile.TemporaryDirectory() as tmp:
+            columnar_export.export_partition(
+                tmp, "run-a", "v1", {"a": np.arange(3.0)}, "npz")
+            columnar_export.export_partition(
+                tmp, "run-b", "v1", {"b": np.arange(2.0)}, "npz")
+            loaded = columnar_export.load(tmp, columns=["b"])
+            scanned = list(columnar_export.scan(tmp, columns=["b"]))
+
+        self.assertEqual(list(loaded["run_id"]), ["run-a"] * 3 + ["run-b"] * 2)
+        np.testing.assert_array_equal(loaded["b"], [np.nan] * 3 + [0.0, 1.0])
+        self.assertEqual([(run, part.keys()) for run, _, part in scanned],
+                         [("run-a", set()), ("run-b", {"b"})])
+        self.assertIsInstance(scanned[1][2]["b"], np.memmap)
+
+    def test_failed_export_still_stores_results(self):
+        """An export error is logged; the database is still written."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, export_format="npz") as evaluator:
+                use_mock_transport(evaluator)
+                with mock.patch("columnar_export.export_partition",
+                                side_effect=OSError("disk full")):
+                    evaluator.run_evaluation()
+            self.assertTrue(os.path.exists(os.path.join(tmp,
+                                                        "evaluation.db")))
+
+    def test_invalid_export_format_is_rejected_at_startup(self):
+        """Unknown formats, also from the environment, fail before a run."""
+        with mock.patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                evaluate_agents.parse_args(["--export", "csv"])
+            with mock.patch.dict(evaluate_agents.CONFIG,
+                                 export_format="csv"):
+                with self.assertRaises(SystemExit):
+                    evaluate_agents.parse_args([])
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            with self.assertRaises(ValueError):
+                evaluate_agents._check_export_format("parquet")
+
+
+class TestResultTable(unittest.TestCase):
+    """Test cases for the columnar result table the report reads."""
+
+    def test_table_aggregates_like_the_result_dicts(self):
+        """Means skip missing values, and text fields become codes."""
+        import result_table
+
+        results = [
+            {"instruction_id": "b", "instruction_type": "bug_fix",
+             "difficulty": "easy", "v1_success": True, "v2_success": False,
+             "v1_metrics": {"response_time": 1.0, "execution_status": "passed"},
+             "v2_metrics": {"response_time": 3.0},
+             "v1_timings": {"attempts": 2, "wait": 0.5,
+                            "phases": [{"total": 1.0}, {"total": 2.0}]}},
+            {"instruction_id": "a", "instruction_type": "code_review",
+             "difficulty": "easy", "v1_success": True, "v2_success": True,
+             "v1_metrics": {"response_time": 2.0, "rouge_l": 0.5,
+                            "execution_status": "failed"},
+             "v2_metrics": {}},
+        ]
+        table = result_table.ResultTable.from_results(
+            results, evaluate_agents.AgentEvaluator._summarize_timings
+        )
+
+        self.assertEqual(table.success_count("v1"), 2)
+        self.assertEqual(table.means(["response_time", "rouge_l"],
+                                     "v1").tolist(), [1.5, 0.5])
+        self.assertEqual(table.mean("response_time", "v2"), 3.0)
+        self.assertEqual(table.mean("rouge_l", "v2"), 0.0)
+        self.assertTrue(table.has("execution_status"))
+        self.assertEqual(table.label_counts("execution_status", "v1"),
+                         {"failed": 1, "passed": 1})
+        self.assertEqual(table.fields["instruction_type"].decode(),
+                         ["bug_fix", "code_review"])
+        self.assertEqual(table.fields["difficulty"].codes.dtype.itemsize, 1)
+        self.assertEqual(table.timing_means(["attempts", "phase_total"],
+                                            "v1").tolist(), [2.0, 3.0])
+        self.assertEqual(table.sort_order().tolist(), [1, 0])
+        self.assertEqual(
+            {group: values.tolist() for group, values in
+             table.grouped_values("response_time", "v1",
+                                  "instruction_type").items()},
+            {"bug_fix": [1.0], "code_review": [2.0]}
+        )
+
+    def test_table_rebuilds_the_rows_it_was_given(self):
+        """Rows come back equal, key order and value types included."""
+        import result_table
+
+        results = [
+            {"instruction_id": "a", "instruction_type": "bug_fix",
+             "difficulty": None, "prompt_hash": "ab" * 32,
+             "v1_model": "gemini-pro", "v2_model": "llama",
+             "v1_response": "text", "v2_response": None,
+             "v1_success": True, "v2_success": False,
+             "v1_metrics": {"response_time": 1.5, "prompt_tokens": 12,
+                            "execution_passed": True,
+                            "execution_status": "passed"},
+             "v2_metrics": {},
+             "v1_timings": {"attempts": 2, "wait": 0.5,
+                            "phases": [{"total": 1.0}, {"total": 2.0}]},
+             "v2_timings": {}},
+            {"instruction_id": "b", "instruction_type": "bug_fix",
+             "difficulty": "hard", "prompt_hash": None,
+             "v1_model": "gemini-pro", "v2_model": "llama",
+             "v1_response": None, "v2_response": "other",
+             "v1_success": False, "v2_success": True,
+             "v1_metrics": {"execution_status": 3},
+             "v2_metrics": {"response_time": 2.0},
+             "v1_timings": {}, "v2_timings": {"attempts": 1, "wait": 0.0}},
+        ]
+        table = result_table.ResultTable.from_results(results)
+        rebuilt = list(table.iter_dicts())
+
+        self.assertEqual(rebuilt, results)
+        self.assertEqual([list(row) for row in rebuilt],
+                         [list(row) for row in results])
+        self.assertEqual(
+            [type(value) for value in rebuilt[0]["v1_metrics"].values()],
+            [float, int, bool, str]
+        )
+
+        table.update_metrics(table.row_of("b"), "v2", {"bleu_score": 0.25})
+        self.assertEqual(table.to_dict(1)["v2_metrics"],
+                         {"response_time": 2.0, "bleu_score": 0.25})
+        self.assertEqual(table.to_dict(0)["v2_metrics"], {})
+
+    def test_table_takes_less_memory_than_the_rows(self):
+        """Holding results as arrays costs a fraction of the dicts."""
+        import hashlib
+        import tracemalloc
+
+        import result_table
+
+        def row(i):
+            result = {
+                "instruction_id": f"instruction-{i}",
+                "instruction_type": ("bug_fix", "code_review")[i % 2],
+                "difficulty": ("easy", "medium", "hard")[i % 3],
+                "prompt_hash": hashlib.sha256(b"%d" % i).hexdigest(),
+                "v1_model": "gemini-pro", "v2_model": "llama",
+                "v1_response": None, "v2_response": None,
+                "v1_success": True, "v2_success": i % 4 != 0,
+            }
+            for version in evaluate_agents.AGENT_VERSIONS:
+                result[f"{version}_metrics"] = {
+                    "response_time": i / 7, "jaccard_similarity": i / 11,
+                    "bleu_score": i / 13, "prompt_tokens": i,
+                    "execution_status": "passed",
+                }
+                result[f"{version}_timings"] = {
+                    "attempts": 1, "wait": 0.0,
+                    "phases": [{"connect": i / 17, "total": i / 19}],
+                }
+            return result
+
+        def allocated(build):
+            tracemalloc.start()
+            try:
+                kept = build()
+                return tracemalloc.get_traced_memory()[0], kept
+            finally:
+                tracemalloc.stop()
+
+        as_dicts, _ = allocated(lambda: [row(i) for i in range(2000)])
+        as_table, _ = allocated(lambda: result_table.ResultTable.from_results(
+            (row(i) for i in range(2000)),
+            evaluate_agents.AgentEvaluator._summarize_timings
+        ))
+
+        self.assertLess(3 * as_table, as_dicts)
+
+    def test_table_takes_scores_added_after_the_row(self):
+        """Scores merged after a row was stored reach the averages."""
+        with tempfile.TemporaryDirectory() as tmp:
+            with make_evaluator(tmp, metrics="jaccard") as evaluator:
+                use_mock_transport(evaluator)
+                evaluator.run_evaluation()
+                self.assertFalse(evaluator._has_metric("bleu_score"))
+                metrics = evaluator.results[0]["v1_metrics"]
+                evaluator._submit_scoring(metrics, "other words",
+                                          evaluator.instructions[0], "v1",
+                                          ("bleu",))
+
+        self.assertTrue(evaluator._has_metric("bleu_score"))
+        self.assertEqual(evaluator._calculate_average_metric("bleu_score",
+                                                             "v1"),
+                         metrics["bleu_score"])
+
+
+class TestMockAgentServer(unittest.TestCase):
+    """Test cases running the evaluator against the local mock server."""
+
+    def _run(self, settings, **overrides):
+        import mock_agent_server
+
+        server = mock_agent_server.start_server(settings)
+        base = "http://127.0.0.1:%d" % server.server_address[1]
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                with make_evaluator(
+                        tmp,
+                        agent_v1_endpoint=base + "/v1beta/models/"
+                        "gemini-pro:generateContent",
+                        agent_v2_chat_url=base + "/openai/v1/chat/completions",
+                        **overrides) as evaluator:
+                    evaluator.run_evaluation()
+            return evaluator, dict(server.stats)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_evaluator_parses_both_providers(self):
+        """Gemini- and Groq-shaped responses are scored successfully."""
+        import mock_agent_server
+
+        evaluator, stats = self._run(mock_agent_server.MockSettings())
+        n = len(evaluator.instructions)
+        self.assertEqual(stats["requests"], 2 * n)
+        self.assertTrue(all(r["v1_success"] and r["v2_success"]
+                            for r in evaluator.results))
+
+    def test_injected_faults_are_retried(self):
+        """Injected 429/503 responses are retried until they succeed."""
+        import mock_agent_server
+
+        settings = mock_agent_server.MockSettings(
+            rate_429=0.2, rate_5xx=0.2, retry_after=0.01, seed=7
+        )
+        evaluator, stats = self._run(settings, concurrency=4, max_retries=10)
+        self.assertGreater(stats["429"] + stats["503"], 0)
+        self.assertTrue(all(r["v1_success"] and r["v2_success"]
+                            for r in evaluator.results))
+
+    def test_token_usage_is_recorded(self):
+        """Provider usage fields become token counts and throughput."""
+        import mock_agent_server
+
+        evaluator, _ = self._run(mock_agent_server.MockSettings(tokens=12))
+        for result in evaluator.results:
+            for version in evaluate_agents.AGENT_VERSIONS:
+                metrics = result[f"{version}_metrics"]
+                self.assertGreater(metrics["prompt_tokens"], 0)
+                self.assertEqual(metrics["completion_tokens"], 12)
+                self.assertAlmostEqual(
+                    metrics["tokens_per_second"]
+                    * metrics["latency_per_output_token"], 1.0
+                )
+
+    def test_timings_cover_every_attempt(self):
+        """Each attempt gets phase timings; retries are counted."""
+        import mock_agent_server
+
+        settings = mock_agent_server.MockSettings(rate_5xx=0.3, seed=3)
+        evaluator, stats = self._run(settings, max_retries=10)
+        timings = [result[f"{version}_timings"]
+                   for result in evaluator.results
+                   for version in evaluate_agents.AGENT_VERSIONS]
+        self.assertEqual(sum(t["attempts"] for t in timings),
+                         stats["requests"])
+        for t in timings:
+            self.assertEqual(len(t["phases"]), t["attempts"])
+            for phases in t["phases"]:
+                self.assertIn("ttfb", phases)
+                self.assertGreaterEqual(phases["total"], phases["ttfb"])
+        # Pooled clients only connect once per agent.
+        self.assertEqual(
+            sum("connect" in phases
+                for t in timings for phases in t["phases"]), 2
+        )
+
+    def test_streaming_records_token_latencies(self):
+        """Streamed responses are reassembled and timed per token."""
+        import mock_agent_server
+
+        settings = mock_agent_server.MockSettings(token_delay=0.001)
+        for concurrency in (1, 2):
+            evaluator, stats = self._run(settings, stream=True,
+                                         concurrency=concurrency)
+            self.assertEqual(stats["streamed"], 2 * len(evaluator.instructions))
+            for result in evaluator.results:
+                for version in evaluate_agents.AGENT_VERSIONS:
+                    self.assertTrue(result[f"{version}_success"])
+                    metrics = result[f"{version}_metrics"]
+                    self.assertGreater(metrics["time_to_first_token"], 0)
+                    self.assertGreater(metrics["output_tokens_per_second"], 0)
+                    self.assertLessEqual(metrics["time_to_first_token"],
+                                         metrics["response_time"])
+
+    def test_recorded_stream_replays_at_its_pace(self):
+        """Recording passes chunks through; replay keeps their timing."""
+        import mock_agent_server
+
+        def first_token_share(evaluator):
+            return max(result[f"{version}_metrics"]["time_to_first_token"]
+                       / result[f"{version}_metrics"]["response_time"]
+                       for result in evaluator.results
+                       for version in evaluate_agents.AGENT_VERSIONS)
+
+        settings = mock_agent_server.MockSettings(token_delay=0.002)
+        with tempfile.TemporaryDirectory() as tmp:
+            cassette_file = os.path.join(tmp, "stream.jsonl")
+            recorder, _ = self._run(settings, stream=True,
+                                    cassette_mode="record",
+                                    cassette_file=cassette_file)
+            with make_evaluator(
+                    tmp, stream=True, cassette_mode="replay",
+                    cassette_file=cassette_file,
+                    agent_v1_endpoint=recorder.config["agent_v1_endpoint"],
+                    agent_v2_chat_url=recorder.config["agent_v2_chat_url"]
+            ) as replayer:
+                replayer.run_evaluation()
+
+        self.assertLess(first_token_share(recorder), 0.5)
+        self.assertLess(first_token_share(replayer), 0.5)
+        self.assertEqual(
+            [r["v1_response"] for r in replayer.results],
+            [r["v1_response"] for r in recorder.results]
+        )
+
+    def test_inter_token_latency_spreads_chunks_over_tokens(self):
+        """Multi-token chunks divide their gap by the tokens they carry."""
+        clock = iter([1.0, 1.5, 2.5])
+        with mock.patch.object(evaluate_agents.time, "perf_counter",
+                               lambda: next(clock)):
+            stream = evaluate_agents.StreamAccumulator("v1", start=0.0)
+            for text, usage in (("ab", None), ("cdefgh", 8)):
+                chunk = {"candidates": [{"content": {"parts": [
+                    {"text": text}]}}]}
+                if usage:
+                    chunk["usageMetadata"] = {"candidatesTokenCount": usage}
+                stream.feed("data: " + json.dumps(chunk))
+            metrics = stream.finish().metrics
+        # Six of the eight tokens arrived over the 0.5 s after the first.
+        self.assertAlmostEqual(metrics["inter_token_latency"], 0.5 / 6)
+        self.assertEqual(metrics["time_to_first_token"], 1.0)
+
+
 if __name__ == "__main__":
     unittest.main()
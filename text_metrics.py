@@ -0,0 +1,529 @@
+"""
+Batch text-similarity metrics.
+
+Scores many (response, expected) pairs at once: every text is tokenized
+once into `TextFeatures` (which can be precomputed and stored, see
+`expected_index`), n-grams of all texts are mapped to shared integer ids,
+and the overlap counts behind Jaccard, BLEU and ROUGE-N are computed for
+the whole batch with NumPy set operations instead of per-pair Python
+loops.
+
+The scores reproduce the libraries the evaluator used before:
+- `jaccard_similarity`: sets of lower-cased whitespace tokens.
+- `bleu_score`: NLTK `sentence_bleu` with uniform weights over 1- to
+  4-grams and `SmoothingFunction().method4`.
+- `rouge_1`/`rouge_2`: F-scores of the `rouge` package, which splits
+  sentences on "." and compares sets of n-grams.
+- `rouge_l`: the package's summary-level ROUGE-L, the union of the words
+  on the LCS of every reference/response sentence pair. The LCS is
+  computed bit-parallel (one machine word covers 64 columns) instead of
+  with the package's full O(n*m) table, and traced back the same way so
+  the same words are picked when several LCSs exist.
+- `gleu_score` (not computed by default): NLTK `sentence_gleu`, imported
+  only when the metric is used.
+
+Texts containing CJK characters are the exception: `analyze` splits
+them into one token per character, where whitespace splitting would turn
+a whole Japanese sentence into a single token.
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import (Any, Callable, Dict, FrozenSet, Hashable, List, Mapping,
+                    Sequence, Set, Tuple)
+
+import numpy as np
+
+BLEU_MAX_ORDER = 4
+# Constant of NLTK's smoothing method 4.
+BLEU_SMOOTHING_K = 5
+ROUGE_N_ORDERS = (1, 2)
+
+
+@dataclass
+class TextFeatures:
+    """The tokenizations of one text that the metrics are computed from."""
+
+    length: int
+    # Whitespace tokens, as BLEU sees them.
+    tokens: Tuple[str, ...]
+    # Lower-cased vocabulary, as Jaccard sees it.
+    vocab: FrozenSet[str]
+    # Words of each "."-separated sentence, as ROUGE sees them.
+    sentences: Tuple[Tuple[str, ...], ...]
+    # (metric, n) -> n-gram counts, filled on first use.
+    ngrams: Dict[Tuple[str, int], Dict[Tuple[str, ...], int]] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+
+    @property
+    def rouge_tokens(self) -> List[str]:
+        return [word for sentence in self.sentences for word in sentence]
+
+    def ngram_counts(self, metric: str, n: int) -> Dict[Tuple[str, ...], int]:
+        """Return the n-gram counts of the "bleu" or "rouge" tokens."""
+        key = (metric, n)
+        if key not in self.ngrams:
+            tokens = self.tokens if metric == "bleu" else self.rouge_tokens
+            self.ngrams[key] = Counter(_ngrams(tokens, n))
+        return self.ngrams[key]
+
+    def precompute(self) -> "TextFeatures":
+        """Fill in the n-gram counts of every metric."""
+        for n in range(1, BLEU_MAX_ORDER + 1):
+            self.ngram_counts("bleu", n)
+        for n in ROUGE_N_ORDERS:
+            self.ngram_counts("rouge", n)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serializable form of the features."""
+        return {
+            "length": self.length,
+            "tokens": list(self.tokens),
+            "vocab": sorted(self.vocab),
+            "sentences": [list(sentence) for sentence in self.sentences],
+            "ngrams": [
+                [metric, n, [[list(gram), count]
+                             for gram, count in counts.items()]]
+                for (metric, n), counts in self.ngrams.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TextFeatures":
+        return cls(
+            length=data["length"],
+            tokens=tuple(data["tokens"]),
+            vocab=frozenset(data["vocab"]),
+            sentences=tuple(tuple(sentence)
+                            for sentence in data["sentences"]),
+            ngrams={
+                (metric, n): {tuple(gram): count for gram, count in counts}
+                for metric, n, counts in data.get("ngrams", [])
+            },
+        )
+
+
+# Characters of scripts written without spaces (Japanese kana, CJK
+# ideographs, CJK and full-width punctuation); each one is a token.
+_CJK_CHARS = (
+    "\u3001\u3003-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff"
+    "\uf900-\ufaff\uff02-\uff1e\uff20-\uff60\uff66-\uff9f"
+    "\U00020000-\U0002fa1f"
+)
+# Full stops that end a sentence: "." and its CJK forms 。！？
+_STOPS = "\u3002\uff01\uff1f"
+_CJK = re.compile(f"[{_STOPS}{_CJK_CHARS}]")
+_PIECES = re.compile(
+    rf"(?P<space>\s+)|(?P<dot>\.)|(?P<stop>[{_STOPS}])"
+    rf"|(?P<cjk>[{_CJK_CHARS}])|(?P<word>[^\s.{_STOPS}{_CJK_CHARS}]+)"
+)
+
+
+def analyze(text: str) -> TextFeatures:
+    """
+    Tokenize `text` for all metrics in a single scan.
+
+    Text without CJK characters is tokenized exactly as before: tokens
+    and vocabulary by whitespace, ROUGE sentences by "." as in the rouge
+    package. CJK characters become one token each, so the n-grams of
+    Japanese text are character n-grams, and 。！？ also end a sentence.
+    """
+    if _CJK.search(text) is None:
+        # Same result as the scan below, using the built-in splitting.
+        tokens = text.split()
+        return _features(text, tokens, [
+            tuple(" ".join(fragment.split()).split(" "))
+            for fragment in text.split(".") if fragment
+        ])
+
+    tokens = []
+    sentences: List[Tuple[str, ...]] = []
+    token: List[str] = []
+    words: List[str] = []
+    # The rouge package keeps every non-empty "."-separated fragment;
+    # a fragment of only whitespace becomes a single empty word.
+    fragment = False
+
+    def end_token() -> None:
+        if token:
+            tokens.append("".join(token))
+            token.clear()
+
+    def end_sentence() -> None:
+        nonlocal fragment
+        if fragment:
+            sentences.append(tuple(words) or ("",))
+        words.clear()
+        fragment = False
+
+    for match in _PIECES.finditer(text):
+        kind, piece = match.lastgroup, match.group()
+        if kind == "space":
+            end_token()
+            fragment = True
+        elif kind == "dot":
+            token.append(piece)
+            end_sentence()
+        elif kind == "word":
+            token.append(piece)
+            words.append(piece)
+            fragment = True
+        else:  # a CJK character or full stop is a token of its own
+            end_token()
+            tokens.append(piece)
+            if kind == "stop":
+                end_sentence()
+            else:
+                words.append(piece)
+                fragment = True
+    end_token()
+    end_sentence()
+    return _features(text, tokens, sentences)
+
+
+def _features(text: str, tokens: List[str],
+              sentences: List[Tuple[str, ...]]) -> TextFeatures:
+    return TextFeatures(
+        length=len(text),
+        tokens=tuple(tokens),
+        vocab=frozenset(token.lower() for token in tokens),
+        sentences=tuple(sentences),
+    ).precompute()
+
+
+def _ngrams(tokens: Sequence[str], n: int):
+    return zip(*(tokens[i:] for i in range(n)))
+
+
+def _encode(counters: Sequence[Mapping[Hashable, int]],
+            ids: Dict[Hashable, int]) -> Tuple[np.ndarray, ...]:
+    """Return (row, n-gram id, count) arrays over all counters."""
+    rows: List[int] = []
+    cols: List[int] = []
+    counts: List[int] = []
+    for row, counter in enumerate(counters):
+        rows.extend([row] * len(counter))
+        cols.extend([ids.setdefault(gram, len(ids)) for gram in counter])
+        counts.extend(counter.values())
+    return (np.asarray(rows, dtype=np.int64),
+            np.asarray(cols, dtype=np.int64),
+            np.asarray(counts, dtype=np.int64))
+
+
+def _overlap(hyps: Sequence[Mapping[Hashable, int]],
+             refs: Sequence[Mapping[Hashable, int]],
+             clip: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count the n-grams shared by each hypothesis and its reference.
+
+    With `clip`, n-grams are multisets and matches are clipped to the
+    reference count (BLEU); otherwise they are sets (ROUGE, Jaccard).
+
+    Returns:
+        Per-pair arrays of (matches, hypothesis n-grams, reference n-grams).
+    """
+    size = len(hyps)
+    ids: Dict[Hashable, int] = {}
+    hyp_rows, hyp_cols, hyp_counts = _encode(hyps, ids)
+    ref_rows, ref_cols, ref_counts = _encode(refs, ids)
+    width = max(len(ids), 1)
+
+    # Each (row, n-gram) key is unique within a side.
+    hyp_keys = hyp_rows * width + hyp_cols
+    ref_keys = ref_rows * width + ref_cols
+    common, hyp_index, ref_index = np.intersect1d(
+        hyp_keys, ref_keys, assume_unique=True, return_indices=True
+    )
+    if clip:
+        shared = np.minimum(hyp_counts[hyp_index], ref_counts[ref_index])
+    else:
+        shared = None
+        hyp_counts = ref_counts = None
+
+    def per_row(keys, weights):
+        return np.bincount(keys // width, weights=weights, minlength=size)
+
+    return (per_row(common, shared), per_row(hyp_keys, hyp_counts),
+            per_row(ref_keys, ref_counts))
+
+
+def _f_score(matches: np.ndarray, hyp_total: np.ndarray,
+             ref_total: np.ndarray) -> np.ndarray:
+    """F1 the way the rouge package computes it, epsilon included."""
+    precision = np.divide(matches, hyp_total, out=np.zeros(len(matches)),
+                          where=hyp_total > 0)
+    recall = np.divide(matches, ref_total, out=np.zeros(len(matches)),
+                       where=ref_total > 0)
+    return 2.0 * (precision * recall) / (precision + recall + 1e-8)
+
+
+def _jaccard(hyps: Sequence[TextFeatures],
+             refs: Sequence[TextFeatures]) -> np.ndarray:
+    matches, hyp_total, ref_total = _overlap(
+        [dict.fromkeys(h.vocab, 1) for h in hyps],
+        [dict.fromkeys(r.vocab, 1) for r in refs], clip=False
+    )
+    union = hyp_total + ref_total - matches
+    return np.divide(matches, union, out=np.zeros(len(hyps)),
+                     where=union > 0)
+
+
+def _bleu(hyps: Sequence[TextFeatures],
+          refs: Sequence[TextFeatures]) -> np.ndarray:
+    hyp_len = np.array([len(h.tokens) for h in hyps], dtype=float)
+    ref_len = np.array([len(r.tokens) for r in refs], dtype=float)
+
+    numerators = np.empty((len(hyps), BLEU_MAX_ORDER))
+    denominators = np.empty((len(hyps), BLEU_MAX_ORDER))
+    for order in range(1, BLEU_MAX_ORDER + 1):
+        matches, hyp_total, _ = _overlap(
+            [h.ngram_counts("bleu", order) for h in hyps],
+            [r.ngram_counts("bleu", order) for r in refs], clip=True
+        )
+        numerators[:, order - 1] = matches
+        denominators[:, order - 1] = np.maximum(hyp_total, 1)
+
+    # Method 4: the k-th order without matches gets a pseudo-count of
+    # 1 / (2**k * K / ln(hyp_len)), for hypotheses longer than one token.
+    smoothed = (numerators == 0) & (hyp_len > 1)[:, None]
+    increments = np.cumsum(smoothed, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_len = np.log(hyp_len)[:, None]
+        pseudo = 1 / (2.0 ** increments * BLEU_SMOOTHING_K / log_len)
+        precisions = np.where(smoothed, pseudo, numerators) / denominators
+        log_sum = np.where(precisions > 0, np.log(precisions), 0.0).sum(
+            axis=1
+        ) / BLEU_MAX_ORDER
+        brevity = np.where(
+            hyp_len > ref_len, 1.0,
+            np.where(hyp_len == 0, 0.0, np.exp(1 - ref_len / hyp_len))
+        )
+    return np.where(numerators[:, 0] == 0, 0.0, brevity * np.exp(log_sum))
+
+
+def _rouge_n(hyps: Sequence[TextFeatures], refs: Sequence[TextFeatures],
+             n: int) -> np.ndarray:
+    matches, hyp_total, ref_total = _overlap(
+        [h.ngram_counts("rouge", n) for h in hyps],
+        [r.ngram_counts("rouge", n) for r in refs], clip=False
+    )
+    return _f_score(matches, hyp_total, ref_total)
+
+
+def _match_masks(y: Sequence[str]) -> Dict[str, int]:
+    """Map each word of `y` to a bit mask of the positions it occurs at."""
+    masks: Dict[str, int] = {}
+    for j, word in enumerate(y):
+        masks[word] = masks.get(word, 0) | (1 << j)
+    return masks
+
+
+def _next_row(row: int, mask: int, full: int) -> int:
+    """
+    Advance one LCS table row (Allison-Dix / Hyyrö).
+
+    A row is stored as a bit vector whose zero bits mark the columns where
+    the LCS length grows, so L[i][j] = j - popcount(row & (2**j - 1)).
+    """
+    matches = row & mask
+    return ((row + matches) | (row - matches)) & full
+
+
+def lcs_length(x: Sequence[str], y: Sequence[str]) -> int:
+    """Length of the longest common subsequence in O(len(y)) bits."""
+    full = (1 << len(y)) - 1
+    masks = _match_masks(y)
+    row = full
+    for word in x:
+        row = _next_row(row, masks.get(word, 0), full)
+    return len(y) - row.bit_count()
+
+
+def lcs_words(x: Sequence[str], y: Sequence[str]) -> Set[str]:
+    """
+    Return the words on the LCS of `x` and `y`.
+
+    The traceback starts at the end and prefers a diagonal match, then
+    moving up only if that keeps a strictly longer LCS, exactly as the
+    rouge package does. Rows are checkpointed every sqrt(len(x)) and
+    recomputed block by block during the traceback, so memory is
+    O(sqrt(len(x)) * len(y)) bits rather than a full table.
+    """
+    n, m = len(x), len(y)
+    if not n or not m:
+        return set()
+    full = (1 << m) - 1
+    masks = _match_masks(y)
+    step = max(1, math.isqrt(n))
+    checkpoints = {0: full}
+    row = full
+    for i, word in enumerate(x, 1):
+        row = _next_row(row, masks.get(word, 0), full)
+        if i % step == 0:
+            checkpoints[i] = row
+
+    def block(base: int) -> List[int]:
+        rows = [checkpoints[base]]
+        for word in x[base:min(base + step, n)]:
+            rows.append(_next_row(rows[-1], masks.get(word, 0), full))
+        return rows
+
+    def length(row_bits: int, j: int) -> int:
+        return j - (row_bits & ((1 << j) - 1)).bit_count()
+
+    words: Set[str] = set()
+    i, j = n, m
+    base, rows = -1, []
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.add(x[i - 1])
+            i -= 1
+            j -= 1
+            continue
+        # Rows i and i - 1 always fall into the same block.
+        if (i - 1) // step * step != base:
+            base = (i - 1) // step * step
+            rows = block(base)
+        if length(rows[i - 1 - base], j) > length(rows[i - base], j - 1):
+            i -= 1
+        else:
+            j -= 1
+    return words
+
+
+def rouge_l(hyp: TextFeatures, ref: TextFeatures) -> float:
+    """Summary-level ROUGE-L F-score of `hyp` against `ref`."""
+    if not (hyp.sentences and ref.sentences):
+        return 0.0
+    hyp_vocab = [set(sentence) for sentence in hyp.sentences]
+    union: Set[str] = set()
+    for ref_sentence in ref.sentences:
+        ref_vocab = set(ref_sentence)
+        for sentence, vocab in zip(hyp.sentences, hyp_vocab):
+            # Sentences without a common word have an empty LCS.
+            if not ref_vocab.isdisjoint(vocab):
+                union |= lcs_words(ref_sentence, sentence)
+    recall = len(union) / len(set(ref.rouge_tokens))
+    precision = len(union) / len(set(hyp.rouge_tokens))
+    return 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+
+
+# Scores a batch of (hypothesis, reference) pairs into named columns.
+Scorer = Callable[[Sequence[TextFeatures], Sequence[TextFeatures]],
+                  Dict[str, np.ndarray]]
+
+
+def _has_sentences(hyps: Sequence[TextFeatures],
+                   refs: Sequence[TextFeatures]) -> np.ndarray:
+    """Blank texts, or texts without any sentence, get ROUGE scores of 0."""
+    return np.array([
+        bool(h.tokens and r.tokens and h.sentences and r.sentences)
+        for h, r in zip(hyps, refs)
+    ], dtype=bool)
+
+
+def length_scores(hyps: Sequence[TextFeatures],
+                  refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    lengths = np.array([h.length for h in hyps], dtype=float)
+    expected_lengths = np.array([r.length for r in refs], dtype=float)
+    return {
+        "response_length": lengths,
+        "expected_length": expected_lengths,
+        "length_ratio": lengths / np.maximum(expected_lengths, 1),
+    }
+
+
+def jaccard_scores(hyps: Sequence[TextFeatures],
+                   refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    return {"jaccard_similarity": _jaccard(hyps, refs)}
+
+
+def bleu_scores(hyps: Sequence[TextFeatures],
+                refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    return {"bleu_score": _bleu(hyps, refs)}
+
+
+def rouge_1_scores(hyps: Sequence[TextFeatures],
+                   refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    return {"rouge_1": np.where(_has_sentences(hyps, refs),
+                                _rouge_n(hyps, refs, 1), 0.0)}
+
+
+def rouge_2_scores(hyps: Sequence[TextFeatures],
+                   refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    return {"rouge_2": np.where(_has_sentences(hyps, refs),
+                                _rouge_n(hyps, refs, 2), 0.0)}
+
+
+def rouge_l_scores(hyps: Sequence[TextFeatures],
+                   refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    return {"rouge_l": np.array([
+        rouge_l(h, r) if ok else 0.0
+        for h, r, ok in zip(hyps, refs, _has_sentences(hyps, refs))
+    ])}
+
+
+def gleu_scores(hyps: Sequence[TextFeatures],
+                refs: Sequence[TextFeatures]) -> Dict[str, np.ndarray]:
+    """NLTK's sentence-level Google-BLEU over the BLEU tokens."""
+    from nltk.translate.gleu_score import sentence_gleu
+
+    return {"gleu_score": np.array([
+        sentence_gleu([list(r.tokens)], list(h.tokens))
+        if h.tokens and r.tokens else 0.0
+        for h, r in zip(hyps, refs)
+    ])}
+
+
+# The metrics `score_features` computes; see `metric_registry` for
+# choosing a subset.
+SCORERS = (length_scores, jaccard_scores, bleu_scores, rouge_1_scores,
+           rouge_2_scores, rouge_l_scores)
+
+
+def score_features(hyps: Sequence[TextFeatures],
+                   refs: Sequence[TextFeatures],
+                   scorers: Sequence[Scorer] = SCORERS
+                   ) -> Dict[str, np.ndarray]:
+    """Score analyzed hypotheses against their references, pair by pair."""
+    if len(hyps) != len(refs):
+        raise ValueError("Need exactly one reference per hypothesis")
+    scores: Dict[str, np.ndarray] = {}
+    for scorer in scorers:
+        scores.update(scorer(hyps, refs))
+    return scores
+
+
+def score_rows(hyps: Sequence[TextFeatures],
+               refs: Sequence[TextFeatures],
+               scorers: Sequence[Scorer] = SCORERS
+               ) -> List[Dict[str, float]]:
+    """Like `score_features`, but return one metrics dict per pair."""
+    columns = score_features(hyps, refs, scorers)
+    rows = [{} for _ in hyps]
+    for name, values in columns.items():
+        for row, value in zip(rows, values.tolist()):
+            row[name] = value
+    for row in rows:
+        for name in ("response_length", "expected_length"):
+            if name in row:
+                row[name] = int(row[name])
+    return rows
+
+
+def score_response(response: str, expected: TextFeatures,
+                   scorers: Sequence[Scorer] = SCORERS) -> Dict[str, float]:
+    """Score one response against analyzed expected features."""
+    return score_rows([analyze(response)], [expected], scorers)[0]
+
+
+def score_pairs(responses: Sequence[str], expected: Sequence[str],
+                scorers: Sequence[Scorer] = SCORERS
+                ) -> List[Dict[str, float]]:
+    """Score each response against its expected response."""
+    return score_rows([analyze(text) for text in responses],
+                      [analyze(text) for text in expected], scorers)